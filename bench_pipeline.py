@@ -0,0 +1,255 @@
+"""End-to-end load benchmark for main.py against fake_llm_server.py.
+
+Starts the fake providers in a separate process, points the real Gemini and
+OpenAI clients at them and runs run_batch() for every combination of topic
+count and concurrency. Reports articles/minute, p50/p95 latency per stage and
+peak memory. No API keys or quota are used.
+
+    python bench_pipeline.py --topics 4,16 --concurrency 1,4,8 --writer-latency lognormal:1.0:0.4
+    python bench_pipeline.py --save results.json
+    python bench_pipeline.py --baseline results.json --tolerance 0.2   # exit 1 on a regression
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+from fake_llm_server import add_profile_arguments
+from tracing import percentile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("writer_ttft", "writer", "simulator", "step")
+
+
+class StageTimer:
+    """Collect per-stage latencies from the wrapped Writer and Simulator.
+
+    A step is measured from one Writer call to the next one for the same
+    article (each article runs in its own task), and the last step of an
+    article ends when its final Writer call does.
+    """
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self._step_start = {}
+        self._last_end = {}
+
+    def writer_started(self):
+        task = asyncio.current_task()
+        now = time.perf_counter()
+        if task in self._step_start:
+            self.samples["step"].append(now - self._step_start[task])
+        self._step_start[task] = now
+        return now
+
+    def writer_finished(self):
+        self._last_end[asyncio.current_task()] = time.perf_counter()
+
+    def close_steps(self):
+        for task, start in self._step_start.items():
+            if task in self._last_end:
+                self.samples["step"].append(self._last_end[task] - start)
+        self._step_start.clear()
+        self._last_end.clear()
+
+
+class TimedWriter:
+    def __init__(self, chain, timer):
+        self.chain = chain
+        self.timer = timer
+
+    async def astream(self, payload):
+        started = self.timer.writer_started()
+        first = True
+        try:
+            async for chunk in self.chain.astream(payload):
+                if first:
+                    self.timer.samples["writer_ttft"].append(time.perf_counter() - started)
+                    first = False
+                yield chunk
+        finally:
+            self.timer.samples["writer"].append(time.perf_counter() - started)
+            self.timer.writer_finished()
+
+
+class TimedSimulator:
+    def __init__(self, llm, timer):
+        self.llm = llm
+        self.timer = timer
+
+    async def ainvoke(self, payload):
+        started = time.perf_counter()
+        try:
+            return await self.llm.ainvoke(payload)
+        finally:
+            self.timer.samples["simulator"].append(time.perf_counter() - started)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def fake_server(args):
+    """Run fake_llm_server.py in a child process so it does not share our GIL."""
+    port = free_port()
+    command = [sys.executable, os.path.join(BASE_DIR, "fake_llm_server.py"), "--port", str(port)]
+    for name in ("writer_latency", "writer_tps", "writer_errors", "simulator_latency", "simulator_tps",
+                 "simulator_errors", "script", "seed"):
+        value = getattr(args, name)
+        if value not in (None, ""):
+            command += ["--" + name.replace("_", "-"), str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                urllib.request.urlopen(url + "/stats", timeout=1).read()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("fake_llm_server.py did not start")
+                time.sleep(0.05)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def server_stats(url):
+    with urllib.request.urlopen(url + "/stats", timeout=5) as response:
+        return json.load(response)
+
+
+def run_once(main_module, format_content, topics, concurrency, max_steps, output_dir):
+    """Run one batch and return its measurements."""
+    timer = StageTimer()
+    writer_chain, simulator_llm = main_module.build_chains(format_content)
+    writer_chain = TimedWriter(writer_chain, timer)
+    simulator_llm = TimedSimulator(simulator_llm, timer)
+    jobs = [(f"ベンチマーク用テーマ {i}", main_module.article_filename(f"bench {i}", i, output_dir))
+            for i in range(1, topics + 1)]
+
+    original_max_steps = main_module.MAX_STEPS
+    main_module.MAX_STEPS = max_steps
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(main_module.run_batch(jobs, writer_chain, simulator_llm, concurrency))
+    finally:
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        main_module.MAX_STEPS = original_max_steps
+    timer.close_steps()
+
+    failed = sum(isinstance(r, Exception) for r in results)
+    row = {
+        "topics": topics,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "failed": failed,
+        "articles_per_min": round((topics - failed) / wall * 60, 2) if wall else 0.0,
+        "peak_traced_mib": round(peak / 2 ** 20, 2),
+        "max_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    for stage in STAGES:
+        row[f"{stage}_p50"] = percentile(timer.samples[stage], 50)
+        row[f"{stage}_p95"] = percentile(timer.samples[stage], 95)
+    return row
+
+
+def format_row(row):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    stages = "  ".join(f"{ms(row[stage + '_p50']):>6}/{ms(row[stage + '_p95']):<6}" for stage in STAGES)
+    return (f"{row['topics']:>6} {row['concurrency']:>5} {row['articles_per_min']:>12.1f} {row['wall_s']:>8.2f}"
+            f" {row['failed']:>6}  {stages} {row['peak_traced_mib']:>9.1f} {row['max_rss_mib']:>8.1f}")
+
+
+HEADER = (f"{'topics':>6} {'conc':>5} {'articles/min':>12} {'wall_s':>8} {'failed':>6}  "
+          + "  ".join(f"{stage + ' ms':>13}" for stage in STAGES)
+          + f" {'peak MiB':>9} {'RSS MiB':>8}")
+
+
+def compare(rows, baseline, tolerance):
+    """Return the runs whose throughput fell more than tolerance below the baseline."""
+    previous = {(r["topics"], r["concurrency"]): r for r in baseline.get("runs", [])}
+    regressions = []
+    for row in rows:
+        old = previous.get((row["topics"], row["concurrency"]))
+        if old and row["articles_per_min"] < old["articles_per_min"] * (1 - tolerance):
+            regressions.append((row, old))
+    return regressions
+
+
+def parse_int_list(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark main.py end to end against the fake LLM server.")
+    parser.add_argument("--topics", type=parse_int_list, default=[4, 16], help="Comma-separated topic counts.")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 4, 8], help="Comma-separated concurrency levels.")
+    parser.add_argument("--max-steps", type=int, default=5, help="Writer/Simulator steps per article.")
+    parser.add_argument("--save", help="Write the results as JSON.")
+    parser.add_argument("--baseline", help="JSON from an earlier --save to compare articles/min against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop before failing (0.2 = 20%%).")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(BASE_DIR, "format.md"), "r", encoding="utf-8") as f:
+        format_content = f.read()
+
+    rows = []
+    with fake_server(args) as url:
+        # The SDKs read these themselves; the response cache must not answer for the server
+        os.environ["GOOGLE_GEMINI_BASE_URL"] = url
+        os.environ["OPENAI_BASE_URL"] = url + "/v1"
+        os.environ["GOOGLE_API_KEY"] = "fake"
+        os.environ["OPENAI_API_KEY"] = "fake"
+        import main as main_module
+
+        print(f"fake server: {url}")
+        print(HEADER)
+        for topics in args.topics:
+            for concurrency in args.concurrency:
+                with tempfile.TemporaryDirectory() as output_dir:
+                    row = run_once(main_module, format_content, topics, concurrency, args.max_steps, output_dir)
+                rows.append(row)
+                print(format_row(row), flush=True)
+        print(f"server requests: {server_stats(url)}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "argv": sys.argv[1:] if argv is None else argv, "runs": rows},
+                      f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(rows, json.load(f), args.tolerance)
+        for row, old in regressions:
+            print(f"REGRESSION topics={row['topics']} concurrency={row['concurrency']}: "
+                  f"{row['articles_per_min']:.1f} articles/min (baseline {old['articles_per_min']:.1f})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Startup benchmark: how long short commands take before doing any work.
+
+Each case runs in a fresh interpreter several times; the median wall time
+is reported with the modules that were imported. A case fails when it
+imports a heavy module (the LLM SDKs, Playwright) or when its median is over
+--max-ms.
+
+    python bench_startup.py
+    python bench_startup.py --runs 10 --max-ms 500   # exit 1 on a regression
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ("langchain_google_genai", "langchain_openai", "langchain_core", "openai", "playwright")
+
+# name -> code run with the repository (and human_assisted_flow for "flow") on sys.path
+CASES = {
+    "import main": "import main",
+    "import cli": "import cli",
+    "cli validate": "import cli, contextlib, io\nwith contextlib.redirect_stdout(io.StringIO()): cli.main(['validate'])",
+    "import flow main": "import os; os.chdir('human_assisted_flow'); import sys; sys.path.insert(0, '.'); import main",
+}
+PROBE = "\nimport json, sys\nprint(json.dumps(sorted(m for m in {heavy!r} if m in sys.modules)))"
+
+
+def run_case(code, runs):
+    """Median seconds over runs, and the heavy modules the code imported."""
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code + PROBE.format(heavy=HEAVY_MODULES)], cwd=BASE_DIR,
+                                capture_output=True, text=True, check=True)
+        timings.append(time.perf_counter() - started)
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return statistics.median(timings), loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the startup time of short commands.")
+    parser.add_argument("--runs", type=int, default=5, help="Interpreter starts per case.")
+    parser.add_argument("--max-ms", type=float, help="Fail if any case's median is slower than this.")
+    args = parser.parse_args(argv)
+
+    failed = False
+    print(f"{'case':<18} {'median':>9}  heavy modules")
+    for name, code in CASES.items():
+        seconds, loaded = run_case(code, args.runs)
+        slow = args.max_ms is not None and seconds * 1000 > args.max_ms
+        failed |= slow or bool(loaded)
+        print(f"{name:<18} {seconds * 1000:>7.0f}ms  {', '.join(loaded) or '-'}{'  SLOW' if slow else ''}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
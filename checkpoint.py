@@ -0,0 +1,83 @@
+"""Resumable progress files for long flows.
+
+Shared by main.py (one checkpoint per article) and human_assisted_flow/main.py
+(one per flow folder). A checkpoint is a small JSON document that is rewritten
+atomically after every completed phase: it is written to a temporary file in
+the same directory, flushed to disk and renamed over the old one, so a crash
+leaves either the previous or the new state, never a torn file.
+"""
+import json
+import os
+import tempfile
+import time
+
+CHECKPOINT_VERSION = 1
+
+
+def write_atomic(path, text):
+    """Replace path with text through a flushed temporary file, so readers never see a torn file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".checkpoint-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Checkpoint:
+    """A JSON object holding one flow's completed phases.
+
+    data["phases"] is the ordered list of completed phases; callers store
+    whatever else they need to rebuild their state next to it.
+    """
+
+    def __init__(self, path, data=None):
+        self.path = path
+        self.data = data if data is not None else {"version": CHECKPOINT_VERSION, "phases": []}
+        self.data.setdefault("phases", [])
+
+    @classmethod
+    def load(cls, path):
+        """Read an existing checkpoint; raises FileNotFoundError if there is none."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"{path}: unsupported checkpoint version {data.get('version')}")
+        return cls(path, data)
+
+    @classmethod
+    def open(cls, path, resume=False):
+        """Load the checkpoint at path when resuming, otherwise start an empty one."""
+        if resume and os.path.exists(path):
+            return cls.load(path)
+        return cls(path)
+
+    @property
+    def phases(self):
+        return self.data["phases"]
+
+    def record(self, **phase):
+        """Append a completed phase and save."""
+        phase.setdefault("completed_at", time.time())
+        self.phases.append(phase)
+        self.save()
+        return phase
+
+    def truncate(self, count):
+        """Forget every phase after the first count (they will be run again)."""
+        del self.phases[count:]
+        self.save()
+
+    def save(self):
+        write_atomic(self.path, json.dumps(self.data, ensure_ascii=False, indent=1))
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
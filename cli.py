@@ -0,0 +1,142 @@
+"""Single entry point for every mode and tool: python cli.py <command> [args...]
+
+Each command imports only what it needs, so short operations (validate,
+report, export) start in milliseconds; the LLM SDKs and Playwright are only
+imported by the commands that call the APIs or open a browser.
+
+    python cli.py api --topics-file topics.txt      # API mode (main.py)
+    python cli.py browser --pool-file topics.txt    # browser mode (human_assisted_flow/main.py)
+    python cli.py validate                          # config.json, prompt placeholders and format.md
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FLOW_DIR = os.path.join(ROOT, "human_assisted_flow")
+
+
+def run_api(argv):
+    import main
+    return main.main(argv)
+
+
+def run_browser(argv):
+    """Run human_assisted_flow/main.py from its own folder (output/ and user_data are relative to it)."""
+    import runpy
+    os.chdir(FLOW_DIR)
+    sys.path.insert(0, FLOW_DIR)
+    sys.argv = [os.path.join(FLOW_DIR, "main.py")] + argv
+    runpy.run_path(sys.argv[0], run_name="__main__")
+
+
+def run_regenerate(argv):
+    import main
+    return main.main(["regenerate"] + argv)
+
+
+def run_report(argv):
+    from tracing import main as report_main
+    return report_main(["report"] + argv)
+
+
+def run_export(argv):
+    from export import main as export_main
+    return export_main(argv)
+
+
+def run_similar(argv):
+    from similar_prompts import main as similar_main
+    return similar_main(argv)
+
+
+def run_queue(argv):
+    from job_queue import main as queue_main
+    return queue_main(argv)
+
+
+def run_service(argv):
+    from service import main as service_main
+    return service_main(argv)
+
+
+def validate(argv):
+    """Check config.json, the prompt templates and format.md without opening a browser or calling an API."""
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(prog="cli.py validate", description=validate.__doc__)
+    parser.add_argument("--config", default=os.path.join(FLOW_DIR, "config.json"), help="Browser-mode config.json.")
+    parser.add_argument("--format", default=os.path.join(ROOT, "format.md"), help="format.md pasted into the Writer prompt.")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    failures = 0
+
+    def report(name, problems, detail=""):
+        nonlocal failures
+        failures += bool(problems)
+        print(f"{'FAIL' if problems else 'ok  '} {name}" + (f": {detail}" if detail and not problems else ""))
+        for problem in problems:
+            print(f"     {problem}")
+
+    try:
+        with open(args.format, "r", encoding="utf-8") as f:
+            format_content = f.read()
+        report("format.md", [] if format_content.strip() else ["format.md is empty"], f"{len(format_content)} chars")
+    except (OSError, UnicodeDecodeError) as e:
+        report("format.md", [str(e)])
+
+    try:
+        # Compiling the API-mode templates happens at import; main no longer imports the SDKs
+        import main
+        problems = [] if "{format_content}" in main.WRITER_SYSTEM_PROMPT else ["WRITER_SYSTEM_PROMPT has no {format_content}"]
+        report("API prompts", problems, ", ".join(sorted(main.PROMPTS.templates)))
+    except ValueError as e:
+        report("API prompts", [str(e)])
+
+    if FLOW_DIR not in sys.path:
+        sys.path.append(FLOW_DIR)
+    from config_check import check_config, summarize
+    try:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        report("config.json", [str(e)])
+    else:
+        problems = check_config(config)
+        report("config.json", problems, "" if problems else summarize(config))
+
+    print(f"checked in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return 1 if failures else 0
+
+
+COMMANDS = {
+    "api": (run_api, "Generate articles through the APIs (main.py)."),
+    "browser": (run_browser, "Human-assisted browser flow (human_assisted_flow/main.py)."),
+    "validate": (validate, "Check config.json, prompt placeholders and format.md."),
+    "dry-run": (validate, "Same as validate."),
+    "regenerate": (run_regenerate, "Run one step of a finished API-mode article again (--step N)."),
+    "report": (run_report, "p50/p95 per phase from trace files."),
+    "export": (run_export, "Render articles to HTML/PDF."),
+    "queue": (run_queue, "Durable job queue: add topics, start workers, show status."),
+    "serve": (run_service, "Local HTTP API that keeps the clients warm between articles."),
+    "similar": (run_similar, "Index of Simulator prompts for near-duplicate reuse."),
+}
+
+
+def usage():
+    lines = ["usage: python cli.py <command> [args...]", "", "commands:"]
+    lines.extend(f"  {name:<10} {help_text}" for name, (_, help_text) in COMMANDS.items())
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help") or argv[0] not in COMMANDS:
+        print(usage())
+        return 0 if not argv or argv[0] in ("-h", "--help") else 2
+    return COMMANDS[argv[0]][0](argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
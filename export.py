@@ -0,0 +1,368 @@
+"""Render finished articles (Markdown) to HTML and PDF, re-rendering only what changed.
+
+An article is split into sections at its "#" and "##" headings. Each
+section's HTML is cached in <article>.export.json under the hash of its
+Markdown, so after an edit, or after the flow appends a phase, only new or
+changed sections are rendered again. The PDF is printed from the HTML by
+the Chromium that Playwright already installs for the browser flow, and only
+when the HTML changed. Nothing is sent to an online service.
+
+    python export.py generated_article.md
+    python export.py human_assisted_flow/output/ --workers 4
+
+A directory stands for every final_article.md below it (one per flow
+folder) or, if it has none, for the .md files directly in it.
+"""
+import argparse
+import atexit
+import glob
+import hashlib
+import html
+import json
+import os
+import re
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump when the renderer or the page template changes, to drop every cached section
+EXPORT_VERSION = 2
+CACHE_SUFFIX = ".export.json"
+FLOW_ARTICLE = "final_article.md"
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: "Hiragino Sans", "Noto Sans JP", "Yu Gothic", sans-serif; font-size: 15px; line-height: 1.8;
+       max-width: 860px; margin: 0 auto; padding: 24px; color: #222; word-wrap: break-word; }}
+h1, h2, h3, h4 {{ line-height: 1.4; margin: 1.6em 0 0.6em; }}
+h1 {{ border-bottom: 2px solid #ddd; padding-bottom: 0.3em; }}
+h2 {{ border-bottom: 1px solid #eee; padding-bottom: 0.2em; }}
+pre {{ background: #f6f8fa; padding: 12px 16px; border-radius: 6px; white-space: pre-wrap; }}
+code {{ font-family: "SFMono-Regular", Consolas, monospace; font-size: 0.9em; }}
+:not(pre) > code {{ background: #f0f0f0; padding: 0.1em 0.3em; border-radius: 3px; }}
+blockquote {{ margin: 1em 0; padding: 0.2em 1em; border-left: 4px solid #ccc; color: #444; background: #fafafa; }}
+table {{ border-collapse: collapse; margin: 1em 0; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 10px; }}
+hr {{ border: none; border-top: 1px solid #ddd; margin: 2em 0; }}
+@media print {{ body {{ max-width: none; padding: 0; }} pre, blockquote {{ page-break-inside: avoid; }} }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+FENCE = re.compile(r"^\s*(```|~~~)")
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+LIST_ITEM = re.compile(r"^(\s*)([-*+]|\d+[.)])\s+(.*)$")
+TABLE_RULE = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+SECTION_HEADING = re.compile(r"^#{1,2}\s")
+# Link and image targets allowed in the output; anything else (javascript:, data:, ...) stays text
+SAFE_URL_SCHEMES = ("", "http", "https", "mailto")
+
+
+def safe_url(url):
+    """Whether an (escaped) link or image target is relative or uses an allowed scheme."""
+    try:
+        return urllib.parse.urlsplit(html.unescape(url)).scheme.lower() in SAFE_URL_SCHEMES
+    except ValueError:
+        return False
+
+
+def render_inline(text):
+    """Escape text and render code spans, links, images, bold and italics."""
+    spans = []
+
+    def keep(fragment):
+        spans.append(fragment)
+        return f"\x00{len(spans) - 1}\x00"
+
+    def image(m):
+        if not safe_url(m.group(2)):
+            return keep(m.group(0))
+        return keep(f'<img src="{m.group(2)}" alt="{m.group(1)}">')
+
+    def link(m):
+        if not safe_url(m.group(2)):
+            return keep(m.group(0))
+        return f'<a href="{m.group(2)}">{m.group(1)}</a>'
+
+    text = re.sub(r"`([^`]+)`", lambda m: keep(f"<code>{html.escape(m.group(1))}</code>"), text)
+    # Quotes are escaped too, so escaped text is safe inside the attributes below
+    text = html.escape(text, quote=True)
+    text = re.sub(r"!\[([^\]]*)\]\(([^)\s]+)\)", image, text)
+    text = re.sub(r"\[([^\]]+)\]\(([^)\s]+)\)", link, text)
+    text = re.sub(r"\*\*(.+?)\*\*|__(.+?)__", lambda m: f"<strong>{m.group(1) or m.group(2)}</strong>", text)
+    text = re.sub(r"(?<!\*)\*(?![\s*])(.+?)(?<![\s*])\*(?!\*)", r"<em>\1</em>", text)
+    return re.sub(r"\x00(\d+)\x00", lambda m: spans[int(m.group(1))], text)
+
+
+def _table_row(line):
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def render_blocks(lines):
+    """Render a list of Markdown lines to HTML (recursive for quotes and list items)."""
+    out = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.strip():
+            i += 1
+            continue
+
+        fence = FENCE.match(line)
+        if fence:
+            language = line.strip()[3:].strip()
+            body = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith(fence.group(1)):
+                body.append(lines[i])
+                i += 1
+            i += 1
+            attr = f' class="language-{html.escape(language)}"' if language else ""
+            out.append(f"<pre><code{attr}>{html.escape(chr(10).join(body))}</code></pre>")
+            continue
+
+        heading = HEADING.match(line)
+        if heading:
+            level = len(heading.group(1))
+            out.append(f"<h{level}>{render_inline(heading.group(2))}</h{level}>")
+            i += 1
+            continue
+
+        if RULE.match(line):
+            out.append("<hr>")
+            i += 1
+            continue
+
+        if line.lstrip().startswith(">"):
+            quoted = []
+            while i < len(lines) and lines[i].lstrip().startswith(">"):
+                quoted.append(re.sub(r"^\s*> ?", "", lines[i]))
+                i += 1
+            out.append(f"<blockquote>\n{render_blocks(quoted)}\n</blockquote>")
+            continue
+
+        if "|" in line and i + 1 < len(lines) and TABLE_RULE.match(lines[i + 1]) and "-" in lines[i + 1]:
+            header = _table_row(line)
+            rows = []
+            i += 2
+            while i < len(lines) and "|" in lines[i] and lines[i].strip():
+                rows.append(_table_row(lines[i]))
+                i += 1
+            head = "".join(f"<th>{render_inline(cell)}</th>" for cell in header)
+            body = "".join("<tr>" + "".join(f"<td>{render_inline(cell)}</td>" for cell in row) + "</tr>\n"
+                           for row in rows)
+            out.append(f"<table>\n<thead><tr>{head}</tr></thead>\n<tbody>\n{body}</tbody>\n</table>")
+            continue
+
+        item = LIST_ITEM.match(line)
+        if item:
+            indent = len(item.group(1))
+            ordered = item.group(2)[0].isdigit()
+            items = []
+            while i < len(lines):
+                item = LIST_ITEM.match(lines[i])
+                if item and len(item.group(1)) == indent:
+                    items.append([item.group(3)])
+                    i += 1
+                elif lines[i].strip() and (len(lines[i]) - len(lines[i].lstrip())) > indent and items:
+                    items[-1].append(lines[i])
+                    i += 1
+                elif not lines[i].strip() and i + 1 < len(lines) and items and (
+                        (len(lines[i + 1]) - len(lines[i + 1].lstrip())) > indent
+                        or (LIST_ITEM.match(lines[i + 1]) and len(LIST_ITEM.match(lines[i + 1]).group(1)) == indent)):
+                    items[-1].append("")
+                    i += 1
+                else:
+                    break
+            tag = "ol" if ordered else "ul"
+            rendered = []
+            for content in items:
+                first, rest = content[0], content[1:]
+                if not any(l.strip() for l in rest):
+                    rendered.append(f"<li>{render_inline(first)}</li>")
+                    continue
+                # Continuation lines are dedented so nested lists and code blocks render
+                width = min(len(l) - len(l.lstrip()) for l in rest if l.strip())
+                inner = render_blocks([first] + [l[width:] for l in rest])
+                rendered.append(f"<li>{inner}</li>")
+            out.append(f"<{tag}>\n" + "\n".join(rendered) + f"\n</{tag}>")
+            continue
+
+        paragraph = []
+        while i < len(lines) and lines[i].strip() and not (
+                FENCE.match(lines[i]) or HEADING.match(lines[i]) or lines[i].lstrip().startswith(">")
+                or (paragraph and LIST_ITEM.match(lines[i]))):
+            paragraph.append(lines[i].strip())
+            i += 1
+        # Line breaks inside a paragraph are kept, as the generated prose relies on them
+        out.append(f"<p>{render_inline(chr(10).join(paragraph)).replace(chr(10), '<br>')}</p>")
+    return "\n".join(out)
+
+
+def render_markdown(text):
+    return render_blocks(text.splitlines())
+
+
+def split_sections(text):
+    """Split at "#" / "##" headings outside code blocks; the text before the first heading is its own section.
+
+    Blank lines around a section are dropped, so appending a section leaves the hash of the one before unchanged.
+    """
+    sections, current, in_code = [], [], False
+    for line in text.splitlines():
+        if FENCE.match(line):
+            in_code = not in_code
+        if not in_code and SECTION_HEADING.match(line) and any(l.strip() for l in current):
+            sections.append("\n".join(current).strip("\n"))
+            current = []
+        current.append(line)
+    if any(l.strip() for l in current):
+        sections.append("\n".join(current).strip("\n"))
+    return sections
+
+
+def section_hash(section):
+    return hashlib.sha256(f"{EXPORT_VERSION}\n{section}".encode("utf-8")).hexdigest()
+
+
+def load_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return cache if cache.get("version") == EXPORT_VERSION else {}
+
+
+def write_file(path, data):
+    """Write through a temporary file so a reader never sees half an export."""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data.encode("utf-8") if isinstance(data, str) else data)
+    os.replace(tmp_path, path)
+
+
+_browser = None
+
+
+def print_pdf(page_html, pdf_path):
+    """Print HTML to PDF with Playwright's Chromium (one browser per worker process)."""
+    global _browser
+    if _browser is None:
+        from playwright.sync_api import sync_playwright
+        playwright = sync_playwright().start()
+        _browser = playwright.chromium.launch()
+        atexit.register(playwright.stop)
+        atexit.register(_browser.close)
+    page = _browser.new_page()
+    try:
+        page.set_content(page_html, wait_until="load")
+        page.pdf(path=pdf_path, format="A4", print_background=True,
+                 margin={"top": "18mm", "bottom": "18mm", "left": "15mm", "right": "15mm"})
+    finally:
+        page.close()
+
+
+def export_article(md_path, pdf=True, force=False):
+    """Export one Markdown file next to itself (.html, .pdf) and return what was done."""
+    started = time.perf_counter()
+    base = os.path.splitext(md_path)[0]
+    html_path, pdf_path, cache_path = base + ".html", base + ".pdf", md_path + CACHE_SUFFIX
+    with open(md_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    cache = {} if force else load_cache(cache_path)
+    cached = {entry["hash"]: entry["html"] for entry in cache.get("sections", [])}
+    sections, rendered = [], 0
+    for section in split_sections(text):
+        digest = section_hash(section)
+        if digest not in cached:
+            cached[digest] = render_markdown(section)
+            rendered += 1
+        sections.append({"hash": digest, "html": cached[digest]})
+
+    title_match = re.search(r"^#\s+(.+)$", text, re.MULTILINE)
+    title = html.escape(title_match.group(1).strip() if title_match else os.path.basename(base))
+    page_html = PAGE_TEMPLATE.format(title=title, body="\n".join(s["html"] for s in sections))
+    page_hash = hashlib.sha256(page_html.encode("utf-8")).hexdigest()
+    result = {"article": md_path, "sections": len(sections), "rendered": rendered, "html": False, "pdf": False}
+
+    if force or cache.get("page_hash") != page_hash or not os.path.exists(html_path):
+        write_file(html_path, page_html)
+        result["html"] = True
+    pdf_hash = cache.get("pdf_hash")
+    if pdf and (force or pdf_hash != page_hash or not os.path.exists(pdf_path)):
+        try:
+            print_pdf(page_html, pdf_path)
+            pdf_hash = page_hash
+            result["pdf"] = True
+        except Exception as e:
+            # The HTML is still exported; the PDF is retried on the next run
+            result["error"] = f"PDF: {e}".splitlines()[0]
+
+    write_file(cache_path, json.dumps({"version": EXPORT_VERSION, "page_hash": page_hash, "pdf_hash": pdf_hash,
+                                       "sections": sections}, ensure_ascii=False))
+    result["wall_s"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def find_articles(paths):
+    """Markdown files to export for the given files or directories."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            flows = sorted(glob.glob(os.path.join(path, "**", FLOW_ARTICLE), recursive=True))
+            found.extend(flows or sorted(p for p in glob.glob(os.path.join(path, "*.md"))
+                                         if os.path.basename(p).lower() != "readme.md"))
+        elif os.path.exists(path):
+            found.append(path)
+    return found
+
+
+def export_all(paths, workers=1, pdf=True, force=False):
+    """Export every article, in `workers` processes when there are several."""
+    articles = find_articles(paths)
+    if workers <= 1 or len(articles) <= 1:
+        return [export_article(path, pdf, force) for path in articles]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(export_article, articles, [pdf] * len(articles), [force] * len(articles)))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Render articles to HTML and PDF, re-rendering only changed sections.")
+    parser.add_argument("paths", nargs="*", default=["generated_article.md"],
+                        help="Markdown files, or directories holding flow folders or .md files.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parallel worker processes.")
+    parser.add_argument("--no-pdf", action="store_true", help="Only write HTML.")
+    parser.add_argument("--force", action="store_true", help="Ignore the section cache and render everything.")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = export_all(args.paths, max(1, args.workers), pdf=not args.no_pdf, force=args.force)
+    if not results:
+        print("No articles found.")
+        return 1
+    for r in results:
+        written = ", ".join(kind for kind in ("html", "pdf") if r[kind]) or "unchanged"
+        print(f"{r['article']}: {r['rendered']}/{r['sections']} sections rendered, {written} ({r['wall_s']:.2f}s)"
+              + (f"  [{r['error']}]" if r.get("error") else ""))
+    rendered = sum(r["rendered"] for r in results)
+    total = sum(r["sections"] for r in results)
+    print(f"{len(results)} article(s), {rendered}/{total} sections rendered")
+    return 1 if any(r.get("error") for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
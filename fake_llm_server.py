@@ -0,0 +1,376 @@
+"""Local stand-in for the Gemini and OpenAI HTTP APIs.
+
+Lets main.py run end to end without API keys or quota. The server speaks the
+shapes the SDKs behind ChatGoogleGenerativeAI and ChatOpenAI expect:
+
+    POST /v1beta/models/<model>:generateContent
+    POST /v1beta/models/<model>:streamGenerateContent?alt=sse
+    POST /v1/chat/completions            (plain and "stream": true)
+    GET  /stats                          (request counts per provider/status)
+
+Point the clients at it with GOOGLE_GEMINI_BASE_URL=<url> and
+OPENAI_BASE_URL=<url>/v1 (both are read by the SDKs themselves).
+
+Responses come from a canned script. Gemini plays the Writer and answers with
+<article>/<prompt> blocks, ending with <finished>. OpenAI plays the Simulator.
+The Writer's step is carried in a [fake-step:N] marker that the Simulator
+echoes back, so the server stays stateless and any number of articles can run
+at once.
+
+Latency is drawn from a distribution before the first token, text is streamed
+at a fixed token rate (one token per character, as for Japanese), and errors
+can be injected at a given rate.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STEP_MARKER_RE = re.compile(r"\[fake-step:(\d+)\]")
+
+DEFAULT_SCRIPT = {
+    "writer": [
+        {
+            "article": "# はじめに\n\nこの記事では、ChatGPTを使って悩みを一歩ずつ解決する方法を紹介します。\n\n"
+                       "## ステップ{step}：原因を書き出す\n\nまずは頭の中にあるものを、すべてChatGPTに話してみましょう。",
+            "prompt": "私は今、困っていることがあります。原因を一緒に整理してください。[fake-step:{step}]",
+        },
+        {
+            "article": "ChatGPTは原因を次のように整理してくれました。\n\n## ステップ{step}：小さな行動に分ける\n\n"
+                       "次は、整理できた原因ごとに、今日できる小さな行動に分けてもらいます。",
+            "prompt": "ありがとうございます。それぞれ15分でできる行動に分けてください。[fake-step:{step}]",
+        },
+        {
+            "article": "## まとめ\n\nAIは答えを出す道具ではなく、考えを整理する相棒です。今日から試してみてください。",
+            "finished": True,
+        },
+    ],
+    "simulator": [
+        "承知しました。原因は大きく3つに分けられます。\n1. 情報が多すぎる\n2. 優先順位が決まっていない\n"
+        "3. 休む時間がない\n[fake-step:{step}]",
+    ],
+}
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a function returning seconds.
+
+    "0.5" is a fixed delay, "uniform:0.2:1.0" is uniform between the bounds,
+    "normal:mean:sd" is clipped at zero, and "lognormal:median:sigma" has a
+    long tail like real model latency.
+    """
+    spec = str(spec)
+    kind, _, rest = spec.partition(":")
+    args = [float(x) for x in rest.split(":")] if rest else []
+    if not rest:
+        value = float(kind)
+        return lambda rng: value
+    if kind == "uniform" and len(args) == 2:
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "normal" and len(args) == 2:
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+    if kind == "lognormal" and len(args) == 2:
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1]) if args[0] > 0 else 0.0
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def parse_errors(spec):
+    """Parse "429:0.05,503:0.01" into [(status, rate), ...]."""
+    errors = []
+    for part in filter(None, (spec or "").split(",")):
+        status, _, rate = part.partition(":")
+        errors.append((int(status), float(rate)))
+    return errors
+
+
+def load_script(path):
+    with open(path, "r", encoding="utf-8") as f:
+        script = json.load(f)
+    if not script.get("writer") or not script.get("simulator"):
+        raise ValueError(f"{path}: a script needs non-empty 'writer' and 'simulator' lists")
+    return script
+
+
+class ProviderProfile:
+    """How one provider behaves: time to first token, token rate and errors."""
+
+    def __init__(self, latency="0", tokens_per_second=0.0, chunk_tokens=8, errors=""):
+        self.latency = parse_latency(latency)
+        self.tokens_per_second = float(tokens_per_second)
+        self.chunk_tokens = max(1, int(chunk_tokens))
+        self.errors = parse_errors(errors) if isinstance(errors, str) else list(errors)
+
+
+class FakeLLMServer:
+    """Run the fake providers on a background thread.
+
+        with FakeLLMServer(writer=ProviderProfile(latency="lognormal:1.0:0.4")) as server:
+            os.environ["GOOGLE_GEMINI_BASE_URL"] = server.url
+            os.environ["OPENAI_BASE_URL"] = server.url + "/v1"
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, writer=None, simulator=None, script=None, seed=None):
+        self.writer = writer or ProviderProfile()
+        self.simulator = simulator or ProviderProfile()
+        self.script = script or DEFAULT_SCRIPT
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {}
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def count(self, provider, status):
+        with self._stats_lock:
+            key = f"{provider}:{status}"
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def sample(self, profile):
+        """Return (delay_seconds, injected_error_status or None)."""
+        with self._rng_lock:
+            delay = profile.latency(self._rng)
+            roll = self._rng.random()
+        for status, rate in profile.errors:
+            if roll < rate:
+                return delay, status
+            roll -= rate
+        return delay, None
+
+    def writer_reply(self, user_text):
+        """Pick the next Writer turn from the step marker in the Simulator answer."""
+        match = STEP_MARKER_RE.search(user_text)
+        step = int(match.group(1)) + 1 if match else 1
+        turn = self.script["writer"][min(step, len(self.script["writer"])) - 1]
+        parts = [f"<article>\n{turn['article'].format(step=step)}\n</article>"]
+        if turn.get("finished"):
+            parts.append("<finished>")
+        else:
+            parts.append(f"<prompt>\n{turn['prompt'].format(step=step)}\n</prompt>")
+        return "\n\n".join(parts)
+
+    def simulator_reply(self, user_text):
+        match = STEP_MARKER_RE.search(user_text)
+        step = int(match.group(1)) if match else 1
+        answers = self.script["simulator"]
+        return answers[(step - 1) % len(answers)].format(step=step)
+
+
+def _chunks(text, size):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_error(self, provider, status):
+            server.count(provider, status)
+            headers = {"Retry-After": "1"} if status == 429 else None
+            message = "Resource has been exhausted (fake)." if status == 429 else "Internal error (fake)."
+            self._send_json(status, {"error": {"code": status, "message": message, "status": "FAKE_ERROR"}}, headers)
+
+        def _stream(self, events):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            for event in events:
+                self.wfile.write(f"data: {event}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        def _paced(self, profile, text):
+            """Yield (chunk, is_last) for text at the profile's token rate."""
+            pause = profile.chunk_tokens / profile.tokens_per_second if profile.tokens_per_second > 0 else 0
+            chunks = list(_chunks(text, profile.chunk_tokens))
+            for i, chunk in enumerate(chunks):
+                if i and pause:
+                    time.sleep(pause)
+                yield chunk, i == len(chunks) - 1
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                with server._stats_lock:
+                    self._send_json(200, dict(server.stats))
+            else:
+                self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+
+        def do_POST(self):
+            path = self.path.split("?", 1)[0]
+            body = self._read_json()
+            if path.startswith("/v1beta/models/"):
+                self._gemini(path, body)
+            elif path.rstrip("/").endswith("/chat/completions"):
+                self._openai(body)
+            else:
+                self._send_json(404, {"error": {"code": 404, "message": f"unknown path {path}"}})
+
+        def _gemini(self, path, body):
+            delay, error = server.sample(server.writer)
+            time.sleep(delay)
+            if error:
+                return self._send_error("gemini", error)
+
+            user_text = "\n".join(
+                part.get("text", "")
+                for content in body.get("contents", []) if content.get("role", "user") == "user"
+                for part in content.get("parts", [])
+            )
+            text = server.writer_reply(user_text)
+            server.count("gemini", 200)
+
+            def response(chunk, final):
+                candidate = {"content": {"role": "model", "parts": [{"text": chunk}]}, "index": 0}
+                if final:
+                    candidate["finishReason"] = "STOP"
+                return {
+                    "candidates": [candidate],
+                    "usageMetadata": {"promptTokenCount": len(user_text), "candidatesTokenCount": len(text),
+                                      "totalTokenCount": len(user_text) + len(text)},
+                    "modelVersion": path.rsplit("/", 1)[-1].split(":")[0],
+                }
+
+            if path.endswith(":streamGenerateContent"):
+                self._stream(json.dumps(response(chunk, last), ensure_ascii=False)
+                             for chunk, last in self._paced(server.writer, text))
+            else:
+                self._wait_generation(server.writer, text)
+                self._send_json(200, response(text, True))
+
+        def _openai(self, body):
+            delay, error = server.sample(server.simulator)
+            time.sleep(delay)
+            if error:
+                return self._send_error("openai", error)
+
+            user_text = "\n".join(
+                m["content"] if isinstance(m.get("content"), str)
+                else "".join(p.get("text", "") for p in m.get("content") or [])
+                for m in body.get("messages", []) if m.get("role") == "user"
+            )
+            text = server.simulator_reply(user_text)
+            model = body.get("model", "gpt-4o")
+            server.count("openai", 200)
+            created = int(time.time())
+            usage = {"prompt_tokens": len(user_text), "completion_tokens": len(text),
+                     "total_tokens": len(user_text) + len(text)}
+
+            if body.get("stream"):
+                def events():
+                    for chunk, _ in self._paced(server.simulator, text):
+                        yield json.dumps({"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created,
+                                          "model": model, "choices": [{"index": 0, "delta": {"content": chunk},
+                                                                       "finish_reason": None}]}, ensure_ascii=False)
+                    yield json.dumps({"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created,
+                                      "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                    yield "[DONE]"
+                self._stream(events())
+            else:
+                self._wait_generation(server.simulator, text)
+                self._send_json(200, {
+                    "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+        def _wait_generation(self, profile, text):
+            """A non-streaming call returns after the whole text would have streamed."""
+            if profile.tokens_per_second > 0:
+                time.sleep(len(text) / profile.tokens_per_second)
+
+    return Handler
+
+
+def add_profile_arguments(parser):
+    """Latency/rate/error options shared by this script and bench_pipeline.py."""
+    for name, default_rate in (("writer", 60.0), ("simulator", 80.0)):
+        parser.add_argument(f"--{name}-latency", default="0",
+                            help=f"{name} time to first token: 0.5, uniform:a:b, normal:mean:sd or lognormal:median:sigma (seconds).")
+        parser.add_argument(f"--{name}-tps", type=float, default=default_rate,
+                            help=f"{name} streaming rate in tokens per second (0 = instant).")
+        parser.add_argument(f"--{name}-errors", default="",
+                            help=f"{name} injected errors, e.g. 429:0.05,503:0.01.")
+    parser.add_argument("--script", help="JSON file with canned 'writer' and 'simulator' turns.")
+    parser.add_argument("--seed", type=int, help="Random seed for latency and errors.")
+
+
+def server_from_args(args, host="127.0.0.1", port=0):
+    return FakeLLMServer(
+        host=host,
+        port=port,
+        writer=ProviderProfile(args.writer_latency, args.writer_tps, errors=args.writer_errors),
+        simulator=ProviderProfile(args.simulator_latency, args.simulator_tps, errors=args.simulator_errors),
+        script=load_script(args.script) if args.script else None,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve fake Gemini/OpenAI endpoints for offline runs and benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = server_from_args(args, args.host, args.port)
+    print(f"Fake LLM server listening on {server.url}")
+    print(f"  GOOGLE_GEMINI_BASE_URL={server.url}")
+    print(f"  OPENAI_BASE_URL={server.url}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Hedged LLM calls: a second request when the first is slower than usual.
+
+Each role (Writer, Simulator) keeps a window of observed latencies. Once a
+call has been running longer than their p95, a duplicate is sent, to the
+same model or to an alternate one. The first good response wins and the
+other call is cancelled. For streams the race is over the first chunk; once
+a stream has produced text it is never duplicated.
+
+No call is hedged until `min_samples` latencies have been observed.
+"""
+import asyncio
+import collections
+import time
+
+from tracing import percentile
+
+
+class LatencyTracker:
+    """Recent latencies of one role and the threshold after which a call is hedged."""
+
+    def __init__(self, window=200, min_samples=10, percentile_rank=95, minimum_s=0.0):
+        self.samples = collections.deque(maxlen=window)
+        self.min_samples = min_samples
+        self.percentile_rank = percentile_rank
+        self.minimum_s = minimum_s
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def threshold(self):
+        """Seconds to wait before hedging, or None while there is too little history."""
+        if len(self.samples) < self.min_samples:
+            return None
+        return max(self.minimum_s, percentile(list(self.samples), self.percentile_rank))
+
+
+async def _discard(task):
+    """Cancel a losing call and wait until it has cleaned up."""
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+class HedgedLLM:
+    """Wrap a chain or chat model so slow calls are raced against a duplicate.
+
+    alternate, if given, receives the duplicate instead of the primary.
+    reserve, if given, is awaited with the payload before the duplicate is
+    sent, so it spends rate-limit quota like any other request.
+    stats counts "calls", "hedged", and which side won each hedged call.
+    """
+
+    def __init__(self, primary, tracker, alternate=None, reserve=None):
+        self.primary = primary
+        self.alternate = alternate
+        self.tracker = tracker
+        self.reserve = reserve
+        self.stats = collections.Counter()
+
+    async def _hedge(self, payload, start):
+        """Start the duplicate once its quota is reserved."""
+        if self.reserve is not None:
+            await self.reserve(payload)
+        return await start()
+
+    async def _race(self, start_primary, start_hedge):
+        """Run start_primary(); after the threshold also start_hedge(). Return the first success."""
+        self.stats["calls"] += 1
+        started = time.perf_counter()
+        threshold = self.tracker.threshold()
+        primary = asyncio.ensure_future(start_primary())
+        pending = {primary}
+        hedged = False
+        try:
+            if threshold is not None:
+                done, _ = await asyncio.wait(pending, timeout=threshold)
+                if not done:
+                    hedged = True
+                    self.stats["hedged"] += 1
+                    pending.add(asyncio.ensure_future(start_hedge()))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.tracker.record(time.perf_counter() - started)
+                        if hedged:
+                            self.stats["primary_won" if task is primary else "hedge_won"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                await _discard(task)
+
+    async def ainvoke(self, payload):
+        return await self._race(lambda: self.primary.ainvoke(payload),
+                                lambda: self._hedge(payload, lambda: (self.alternate or self.primary).ainvoke(payload)))
+
+    async def astream(self, payload):
+        streams = []
+
+        async def first_chunk(runnable):
+            stream = runnable.astream(payload)
+            streams.append(stream)
+            try:
+                return stream, [await stream.__anext__()]
+            except StopAsyncIteration:
+                return stream, []
+
+        stream, head = await self._race(lambda: first_chunk(self.primary),
+                                        lambda: self._hedge(payload, lambda: first_chunk(self.alternate or self.primary)))
+        for other in streams:
+            if other is not stream:
+                await other.aclose()
+        try:
+            for chunk in head:
+                yield chunk
+            if head:
+                async for chunk in stream:
+                    yield chunk
+        finally:
+            await stream.aclose()
+
+    def summary(self, name):
+        threshold = self.tracker.threshold()
+        return (f"{name}: {self.stats['hedged']}/{self.stats['calls']} calls hedged, "
+                f"{self.stats['hedge_won']} won by the hedge, threshold "
+                + (f"{threshold:.1f}s" if threshold is not None else "not yet known"))
@@ -0,0 +1,363 @@
+"""フローの成果物を1つの SQLite ファイル（output/archive.sqlite3）にまとめて保存する
+
+フローフォルダーには、同じ回答が gemini_output/ や chatgpt_output/ のテキスト・
+final_article.md・checkpoint.json に重複して書かれ、スクリーンショットの PNG も加わる。
+アーカイブでは:
+
+- ファイルの中身は SHA-256 ごとに1回だけ、圧縮して保存する（blobs）。同じ内容のファイルや
+  同じスクリーンショットは何度取り込んでも増えない
+- final_article.md は、回答テキストと一致する部分を参照に置き換えて保存する
+  （取り出すと元と同じバイト列に戻る）
+- ファイルごとに、フロー・フェーズ・サービス・時刻の索引を持つ（files）
+
+保存済みの内容は書き換えず、追記だけを行う。取り込み直したファイルの中身が
+変わっていれば、新しい内容を追加して参照先を切り替える。
+
+    python archive.py import output/ .        # 既存の output/flow_* と、直下に残った古いコピー
+    python archive.py list --phase Phase_6_Summary
+    python archive.py extract flow_20251129_133522 --dest restored/
+    python archive.py export flow_20251129_133522 --json
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import zlib
+from datetime import datetime
+
+DEFAULT_ARCHIVE = os.path.join("output", "archive.sqlite3")
+SERVICE_DIRS = {"gemini_output": "gemini", "chatgpt_output": "chatgpt"}
+SCREENSHOT_DIR = "screenshots"
+ARTICLE_FILE = "final_article.md"
+# フォルダー直下で取り込むファイル（user_data などは対象外）
+TOP_LEVEL_FILES = (ARTICLE_FILE, "checkpoint.json", "*.jsonl")
+# これより短い回答は、最終記事の中で参照に置き換えない
+MIN_SHARED_CHARS = 200
+FLOW_TIMESTAMP = re.compile(r"flow_(\d{8}_\d{6})")
+
+
+def flow_files(folder):
+    """フローフォルダーの中で、アーカイブに取り込むファイル（フォルダーからの相対パス）"""
+    found = []
+    for pattern in TOP_LEVEL_FILES:
+        found.extend(os.path.basename(p) for p in glob.glob(os.path.join(folder, pattern)))
+    for sub in list(SERVICE_DIRS) + [SCREENSHOT_DIR]:
+        directory = os.path.join(folder, sub)
+        if os.path.isdir(directory):
+            found.extend(f"{sub}/{name}" for name in os.listdir(directory)
+                         if os.path.isfile(os.path.join(directory, name)))
+    return sorted(set(found))
+
+
+def find_flow_folders(paths):
+    """取り込むフローフォルダー: 成果物があるフォルダーはそれ自体、なければその下の flow_*"""
+    folders = []
+    for path in paths:
+        if flow_files(path):
+            folders.append(path)
+        folders.extend(sorted(p for p in glob.glob(os.path.join(path, "flow_*"))
+                              if os.path.isdir(p) and flow_files(p)))
+    return folders
+
+
+def describe(relative_path):
+    """相対パスから (種類, フェーズ, サービス) を決める"""
+    directory, _, name = relative_path.rpartition("/")
+    stem = os.path.splitext(name)[0]
+    if directory in SERVICE_DIRS:
+        return "response", stem, SERVICE_DIRS[directory]
+    if directory == SCREENSHOT_DIR:
+        return ("log", None, None) if name.endswith(".jsonl") else ("screenshot", stem, None)
+    if name == ARTICLE_FILE:
+        return "article", None, None
+    return "log", None, None
+
+
+def run_time(folder):
+    """フォルダー名（flow_YYYYMMDD_HHMMSS）の時刻、なければ更新時刻"""
+    match = FLOW_TIMESTAMP.search(os.path.basename(os.path.abspath(folder)))
+    if match:
+        return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").timestamp()
+    return os.path.getmtime(folder)
+
+
+def split_shared(text, shared):
+    """text を、shared（回答テキスト → sha256）と一致する部分の参照と、それ以外の文字列に分ける"""
+    pieces = [text]
+    for part in sorted(shared, key=len, reverse=True):
+        next_pieces = []
+        for piece in pieces:
+            if not isinstance(piece, str) or part not in piece:
+                next_pieces.append(piece)
+                continue
+            chunks = piece.split(part)
+            for index, chunk in enumerate(chunks):
+                if index:
+                    next_pieces.append({"ref": shared[part]})
+                if chunk:
+                    next_pieces.append(chunk)
+        pieces = next_pieces
+    return pieces
+
+
+class RunArchive:
+    """フローの成果物を保存する SQLite のアーカイブ"""
+
+    def __init__(self, path=DEFAULT_ARCHIVE):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run TEXT PRIMARY KEY, started_at REAL NOT NULL, imported_at REAL NOT NULL, meta TEXT);"
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " sha256 TEXT PRIMARY KEY, codec TEXT NOT NULL, data BLOB NOT NULL,"
+            " size INTEGER NOT NULL, stored INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS files ("
+            " run TEXT NOT NULL, path TEXT NOT NULL, kind TEXT NOT NULL, phase TEXT, service TEXT,"
+            " sha256 TEXT NOT NULL, modified_at REAL NOT NULL, PRIMARY KEY (run, path));"
+            "CREATE INDEX IF NOT EXISTS files_phase ON files(phase);"
+            "CREATE INDEX IF NOT EXISTS files_service ON files(service);"
+            "CREATE INDEX IF NOT EXISTS files_time ON files(modified_at);"
+            "CREATE INDEX IF NOT EXISTS runs_time ON runs(started_at);"
+        )
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _put_blob(self, data, codec_hint=None):
+        """中身を保存して sha256 を返す（保存済みなら何もしない）"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self._db.execute("SELECT 1 FROM blobs WHERE sha256 = ?", (digest,)).fetchone():
+            return digest
+        if codec_hint is not None:
+            codec, stored = codec_hint
+        else:
+            compressed = zlib.compress(data, 9)
+            # PNG などの圧縮済みの中身は、縮まなければそのまま保存する
+            codec, stored = ("zlib", compressed) if len(compressed) < len(data) else ("raw", data)
+        self._db.execute("INSERT INTO blobs (sha256, codec, data, size, stored) VALUES (?, ?, ?, ?, ?)",
+                         (digest, codec, stored, len(data), len(stored)))
+        return digest
+
+    def read_blob(self, digest):
+        row = self._db.execute("SELECT codec, data FROM blobs WHERE sha256 = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"アーカイブに中身がありません: {digest[:12]}")
+        codec, data = row
+        if codec == "raw":
+            return bytes(data)
+        data = zlib.decompress(data)
+        if codec == "pieces":
+            pieces = json.loads(data.decode("utf-8"))
+            return "".join(p if isinstance(p, str) else self.read_blob(p["ref"]).decode("utf-8")
+                           for p in pieces).encode("utf-8")
+        return data
+
+    def import_folder(self, folder, run=None):
+        """フローフォルダーを取り込み、(今回取り込んだファイルの相対パスのリスト, 元のバイト数) を返す"""
+        run = run or os.path.basename(os.path.abspath(folder))
+        meta = {"source": os.path.abspath(folder)}
+        checkpoint_path = os.path.join(folder, "checkpoint.json")
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            meta.update(problem_settings=checkpoint.get("problem_settings"),
+                        completed=checkpoint.get("completed", False))
+
+        files = flow_files(folder)
+        # 回答テキストを先に保存し、最終記事の中の同じ部分を参照に置き換える
+        files.sort(key=lambda path: describe(path)[0] == "article")
+        shared = {}
+        total = 0
+        with self._db:
+            self._db.execute(
+                "INSERT INTO runs (run, started_at, imported_at, meta) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(run) DO UPDATE SET imported_at = excluded.imported_at, meta = excluded.meta",
+                (run, run_time(folder), time.time(), json.dumps(meta, ensure_ascii=False)))
+            for relative_path in files:
+                full_path = os.path.join(folder, relative_path)
+                with open(full_path, "rb") as f:
+                    data = f.read()
+                total += len(data)
+                kind, phase, service = describe(relative_path)
+                codec_hint = None
+                if kind == "article" and shared:
+                    pieces = split_shared(data.decode("utf-8"), shared)
+                    if any(isinstance(p, dict) for p in pieces):
+                        codec_hint = ("pieces", zlib.compress(json.dumps(pieces, ensure_ascii=False).encode("utf-8"), 9))
+                digest = self._put_blob(data, codec_hint)
+                if kind == "response":
+                    text = data.decode("utf-8", errors="replace")
+                    if len(text) >= MIN_SHARED_CHARS:
+                        shared[text] = digest
+                self._db.execute(
+                    "INSERT OR REPLACE INTO files (run, path, kind, phase, service, sha256, modified_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (run, relative_path, kind, phase, service, digest, os.path.getmtime(full_path)))
+        return files, total
+
+    def verify(self, run, folder, paths=None):
+        """取り込んだファイル（paths があればそのファイルだけ）がアーカイブから元どおりに読めるか確かめる
+        
+        前回の取り込みの後にフォルダーから消えたファイルも索引には残るので、
+        取り込んだ直後の確認には import_folder が返したパスを渡す。
+        """
+        rows = self._db.execute("SELECT path, sha256 FROM files WHERE run = ?", (run,)).fetchall()
+        if paths is not None:
+            wanted = set(paths)
+            rows = [row for row in rows if row[0] in wanted]
+        for relative_path, digest in rows:
+            with open(os.path.join(folder, relative_path), "rb") as f:
+                if hashlib.sha256(self.read_blob(digest)).hexdigest() != hashlib.sha256(f.read()).hexdigest():
+                    return False
+        return True
+
+    def runs(self):
+        return self._db.execute(
+            "SELECT r.run, r.started_at, r.meta, COUNT(f.path) FROM runs r LEFT JOIN files f ON f.run = r.run"
+            " GROUP BY r.run ORDER BY r.started_at").fetchall()
+
+    def find(self, run=None, phase=None, service=None, kind=None, since=None):
+        """索引から (run, path, kind, phase, service, sha256, modified_at) を探す"""
+        clauses, params = [], []
+        for column, value in (("run", run), ("phase", phase), ("service", service), ("kind", kind)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("modified_at >= ?")
+            params.append(since)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._db.execute(
+            "SELECT run, path, kind, phase, service, sha256, modified_at FROM files" + where +
+            " ORDER BY run, modified_at, path", params).fetchall()
+
+    def extract(self, run, dest, **filters):
+        """フローのファイルを dest/<run>/ に書き戻し、書いたファイル数を返す"""
+        rows = self.find(run=run, **filters)
+        for _, relative_path, *_, digest, _ in rows:
+            target = os.path.join(dest, run, relative_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(self.read_blob(digest))
+        return len(rows)
+
+    def export_run(self, run):
+        """フローのテキストの成果物（回答と最終記事）を辞書にまとめる"""
+        responses = []
+        article = None
+        for _, relative_path, kind, phase, service, digest, modified_at in self.find(run=run):
+            if kind == "response":
+                responses.append({"phase": phase, "service": service, "modified_at": modified_at,
+                                  "text": self.read_blob(digest).decode("utf-8")})
+            elif kind == "article":
+                article = self.read_blob(digest).decode("utf-8")
+        return {"run": run, "responses": responses, "article": article}
+
+    def stats(self):
+        original, stored, blobs = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(SUM(stored), 0), COUNT(*) FROM blobs").fetchone()
+        referenced = self._db.execute(
+            "SELECT COALESCE(SUM(b.size), 0), COUNT(*) FROM files f JOIN blobs b ON b.sha256 = f.sha256").fetchone()
+        return {"files": referenced[1], "file_bytes": referenced[0], "blobs": blobs, "blob_bytes": original,
+                "stored_bytes": stored}
+
+
+def prune(folder, relative_paths):
+    """取り込み済みのファイルを消し、空になったサブフォルダーとフォルダーも消す"""
+    for relative_path in relative_paths:
+        os.remove(os.path.join(folder, relative_path))
+    for sub in list(SERVICE_DIRS) + [SCREENSHOT_DIR]:
+        directory = os.path.join(folder, sub)
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+    if os.path.basename(os.path.abspath(folder)).startswith("flow_") and not os.listdir(folder):
+        os.rmdir(folder)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="フローの成果物のアーカイブ（1つの SQLite ファイル）")
+    parser.add_argument("--archive", default=DEFAULT_ARCHIVE, help="アーカイブのファイル")
+    sub = parser.add_subparsers(dest="command", required=True)
+    importer = sub.add_parser("import", help="フローフォルダー（または output/ など、その親）を取り込む")
+    importer.add_argument("paths", nargs="+")
+    importer.add_argument("--prune", action="store_true", help="取り込んで読み戻しを確認したファイルを消す")
+    listing = sub.add_parser("list", help="フロー、または条件に合うファイルの一覧")
+    extract = sub.add_parser("extract", help="フローのファイルをフォルダーに書き戻す")
+    extract.add_argument("run")
+    extract.add_argument("--dest", default=".", help="書き出し先（<dest>/<run>/ に書く）")
+    export = sub.add_parser("export", help="フローの最終記事（--json なら回答も）を標準出力に書く")
+    export.add_argument("run")
+    export.add_argument("--json", action="store_true")
+    for command in (listing, extract):
+        command.add_argument("--phase")
+        command.add_argument("--service", choices=sorted(SERVICE_DIRS.values()))
+    listing.add_argument("--since", help="この日付（YYYY-MM-DD）以降に書かれたファイル")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    with RunArchive(args.archive) as archive:
+        if args.command == "import":
+            folders = find_flow_folders(args.paths)
+            if not folders:
+                print("取り込むフローフォルダーが見つかりません。")
+                return 1
+            for folder in folders:
+                run = os.path.basename(os.path.abspath(folder))
+                files, size = archive.import_folder(folder, run)
+                print(f"{run}: {len(files)} ファイル（{size / 1024:.0f} KiB）を取り込みました")
+                if args.prune:
+                    # 消すのは今回取り込んだファイルだけ（前回の取り込みの後に消えたファイルは索引にだけ残っている）
+                    if not archive.verify(run, folder, files):
+                        print(f"警告: {run} はアーカイブから元どおりに読めないため、削除しません。")
+                        continue
+                    prune(folder, files)
+            s = archive.stats()
+            print(f"アーカイブ: {s['files']} ファイル {s['file_bytes'] / 1024:.0f} KiB → "
+                  f"保存 {s['stored_bytes'] / 1024:.0f} KiB（{args.archive}）")
+        elif args.command == "list":
+            if args.phase or args.service or args.since:
+                since = datetime.strptime(args.since, "%Y-%m-%d").timestamp() if args.since else None
+                for run, path, kind, phase, service, _, modified_at in archive.find(
+                        phase=args.phase, service=args.service, since=since):
+                    stamp = datetime.fromtimestamp(modified_at).strftime("%Y-%m-%d %H:%M")
+                    print(f"{run:<28} {stamp}  {service or '-':<8} {path}")
+            else:
+                for run, started_at, meta, files in archive.runs():
+                    meta = json.loads(meta or "{}")
+                    stamp = datetime.fromtimestamp(started_at).strftime("%Y-%m-%d %H:%M")
+                    done = "完了" if meta.get("completed") else "-"
+                    print(f"{run:<28} {stamp}  {files:>4} ファイル  {done:<4} {(meta.get('problem_settings') or '')[:30]}")
+        elif args.command == "extract":
+            count = archive.extract(args.run, args.dest, phase=args.phase, service=args.service)
+            print(f"{count} ファイルを {os.path.join(args.dest, args.run)} に書き出しました")
+            return 0 if count else 1
+        elif args.command == "export":
+            exported = archive.export_run(args.run)
+            if args.json:
+                print(json.dumps(exported, ensure_ascii=False, indent=1))
+            elif exported["article"] is not None:
+                print(exported["article"], end="")
+            else:
+                print(f"{args.run} に最終記事がありません。")
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""成果物（回答テキスト・最終記事・スクリーンショット）をバックグラウンドで書き出す
+
+ブラウザを操作するスレッドではファイルを書かず、書き出しの依頼をキューに積むだけにする。
+最終記事はセクション（フェーズ名）ごとにメモリ上に持ち、変更があるたびに
+一時ファイルへ書いてから置き換える（途中までしか書かれていないファイルは残らない）。
+
+スクリーンショットの撮影（Playwright の sync API）はブラウザのスレッドからしか呼べないため、
+撮影は呼び出し側で行い、重複チェック（同じ画像を撮っていれば保存しない）と保存をここで行う。
+"""
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import threading
+
+FINAL_ARTICLE = "final_article.md"
+SCREENSHOT_INDEX = "screenshots/index.jsonl"
+SCREENSHOT_EXTENSIONS = {"png": "png", "jpeg": "jpg"}
+
+
+def write_atomic(path, data):
+    """同じフォルダーの一時ファイルに書いてから置き換える"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".artifact-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def screenshot_options(artifact_config):
+    """config.json の artifacts から element.screenshot() の引数を作る
+
+    screenshot_format が "jpeg" のときは screenshot_quality（1〜100）で非可逆圧縮する。
+    エンコードはブラウザ側で行われ、長い回答でも PNG よりずっと小さく速い。
+    """
+    image_type = artifact_config.get("screenshot_format", "png")
+    if image_type not in SCREENSHOT_EXTENSIONS:
+        raise ValueError(f"screenshot_format は {' / '.join(SCREENSHOT_EXTENSIONS)} のいずれかです: {image_type}")
+    options = {"type": image_type}
+    if image_type == "jpeg":
+        options["quality"] = artifact_config.get("screenshot_quality", 80)
+    return options
+
+
+class ArtifactWriter:
+    """フローフォルダー1つ分の成果物を書き出すバックグラウンドスレッド"""
+
+    def __init__(self, folder, dedupe_screenshots=True):
+        self.folder = folder
+        self.dedupe_screenshots = dedupe_screenshots
+        self.sections = {}
+        self.errors = []
+        self._lock = threading.Lock()
+        self._article_pending = False
+        # 再開したフローでは、前回保存した画像とも重複を調べる
+        self._screenshots = {}
+        index_path = os.path.join(folder, SCREENSHOT_INDEX)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry.get("file"):
+                        self._screenshots[entry["sha256"]] = entry["file"]
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"artifacts-{os.path.basename(folder)}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                func, args = job
+                func(*args)
+            except Exception as e:
+                self.errors.append(e)
+                print(f"警告: 成果物の書き出しに失敗しました: {e}")
+            finally:
+                self._queue.task_done()
+
+    def write_text(self, relative_path, text):
+        """テキストファイルを書き出す（上書き）"""
+        self._queue.put((write_atomic, (os.path.join(self.folder, relative_path), text)))
+
+    def append_section(self, section, text):
+        """最終記事にセクションを加える（同じセクションをもう一度書いた場合は置き換える）"""
+        with self._lock:
+            self.sections[section] = text
+            self._schedule_article()
+
+    def set_sections(self, parts):
+        """最終記事を (セクション, テキスト) の並びで作り直す"""
+        with self._lock:
+            self.sections = dict(parts)
+            self._schedule_article()
+
+    def article_text(self):
+        with self._lock:
+            return "".join(f"\n\n{text}" for text in self.sections.values())
+
+    def _schedule_article(self):
+        # 書き出し待ちが既にあれば、その書き出しが最新の内容を書く
+        if not self._article_pending:
+            self._article_pending = True
+            self._queue.put((self._write_article, ()))
+
+    def _write_article(self):
+        with self._lock:
+            self._article_pending = False
+            text = "".join(f"\n\n{text}" for text in self.sections.values())
+        write_atomic(os.path.join(self.folder, FINAL_ARTICLE), text)
+
+    def save_screenshot(self, name, data, image_type="png"):
+        """撮影済みの画像（bytes）を screenshots/ に保存する"""
+        self._queue.put((self._store_screenshot, (name, data, image_type)))
+
+    def _store_screenshot(self, name, data, image_type):
+        digest = hashlib.sha256(data).hexdigest()
+        filename = f"screenshots/{name}.{SCREENSHOT_EXTENSIONS[image_type]}"
+        entry = {"phase": name, "file": filename, "sha256": digest, "bytes": len(data)}
+        duplicate_of = self._screenshots.get(digest) if self.dedupe_screenshots else None
+        if duplicate_of:
+            entry.update(file=None, duplicate_of=duplicate_of)
+        else:
+            write_atomic(os.path.join(self.folder, filename), data)
+            self._screenshots[digest] = filename
+        index_path = os.path.join(self.folder, SCREENSHOT_INDEX)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        """それまでに依頼した書き出しが終わるまで待つ"""
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
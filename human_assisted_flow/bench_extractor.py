@@ -0,0 +1,147 @@
+"""保存済みのGeminiの回答で extractor の速度と精度を測る
+
+gemini_output/ と output/flow_*/gemini_output/ のすべての .txt を対象に、
+extraction_corpus.json の期待値（プロンプトのハッシュと総ステップ数）と比べる。
+期待値がないファイルは「未登録」として抽出結果を表示する。
+
+使い方:
+    python bench_extractor.py              # 精度と速度を表示
+    python bench_extractor.py --repeat 200 # 計測の繰り返し回数を変える
+    python bench_extractor.py --add-new    # 未登録ファイルの現在の抽出結果を期待値として追加
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+from extractor import extract
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(BASE_DIR, "extraction_corpus.json")
+SOURCE_PATTERNS = ("gemini_output/*.txt", "output/flow_*/gemini_output/*.txt")
+
+
+def find_outputs(base_dir=BASE_DIR):
+    """保存済みの回答ファイルを base_dir からの相対パスで返す"""
+    paths = []
+    for pattern in SOURCE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(base_dir, pattern)))
+    return sorted(os.path.relpath(p, base_dir).replace(os.sep, "/") for p in paths)
+
+
+def prompt_digest(prompt):
+    return None if prompt is None else hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def expectation(extraction):
+    """抽出結果をコーパスに保存する形に変換する"""
+    return {
+        "prompt_sha256": prompt_digest(extraction.prompt),
+        "prompt_chars": None if extraction.prompt is None else len(extraction.prompt),
+        "total_steps": extraction.total_steps,
+    }
+
+
+def load_corpus(path=CORPUS_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def evaluate(corpus, base_dir=BASE_DIR):
+    """全ファイルを1回ずつ抽出して期待値と比べる
+
+    戻り値は results（ファイルごとの辞書のリスト）。
+    status は "ok" / "mismatch" / "unlabeled"。
+    """
+    results = []
+    for rel in find_outputs(base_dir):
+        with open(os.path.join(base_dir, rel), "r", encoding="utf-8") as f:
+            text = f.read()
+        got = expectation(extract(text))
+        expected = corpus.get(rel)
+        if expected is None:
+            status = "unlabeled"
+            problems = []
+        else:
+            problems = [field for field in ("prompt_sha256", "total_steps") if got[field] != expected.get(field)]
+            status = "mismatch" if problems else "ok"
+        results.append({"file": rel, "status": status, "problems": problems, "got": got, "expected": expected})
+    return results
+
+
+def measure_throughput(texts, repeat):
+    """texts を repeat 回抽出し、(秒, 文字/秒, ファイル/秒) を返す"""
+    total_chars = sum(len(t) for t in texts) * repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            extract(text)
+    elapsed = time.perf_counter() - started
+    return elapsed, total_chars / elapsed if elapsed else 0.0, len(texts) * repeat / elapsed if elapsed else 0.0
+
+
+def summarize(results):
+    labeled = [r for r in results if r["status"] != "unlabeled"]
+    # プロンプトがあるはずなのに取れなかったファイルは、手動フォールバックに落ちる
+    with_prompt = [r for r in labeled if r["expected"].get("prompt_sha256")]
+    missed = [r for r in with_prompt if r["got"]["prompt_sha256"] is None]
+    return {
+        "files": len(results),
+        "labeled": len(labeled),
+        "correct": sum(r["status"] == "ok" for r in labeled),
+        "prompt_correct": sum("prompt_sha256" not in r["problems"] for r in labeled),
+        "steps_correct": sum("total_steps" not in r["problems"] for r in labeled),
+        "fallback_rate": len(missed) / len(with_prompt) if with_prompt else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存済みの回答で extractor の速度と精度を測る")
+    parser.add_argument("--repeat", type=int, default=100, help="速度計測の繰り返し回数")
+    parser.add_argument("--add-new", action="store_true",
+                        help="未登録ファイルの抽出結果を期待値として追加する（内容を目で確認してから使う）")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus()
+    results = evaluate(corpus)
+
+    for r in results:
+        if r["status"] == "mismatch":
+            print(f"NG  {r['file']}: {', '.join(r['problems'])} 期待={r['expected']} 結果={r['got']}")
+        elif r["status"] == "unlabeled":
+            print(f"??  {r['file']}: 未登録 結果={r['got']}")
+
+    s = summarize(results)
+    if s["labeled"]:
+        print(f"精度: {s['correct']}/{s['labeled']} ファイル一致"
+              f"（プロンプト {s['prompt_correct']}/{s['labeled']}, ステップ数 {s['steps_correct']}/{s['labeled']}）")
+        print(f"手動フォールバック率: {s['fallback_rate']:.0%}")
+
+    texts = []
+    for rel in find_outputs():
+        with open(os.path.join(BASE_DIR, rel), "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    if texts and args.repeat > 0:
+        elapsed, chars_per_sec, files_per_sec = measure_throughput(texts, args.repeat)
+        print(f"速度: {files_per_sec:,.0f} ファイル/秒, {chars_per_sec / 1e6:.2f} M文字/秒"
+              f"（{len(texts)} ファイル × {args.repeat} 回, {elapsed:.2f}秒）")
+
+    if args.add_new:
+        added = {r["file"]: r["got"] for r in results if r["status"] == "unlabeled"}
+        if added:
+            corpus.update(added)
+            with open(CORPUS_PATH, "w", encoding="utf-8") as f:
+                json.dump(dict(sorted(corpus.items())), f, ensure_ascii=False, indent=2)
+                f.write("\n")
+            print(f"{len(added)} ファイルを {os.path.basename(CORPUS_PATH)} に追加しました。")
+
+    return 1 if any(r["status"] == "mismatch" for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""回答の完了をブラウザ側で自動検出する
+
+送信ボタンは人が押す。ここでは「回答が終わったか」の待機だけを自動化する。
+latest_response の最後の要素を MutationObserver で監視し、
+停止ボタン（生成中インジケーター）が消えてテキストが一定時間変化しなくなったら完了とみなす。
+"""
+import json
+import time
+
+DEFAULT_QUIET_PERIOD_MS = 2000
+DEFAULT_TIMEOUT_MS = 600000
+
+# 監視用スクリプト。完了・タイムアウトのどちらでも結果オブジェクトを返す
+WATCH_SCRIPT = """
+([selector, stopSelector, baseCount, baseText, quietMs, timeoutMs]) => new Promise(resolve => {
+    const start = performance.now();
+    let firstChange = null, lastChange = null, lastText = null, settle = null;
+
+    const read = () => {
+        const nodes = document.querySelectorAll(selector);
+        const last = nodes[nodes.length - 1];
+        return {count: nodes.length, text: last ? last.innerText : null};
+    };
+    const streaming = () => !!(stopSelector && document.querySelector(stopSelector));
+
+    const finish = (reason) => {
+        observer.disconnect();
+        clearTimeout(settle);
+        clearInterval(poll);
+        clearTimeout(deadline);
+        resolve({
+            reason: reason,
+            waited_ms: Math.round(performance.now() - start),
+            first_change_ms: firstChange === null ? null : Math.round(firstChange),
+            chars: (lastText || "").length,
+        });
+    };
+
+    const check = () => {
+        const cur = read();
+        const started = cur.count > baseCount || (cur.count === baseCount && cur.text && cur.text !== baseText);
+        if (!started) return;
+        const now = performance.now();
+        if (firstChange === null) firstChange = now - start;
+        if (cur.text !== lastText) {
+            lastText = cur.text;
+            lastChange = now;
+        }
+        clearTimeout(settle);
+        const wait = streaming() ? quietMs : Math.max(quietMs - (now - lastChange), 0);
+        settle = setTimeout(() => {
+            const again = read();
+            if (again.text === lastText && lastText && !streaming()) finish("stable");
+            else check();
+        }, wait);
+    };
+
+    const observer = new MutationObserver(check);
+    observer.observe(document.body, {childList: true, subtree: true, characterData: true});
+    // Shadow DOM などで通知が来ない場合の保険
+    const poll = setInterval(check, 1000);
+    const deadline = setTimeout(() => finish("timeout"), timeoutMs);
+    check();
+})
+"""
+
+
+def snapshot_responses(page, selector):
+    """現在の回答要素の数と、最後の要素のテキストを返す（送信前の基準値）"""
+    try:
+        return page.evaluate(
+            """(selector) => {
+                const nodes = document.querySelectorAll(selector);
+                const last = nodes[nodes.length - 1];
+                return [nodes.length, last ? last.innerText : null];
+            }""",
+            selector,
+        )
+    except Exception:
+        return [0, None]
+
+
+def wait_for_completion(page, selectors, baseline, quiet_period_ms=DEFAULT_QUIET_PERIOD_MS,
+                        timeout_ms=DEFAULT_TIMEOUT_MS):
+    """新しい回答が出て、生成が止まり、quiet_period_ms 変化しなくなるまで待つ
+
+    戻り値は reason（"stable" / "timeout" / "error"）と各種時間（ms）を含む辞書。
+    """
+    base_count, base_text = baseline
+    started = time.monotonic()
+    try:
+        result = page.evaluate(
+            WATCH_SCRIPT,
+            [selectors['latest_response'], selectors.get('stop_button'), base_count, base_text,
+             quiet_period_ms, timeout_ms],
+        )
+    except Exception as e:
+        result = {"reason": "error", "error": str(e), "first_change_ms": None, "chars": 0}
+    result["wall_ms"] = round((time.monotonic() - started) * 1000)
+    result["quiet_period_ms"] = quiet_period_ms
+    return result
+
+
+def log_completion(result, phase_name, service, flow_folder):
+    """検出結果を表示し、completion_log.jsonl に記録する"""
+    if result["reason"] == "stable":
+        first = result.get("first_change_ms")
+        first_text = f"{first / 1000:.1f}秒後に出力開始、" if first is not None else ""
+        print(f"回答の完了を検出しました（{first_text}{result['wall_ms'] / 1000:.1f}秒, {result['chars']}文字）。")
+    else:
+        print(f"回答の完了を自動検出できませんでした（{result['reason']}）。")
+
+    entry = {"phase": phase_name, "service": service, "timestamp": time.time(), **result}
+    with open(f"{flow_folder}/completion_log.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def start_watch(page, selectors, baseline, quiet_period_ms=DEFAULT_QUIET_PERIOD_MS,
+                timeout_ms=DEFAULT_TIMEOUT_MS):
+    """完了の監視をページ内で開始し、すぐに戻る（結果は poll_watch で受け取る）
+
+    複数のタブを1つのスレッドで並行に見張るプールモード用。
+    """
+    base_count, base_text = baseline
+    page.evaluate(
+        "(args) => {"
+        " window.__articleAgentWatch = null;"
+        " window.__articleAgentBaseline = [args[0], args[2], args[3]];"
+        f" ({WATCH_SCRIPT})(args).then(r => {{ window.__articleAgentWatch = r; }});"
+        "}",
+        [selectors['latest_response'], selectors.get('stop_button'), base_count, base_text,
+         quiet_period_ms, timeout_ms],
+    )
+
+
+def poll_watch(page):
+    """start_watch の状態を返す
+
+    完了（またはタイムアウト）していれば wait_for_completion と同じ辞書、
+    まだなら {"reason": None, "started": 回答が出始めたか}。
+    """
+    try:
+        result = page.evaluate(
+            """() => {
+                if (window.__articleAgentWatch) return window.__articleAgentWatch;
+                const base = window.__articleAgentBaseline;
+                if (!base) return null;
+                const nodes = document.querySelectorAll(base[0]);
+                const last = nodes[nodes.length - 1];
+                const text = last ? last.innerText : null;
+                return {reason: null, started: nodes.length > base[1] || (!!text && text !== base[2])};
+            }"""
+        )
+    except Exception as e:
+        return {"reason": "error", "error": str(e), "first_change_ms": None, "chars": 0, "wall_ms": None}
+    if result and result.get("reason"):
+        result.setdefault("wall_ms", result.get("waited_ms"))
+    return result
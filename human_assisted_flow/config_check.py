@@ -0,0 +1,101 @@
+"""config.json の検証（ブラウザも Playwright も使わない）
+
+python ../cli.py validate から呼ばれる。main.py の load_config() は最初の問題で例外になるので、
+壊れた設定でも main.py を使わずに、問題の一覧をまとめて返せるようにしておく。
+"""
+import os
+import re
+import sys
+
+from conformance import STEP, conformance_settings
+from phase_graph import PhaseGraph, RetryPolicy
+from selector_probe import candidates
+
+# リポジトリ直下の共通モジュール（prompt_budget）を読み込めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prompt_budget import validate_templates
+
+REQUIRED_BROWSER_KEYS = ("gemini_user_data_dir", "chatgpt_user_data_dir", "gemini_url", "chatgpt_url")
+REQUIRED_SELECTORS = ("input_area", "latest_response")
+
+
+def phase_services(phases):
+    """phases（繰り返しグループの本体を含む）で使うサービス"""
+    services = set()
+    for node in phase_nodes(phases):
+        services.update(s for s in (node.get("source"), node.get("target")) if s)
+    return services
+
+
+def phase_nodes(phases):
+    """phases のノード（繰り返しグループは本体のノード）"""
+    for spec in phases:
+        yield from spec.get("nodes", []) if "repeat" in spec else [spec]
+
+
+def check_config(config):
+    """設定の問題を文字列のリストで返す（問題がなければ空）"""
+    problems = []
+    for section in ("browser_config", "selectors", "prompts", "phases"):
+        if section not in config:
+            problems.append(f"{section} がありません")
+    if problems:
+        return problems
+
+    browser_config = config['browser_config']
+    problems.extend(f"browser_config.{key} がありません" for key in REQUIRED_BROWSER_KEYS if key not in browser_config)
+
+    try:
+        graph = PhaseGraph(config['phases'])
+        inputs = graph.template_inputs()
+    except (KeyError, ValueError) as e:
+        problems.append(str(e).strip("'\""))
+        inputs = {}
+    try:
+        validate_templates(config['prompts'], {name: used for name, used in inputs.items() if name in config['prompts']})
+    except ValueError as e:
+        problems.append(str(e))
+    unknown_budgets = set(config.get('prompt_budgets', {})) - set(config['prompts'])
+    if unknown_budgets:
+        problems.append(f"prompt_budgets: 存在しないテンプレート {', '.join(sorted(unknown_budgets))}")
+
+    for service in sorted(phase_services(config['phases'])):
+        selectors = config['selectors'].get(service)
+        if selectors is None:
+            problems.append(f"selectors.{service} がありません（phases で使っています）")
+            continue
+        problems.extend(f"selectors.{service}.{key} がありません" for key in REQUIRED_SELECTORS if not selectors.get(key))
+        # 候補のリストは上から順に試すので、どれも空でない文字列にする
+        problems.extend(f"selectors.{service}.{key}: 候補は空でない文字列にしてください"
+                        for key, value in selectors.items()
+                        if value and not all(isinstance(option, str) and option.strip() for option in candidates(value)))
+
+    conformance = conformance_settings(config)
+    if conformance is not None:
+        if "{problems}" not in conformance["reask_prompt"]:
+            problems.append("conformance.reask_prompt に {problems} がありません")
+        names = conformance["spec"].names()
+        for node in phase_nodes(config['phases']):
+            unknown = [name for name in node.get("expect", ())
+                       if name not in names and not re.fullmatch(STEP + r"(?:[0-9]+|\{step\})", name)]
+            if unknown:
+                problems.append(f"{node.get('id')}.expect: フォーマット定義にない名前 {', '.join(unknown)}")
+
+    retry = RetryPolicy.from_config(config.get('retry', {}))
+    if any(not isinstance(value, (int, float)) or value < 0
+           for value in (retry.backoff_s, retry.multiplier, retry.max_backoff_s)):
+        problems.append("retry: 待ち時間は 0 以上の数にしてください")
+    for key in ("quiet_period_ms", "timeout_ms"):
+        value = config.get('completion', {}).get(key)
+        if value is not None and (not isinstance(value, int) or value <= 0):
+            problems.append(f"completion.{key} は正の整数にしてください")
+    return problems
+
+
+def summarize(config):
+    """検証に通った設定の概要（フェーズ数など）"""
+    phases = config['phases']
+    groups = sum(1 for spec in phases if "repeat" in spec)
+    return (f"phases {len(phases)}（繰り返し {groups}）, prompts {len(config['prompts'])}, "
+            f"services {', '.join(sorted(phase_services(phases)))}")
+
@@ -0,0 +1,142 @@
+"""Geminiの回答がフォーマット定義（phase_0 / format.md）に沿っているかの検証（config.json の conformance）
+
+ブラウザも API も使わず、回答テキストだけを調べる。
+
+- phases のノードの expect に書いた見出し・ブロックがあるか
+- 見出しの順番（フォーマット定義の順。ステップは 1, 2, 3… と続く番号順）
+- ステップ番号が、解決策で宣言した総ステップ数を超えていないか
+- フォーマット定義のプレースホルダー（[番号] など）や、【プロンプト】の中の [〜] {〜}、
+  「ここに〜を入れて」といった書き換え前提の指示が残っていないか
+- 【プロンプト】の後にコードブロックがあるか
+
+問題があれば main.article_flow が同じ会話で直してもらい（reask_prompt）、
+直った回答だけを ChatGPT に回す。
+"""
+import re
+
+from extractor import extract
+
+TITLE = "タイトル"
+PROMPT = "【プロンプト】"
+ANSWER = "【ChatGPTからの回答例】"
+STEP = "ステップ"
+
+CONFORMANCE_DEFAULTS = {
+    "enabled": False,
+    "format_template": "phase_0",
+    "reasks": 1,
+    "reask_prompt": ("直前の回答には、フォーマットと合わない点がありました。\n\n{problems}\n\n"
+                     "これらを直して、直前の回答と同じ出力範囲をもう一度最初から書いてください。"),
+}
+
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]*(.+?)[ \t]*$", re.M)
+# 記事タイトル（x-x：…）。inner_text では # が消えるので、なくても受け付ける
+_TITLE_RE = re.compile(r"\A\s*(?:#[ \t]*)?[0-9０-９xX]+[ \t]*[-－‐][ \t]*[0-9０-９xX]+[ \t]*[：:]")
+_STEP_RE = re.compile(r"ステップ([0-9０-９]+)")
+_TO_ASCII = str.maketrans("０１２３４５６７８９", "0123456789")
+# 日本語を含む [〜] と {〜}（[x] やリンクの [text](url)、コードの {key} は対象外）
+_PLACEHOLDER_RE = re.compile(r"\[[^\[\]\n]*[^\x00-\x7f][^\[\]\n]*\](?!\()|\{[^{}\n]*[^\x00-\x7f][^{}\n]*\}")
+_FILL_IN_RE = re.compile(r"ここに[^\n。]{0,20}?(?:入れて|入力して|書いて|貼り付けて|記入して)")
+
+
+def conformance_settings(config):
+    """conformance が有効なら既定値を補った設定と、フォーマット定義から作った FormatSpec を返す（無効なら None）"""
+    settings = dict(CONFORMANCE_DEFAULTS, **config.get('conformance', {}))
+    if not settings["enabled"]:
+        return None
+    template = config['prompts'].get(settings["format_template"], settings["format_template"])
+    return dict(settings, spec=FormatSpec.from_template(template))
+
+
+def section_name(title, level=None):
+    """見出しの文字列を、フォーマット定義の名前（原因、ステップ など）にする"""
+    if level == 1:
+        return TITLE
+    name = re.split(r"[：:]", title, maxsplit=1)[0].strip()
+    return STEP if re.fullmatch(r"ステップ(?:\[番号\]|[0-9０-９]+)", name) else name
+
+
+class FormatSpec:
+    """フォーマット定義の見出しの順番と、定義に書かれたプレースホルダー"""
+
+    def __init__(self, order, blocks, placeholders):
+        self.order = order
+        self.blocks = blocks
+        self.placeholders = placeholders
+
+    @classmethod
+    def from_template(cls, text):
+        order, blocks = [], []
+        for m in _HEADING_RE.finditer(text):
+            level = len(m.group(1))
+            name = section_name(m.group(2), level)
+            # レベル4（【プロンプト】など）は各ステップの中に繰り返し出てくるブロック
+            target = blocks if level >= 4 else order
+            if name not in target:
+                target.append(name)
+        return cls(order, blocks, sorted(set(_PLACEHOLDER_RE.findall(text))))
+
+    def names(self):
+        """expect に書ける名前（ステップは「ステップ2」「ステップ{step}」のように番号付きで書く）"""
+        return [name for name in self.order if name != STEP] + self.blocks
+
+    def check(self, text, expect=(), total_steps=None):
+        """回答の問題を文字列のリストで返す（total_steps がなければ回答自身に書かれた総ステップ数を使う）"""
+        result = extract(text)
+        headings = []
+        for section in result.sections:
+            if section["kind"] != "section":
+                continue
+            step = _STEP_RE.match(section["title"])
+            heading = (section_name(section["title"]), int(step.group(1).translate(_TO_ASCII)) if step else None)
+            # 解決策の中の手順の一覧（ステップ1：… ラストステップ：…）は、同じ見出しがもう一度
+            # 出てきたところで一覧だったと分かるので、そこまでの分を見出しから外す
+            if heading in headings:
+                del headings[headings.index(heading):]
+            headings.append(heading)
+        kinds = {section["kind"] for section in result.sections}
+
+        problems = []
+        for name in expect:
+            step = _STEP_RE.fullmatch(name)
+            if name == TITLE:
+                missing = not _TITLE_RE.match(text)
+            elif name == PROMPT:
+                missing = "prompt" not in kinds
+                if not missing and result.prompt is None:
+                    problems.append(f"{PROMPT}の後にコードブロックがありません")
+            elif name == ANSWER:
+                missing = "answer" not in kinds
+            elif step:
+                missing = (STEP, int(step.group(1).translate(_TO_ASCII))) not in headings
+            else:
+                missing = all(heading != name for heading, _ in headings)
+            if missing:
+                problems.append(f"「{name}」がありません")
+        if "解決策" in expect and result.total_steps is None:
+            problems.append("解決策に総ステップ数（「全部で3つのステップ」など）が書かれていません")
+
+        rank = {name: i for i, name in enumerate(self.order)}
+        previous = None
+        for name, number in headings:
+            if name not in rank:
+                continue
+            if previous is not None:
+                before, before_number = previous
+                if rank[name] < rank[before]:
+                    problems.append(f"見出しの順番が違います（「{before}」の後に「{name}」があります）")
+                elif name == before == STEP and number != before_number + 1:
+                    problems.append(f"ステップ番号が続いていません（ステップ{before_number} の次が ステップ{number}）")
+            previous = (name, number)
+
+        total = total_steps if total_steps is not None else result.total_steps
+        if total is not None:
+            problems.extend(f"ステップ{number} が総ステップ数（{total}）を超えています"
+                            for name, number in headings if name == STEP and number > total)
+
+        problems.extend(f"フォーマット定義のプレースホルダー {p} が残っています" for p in self.placeholders if p in text)
+        if result.prompt:
+            problems.extend(f"{PROMPT}に {p} が残っています（読者がそのまま使える具体的な文にしてください）"
+                            for p in dict.fromkeys(_PLACEHOLDER_RE.findall(result.prompt)) if p not in self.placeholders)
+            problems.extend(f"{PROMPT}に「{m}」という指示が残っています" for m in _FILL_IN_RE.findall(result.prompt))
+        return problems
@@ -0,0 +1,129 @@
+"""Geminiの回答から、プロンプト・総ステップ数・セクション境界をまとめて取り出す
+
+回答全体を1つのコンパイル済み正規表現で1回だけ走査し、目印（【プロンプト】、
+コードブロックの言語ラベル行、【ChatGPTからの回答例】、見出し、ステップ数の記述）
+の位置を集めてから、それぞれの値を組み立てる。
+"""
+import re
+
+# 全角数字も受け付ける
+_DIGITS = "0-9０-９"
+_DIGIT_CHARS = "0123456789０１２３４５６７８９"
+_TO_ASCII = str.maketrans("０１２３４５６７８９", "0123456789")
+
+# ブラウザの inner_text ではコードブロックの先頭に言語名だけの行が入る
+CODE_LABELS = ("Markdown", "markdown", "Plaintext", "plaintext", "Text", "text", "Code", "code")
+
+# どの分岐も固定の1文字で始まるようにしておくと、re はその文字以外を読み飛ばせる。
+# 改行の分岐は行頭の1文字で先に絞り込む（CODE_LABELS を増やしたら先頭文字も足すこと）
+TOKEN_RE = re.compile(
+    r"```[^\n]*\n(?s:(?P<fence>.*?))```"
+    r"|【(?P<prompt>プロンプト)】"
+    r"|\n(?=[【\n#ステラ原解まMmPpTtCc])(?:(?P<answer>【ChatGPTからの回答例】)"
+    r"|(?P<break>\n#{2,3} )"
+    r"|(?P<label>" + "|".join(CODE_LABELS) + r")(?=\r?\n)"
+    r"|(?:#{1,6}[ \t]*)?(?P<section>(?:ステップ(?P<heading_step>[" + _DIGITS + r"]+)|ラストステップ|原因|解決策|まとめ)[：:]))"
+    r"|全(?:部で)?(?P<total>[" + _DIGITS + r"]+)(?:つの|個の)?ステップ"
+    r"|ステップ(?P<step>[" + _DIGITS + r"]*)"
+)
+
+
+class Extraction:
+    """extract() の結果
+
+    prompt: ChatGPTに渡すプロンプト（見つからなければ None）
+    total_steps: 総ステップ数（見つからなければ None）
+    sections: [{"kind", "title", "start", "end"}, ...] 見出し・プロンプト・回答例の範囲
+    prompt_span: prompt の元テキスト上の (start, end)
+    """
+
+    def __init__(self, prompt, total_steps, sections, prompt_span):
+        self.prompt = prompt
+        self.total_steps = total_steps
+        self.sections = sections
+        self.prompt_span = prompt_span
+
+    def __repr__(self):
+        return f"Extraction(prompt={len(self.prompt or '')} chars, total_steps={self.total_steps}, sections={len(self.sections)})"
+
+
+def extract(text):
+    """回答テキストを1回走査して Extraction を返す"""
+    if not text:
+        return Extraction(None, None, [], None)
+
+    # 先頭行も「改行の直後」として扱えるように1文字足して走査する（位置は -1 して戻す）
+    scanned = "\n" + text
+    prompt_pos = None
+    label_end = None
+    prompt_end = None
+    last_fence = None
+    explicit_total = None
+    max_step = None
+    starts = []
+
+    for m in TOKEN_RE.finditer(scanned):
+        kind = m.lastgroup
+        if kind == "fence":
+            last_fence = (m.start("fence") - 1, m.end("fence") - 1)
+        elif kind == "prompt":
+            starts.append(("prompt", "【プロンプト】", m.start() - 1))
+            if prompt_pos is None:
+                prompt_pos = m.start() - 1
+        elif kind == "label":
+            if prompt_pos is not None and label_end is None:
+                label_end = m.end() - 1
+        elif kind in ("answer", "break"):
+            if kind == "answer":
+                starts.append(("answer", "【ChatGPTからの回答例】", m.start("answer") - 1))
+            if label_end is not None and prompt_end is None:
+                prompt_end = m.start() - 1
+        elif kind == "section":
+            # 見出しの行内（「全3ステップ」など）も続けて走査するので、タイトルは行末まで切り出す
+            line_end = scanned.find("\n", m.end())
+            title = scanned[m.start("section"):line_end if line_end != -1 else len(scanned)].strip()
+            starts.append(("section", title, m.start("section") - 1))
+            if m.group("heading_step"):
+                step = int(m.group("heading_step").translate(_TO_ASCII))
+                max_step = step if max_step is None else max(max_step, step)
+        elif kind == "step" and m.group("step"):
+            step = int(m.group("step").translate(_TO_ASCII))
+            max_step = step if max_step is None else max(max_step, step)
+        elif kind in ("total", "step"):
+            # プロンプト本文の中の「5〜6ステップで」などは数えない
+            if explicit_total is not None or (label_end is not None and prompt_end is None):
+                continue
+            if kind == "total":
+                digits = m.group("total")
+            elif scanned[m.start() - 2:m.start()] in ("つの", "個の"):
+                # 「3つのステップ」の数字は直前にあるので、そこまで戻って読む
+                digits_end = digits_start = m.start() - 2
+                while digits_start > 0 and scanned[digits_start - 1] in _DIGIT_CHARS:
+                    digits_start -= 1
+                digits = scanned[digits_start:digits_end]
+            else:
+                continue
+            if digits:
+                explicit_total = int(digits.translate(_TO_ASCII))
+
+    prompt = None
+    prompt_span = None
+    if label_end is not None:
+        end = prompt_end if prompt_end is not None else len(text)
+        candidate = text[label_end:end].strip()
+        if candidate:
+            prompt = candidate
+            prompt_span = (label_end, end)
+    if prompt is None and last_fence is not None:
+        candidate = text[last_fence[0]:last_fence[1]].strip()
+        if candidate:
+            prompt = candidate
+            prompt_span = last_fence
+
+    sections = []
+    for i, (kind, title, start) in enumerate(starts):
+        end = starts[i + 1][2] if i + 1 < len(starts) else len(text)
+        sections.append({"kind": kind, "title": title, "start": start, "end": end})
+
+    total_steps = explicit_total if explicit_total is not None else max_step
+    return Extraction(prompt, total_steps, sections, prompt_span)
@@ -0,0 +1,65 @@
+"""軽量ブラウザモード（config.json の lean）
+
+長い作業で多くのフローを流しても、メモリと1回あたりの DOM 探索のコストが増えないようにする。
+
+- Gemini と ChatGPT に同じプロファイル（shared_user_data_dir）でログインしていれば、
+  Chromium を1つだけ起動して両方のタブを開く
+- 回答の抽出に使わない画像・フォント・動画と、計測用の通信（telemetry）を読み込まない
+- フローごとに新しいチャットを開く。1本のフローの中でも、ページの DOM が
+  max_dom_nodes を超えたら新しいチャットに切り替え、それまでの会話（Phase_0 の
+  フォーマット定義から）を1つのメッセージで引き継ぐ（main.reseeding_flow）
+"""
+import fnmatch
+
+LEAN_DEFAULTS = {
+    "enabled": False,
+    "shared_user_data_dir": None,
+    "block_resource_types": ["image", "font", "media"],
+    "block_urls": [
+        "*google-analytics.com/*", "*googletagmanager.com/*", "*play.google.com/log*", "*/gen_204*",
+        "*ab.chatgpt.com/*", "*/ces/v1/*", "*browser-intake-datadoghq.com/*", "*sentry.io/*",
+        "*featuregates.org/*", "*statsig*",
+    ],
+    "fresh_chat_per_flow": True,
+    "max_dom_nodes": 30000,
+}
+
+
+def lean_settings(config):
+    """lean が有効なら既定値を補った設定を、無効なら None を返す"""
+    settings = dict(LEAN_DEFAULTS, **config.get('lean', {}))
+    return settings if settings["enabled"] else None
+
+
+def should_block(resource_type, url, settings):
+    """抽出に不要なリクエストなら True"""
+    if resource_type in settings["block_resource_types"]:
+        return True
+    return any(fnmatch.fnmatch(url, pattern) for pattern in settings["block_urls"])
+
+
+def install_blocking(context, settings, stats):
+    """コンテキストのすべてのタブで、不要なリクエストを読み込まない（stats["blocked"] に件数を数える）"""
+    def handle(route):
+        request = route.request
+        if should_block(request.resource_type, request.url, settings):
+            stats["blocked"] = stats.get("blocked", 0) + 1
+            route.abort()
+        else:
+            route.continue_()
+
+    context.route("**/*", handle)
+
+
+def dom_size(page):
+    """ページの要素数（取得できなければ 0）"""
+    try:
+        return page.evaluate("() => document.getElementsByTagName('*').length")
+    except Exception:
+        return 0
+
+
+def open_fresh_chat(page, url, reason):
+    """新しいチャットを開く（前の会話の DOM はここで破棄される）"""
+    print(f"新しいチャットを開きます（{reason}）: {url}")
+    page.goto(url)
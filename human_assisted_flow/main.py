@@ -1,21 +1,118 @@
+import argparse
+import functools
+import hashlib
 import json
 import os
+import re
+import sys
 import time
 import pyperclip
-import re
-from playwright.sync_api import sync_playwright
+from artifacts import ArtifactWriter, screenshot_options
+from extractor import extract
+from lean import dom_size, install_blocking, lean_settings, open_fresh_chat
+from conformance import conformance_settings
+from completion import log_completion, poll_watch, snapshot_responses, start_watch, wait_for_completion
+from phase_graph import PhaseGraph, RetryPolicy
+from pool import SERVICE_LABELS, FlowSlot, render_status
+from selector_probe import SelectorResolver
+
+# リポジトリ直下の共通モジュール（llm_cache など）を読み込めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from checkpoint import Checkpoint
+from llm_cache import CacheMiss, cache_from_env
+from prompt_budget import PromptAssembler, PromptTemplate
+from similar_prompts import DEFAULT_THRESHOLD, PromptIndex
+from tracing import Tracer, text_stats
+
+# config.json はこのファイルの隣のものを使う（作業ディレクトリによらない）
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+
+# 設定と、そこから作るもの。import しただけでは読み込まず、main() とサブコマンドが load_config() で用意する
+config = None
+config_path = None
+# 各テンプレートが受け取るプレースホルダー（phases の inputs から決め、読み込み時に過不足を検証する）
+PROMPT_PLACEHOLDERS = {}
+prompt_assembler = None
+# 前のノードの回答がないときに {previous_response} に入れる文
+MISSING_RESPONSE = "（前のステップの回答が取得できませんでした）"
+
+# 回答キャッシュ（main() で初期化）と、(フロー, サービス) ごとの会話履歴ハッシュ
+response_cache = None
+conversation_context = {}
+replayed_services = set()
+
+# 似たプロンプトの過去の回答の索引（main() で初期化）。プールモードでは確認せずに使う
+similar_index = None
+similar_auto = False
+
+# フローフォルダーごとのチェックポイントと、チェックポイントから復元中のフロー
+CHECKPOINT_FILE = "checkpoint.json"
+active_checkpoints = {}
+restoring_flows = set()
+
+# 新しいチャットに、それまでの会話（Phase_0 のフォーマット定義から）を引き継ぐ依頼。最終記事には入れない
+# dom_baselines は (フロー, サービス) ごとの、引き継いだ直後のページの要素数
+RESEED_PHASE = "Phase_0_Reseed"
+RESEED_PROMPT = ("これまでの会話を新しいチャットに引き継ぎます。以下は前のチャットでのやり取りで、"
+                 "最初の依頼の決まりはこの後もすべて守ってください。\n"
+                 "この後の依頼には、この会話の続きとして答えてください。このメッセージには「了解しました」とだけ答えてください。\n\n"
+                 "{history}")
+dom_baselines = {}
+
+# 軽量ブラウザモードの設定（無効なら None）と、読み込まなかったリクエストの数
+lean = None
+lean_stats = {}
+
+# フォーマット検証の設定（無効なら None）。expect のあるノードの回答に問題があれば、先に進む前に直してもらう
+conformance = None
+
+# 要素ごとのセレクターの候補から今使うものを選んで覚えておく（ログイン直後に probe_selectors で確かめる）
+selector_resolver = None
+# どの候補も見つからなかった要素を待つ時間と、入力欄をクリックできるまで待つ時間（ミリ秒）
+BROKEN_SELECTOR_TIMEOUT_MS = 5000
+INPUT_AREA_TIMEOUT_MS = 5000
+
+# フローフォルダーごとの成果物の書き出しスレッド
+artifact_writers = {}
 
-# Load configuration
-with open('config.json', 'r', encoding='utf-8') as f:
-    config = json.load(f)
+# (フローフォルダー, サービス) ごとの計測中のフェーズ（スパン）と、次の再試行に計上する待機時間
+TRACE_FILE = "trace.jsonl"
+active_spans = {}
+retry_sleeps = {}
 
-def ensure_directories():
-    """フロー実行ごとにタイムスタンプ付きフォルダを作成"""
+def load_config(path=CONFIG_PATH):
+    """config.json を読み込み、テンプレート、軽量モード、フォーマット検証、セレクターの設定を用意して返す
+
+    同じファイルは2回目からは読み込まず、用意済みの設定を返す。
+    """
+    global config, config_path, PROMPT_PLACEHOLDERS, prompt_assembler, lean, conformance, selector_resolver
+    path = os.path.abspath(path)
+    if config is not None and path == config_path:
+        return config
+    with open(path, 'r', encoding='utf-8') as f:
+        loaded = json.load(f)
+    placeholders = {name: inputs for name, inputs in PhaseGraph(loaded['phases']).template_inputs().items()
+                    if name in loaded['prompts']}
+    prompt_assembler = PromptAssembler(loaded['prompts'], loaded.get('prompt_budgets', {}), placeholders)
+    PROMPT_PLACEHOLDERS = placeholders
+    lean = lean_settings(loaded)
+    conformance = conformance_settings(loaded)
+    selector_resolver = SelectorResolver(loaded['selectors'])
+    config, config_path = loaded, path
+    return config
+
+def get_prompt_assembler():
+    """config.json の prompts から作ったテンプレート（未読み込みなら読み込む）"""
+    load_config()
+    return prompt_assembler
+
+def ensure_directories(suffix=""):
+    """フロー実行ごとにタイムスタンプ付きフォルダを作成（suffix は同時に作る複数フローの区別用）"""
     from datetime import datetime
     
     # タイムスタンプ付きフォルダ名を生成
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    flow_folder = f"output/flow_{timestamp}"
+    flow_folder = f"output/flow_{timestamp}{suffix}"
     
     # 各サブフォルダを作成
     os.makedirs(f"{flow_folder}/screenshots", exist_ok=True)
@@ -26,18 +123,62 @@ def ensure_directories():
 
 def append_to_final_article(text, phase_name, flow_folder):
     """最終記事ファイルにテキストを追記"""
-    # Phase_0_Format は除外（フォーマット定義の確認応答のみなので不要）
-    if phase_name == "Phase_0_Format":
+    # Phase_0_Format と会話の引き継ぎは除外（確認応答のみなので不要）
+    if phase_name in ("Phase_0_Format", RESEED_PHASE):
+        return
+    # 復元中のフェーズは前回の実行で追記済み
+    if flow_folder in restoring_flows:
         return
     
-    # Phase情報のヘッダーは追加せず、Geminiの回答をそのまま保存
-    with open(f"{flow_folder}/final_article.md", "a", encoding="utf-8") as f:
-        f.write(f"\n\n{text}")
+    # Phase情報のヘッダーは追加せず、Geminiの回答をそのまま保存（書き出しはバックグラウンド）
+    artifacts(flow_folder).append_section(phase_name, text)
+    
+    checkpoint = active_checkpoints.get(flow_folder)
+    if checkpoint is not None:
+        checkpoint.data["article"].append({"phase": phase_name, "text": text})
+        checkpoint.save()
+
+def artifacts(flow_folder):
+    """フローフォルダーの成果物の書き出しスレッドを返す（なければ起動する）"""
+    writer = artifact_writers.get(flow_folder)
+    if writer is None:
+        writer = ArtifactWriter(flow_folder, config.get('artifacts', {}).get('dedupe_screenshots', True))
+        artifact_writers[flow_folder] = writer
+    return writer
 
-def get_latest_response(page, selector):
+def archive_finished_flow(flow_folder):
+    """config の artifacts.archive が true なら、完了したフローを output/archive.sqlite3 に取り込む"""
+    if not config.get('artifacts', {}).get('archive', False):
+        return
+    from archive import RunArchive
+    with RunArchive(os.path.join(os.path.dirname(os.path.abspath(flow_folder)), "archive.sqlite3")) as archive:
+        files, _ = archive.import_folder(flow_folder)
+    print(f"アーカイブに {len(files)} ファイルを取り込みました: {flow_folder}")
+
+def close_artifacts(flow_folder):
+    """書き出し待ちの成果物をすべて書き終えてからスレッドを止める"""
+    writer = artifact_writers.pop(flow_folder, None)
+    if writer is not None:
+        writer.close()
+
+def get_latest_response(page, selector, timeout=120000):
+    service = page_service(page)
+    options = selector_resolver.fallbacks(service, 'latest_response', selector)
+    if selector_resolver.is_broken(service, 'latest_response'):
+        # どの候補も見つからなかった要素は、フェーズごとに長く待たない
+        timeout = min(timeout, BROKEN_SELECTOR_TIMEOUT_MS)
     print(f"回答要素を待機中: {selector}")
     try:
-        page.wait_for_selector(selector, timeout=120000) # 2 min timeout
+        # 候補のどれか（CSS のセレクターリスト）が現れるまで待つ
+        page.wait_for_selector(", ".join(options), timeout=timeout) # default 2 min timeout
+        if len(options) > 1 and page.query_selector(selector) is None:
+            # 今のセレクターでは見つからないので、見つかった候補に切り替えて覚える
+            selector = selector_resolver.recover(page, service, 'latest_response') or selector
+            print(f"回答要素のセレクターを切り替えました: {selector}")
+        if lean:
+            # 最後の要素だけを扱う（会話が長くなっても、全要素のハンドルを受け取らない）
+            last_element = page.locator(selector).last
+            return last_element.inner_text(), last_element
         elements = page.query_selector_all(selector)
         if not elements:
             return None, None
@@ -46,79 +187,42 @@ def get_latest_response(page, selector):
         return text, last_element
     except Exception as e:
         print(f"回答の取得に失敗しました: {e}")
+        # 候補が1つだけでも、見つからなければ壊れていると記録し、次のフェーズからは長く待たない
+        selector_resolver.recover(page, service, 'latest_response')
         return None, None
 
 def extract_total_steps(text):
     """Geminiの回答から総ステップ数を抽出する"""
-    if not text:
-        return None
-    
-    # パターン1: "全部でN個のステップ"
-    match = re.search(r'全部で(\d+)個のステップ', text)
-    if match:
-        return int(match.group(1))
-    
-    # パターン2: "ステップN" の最大値を探す
-    matches = re.findall(r'ステップ(\d+)', text)
-    if matches:
-        return max(map(int, matches))
-        
-    return None
+    return extract(text).total_steps
 
 def extract_code_block(text):
-    """テキストから最後のコードブロックまたはプロンプトを抽出する"""
-    if not text:
-        return None
-    
-    # パターン1: 【プロンプト】セクションから抽出
-    # より確実な方法：【プロンプト】を見つけ、その後の「Markdown」を見つけ、
-    # そこから次の大きなセクション（【ChatGPTからの回答例】または次の###/##）まで取得
-    
-    # まず【プロンプト】の位置を探す
-    prompt_start = text.find('【プロンプト】')
-    if prompt_start != -1:
-        # 【プロンプト】以降のテキスト
-        after_prompt = text[prompt_start:]
-        
-        # 「Markdown」または「markdown」の位置を探す
-        markdown_pos = -1
-        for marker in ['Markdown\n', 'markdown\n', 'Markdown\r\n', 'markdown\r\n']:
-            pos = after_prompt.find(marker)
-            if pos != -1:
-                markdown_pos = pos + len(marker)
-                break
-        
-        if markdown_pos != -1:
-            # Markdown以降のテキスト
-            prompt_content = after_prompt[markdown_pos:]
-            
-            # 終了位置を探す：【ChatGPTからの回答例】または次の大きなセクション
-            end_markers = [
-                '\n【ChatGPTからの回答例】',
-                '\n\n### ',  # 次のステップ
-                '\n\n## ',   # 次の大セクション
-            ]
-            
-            end_pos = len(prompt_content)  # デフォルトは最後まで
-            for marker in end_markers:
-                pos = prompt_content.find(marker)
-                if pos != -1 and pos < end_pos:
-                    end_pos = pos
-            
-            extracted = prompt_content[:end_pos].strip()
-            if extracted:
-                return extracted
-    
-    # パターン2: 通常のコードブロック (```...```)
-    matches = re.findall(r'```(?:.*?)?\n(.*?)```', text, re.DOTALL)
-    if matches:
-        return matches[-1].strip()
-    
-    return None
+    """テキストから【プロンプト】のコードブロック（なければ最後のコードブロック）を抽出する"""
+    return extract(text).prompt
 
-def run_phase(phase_name, source_page, target_page, prompt, source_selectors, target_selectors, flow_folder):
+def build_prompt(name, values, flow_folder):
+    """テンプレートからプロンプトを組み立てる（予算超過時は前の回答を要約し、削った行を記録）"""
+    assembled = get_prompt_assembler().assemble(name, values, log_path=f"{flow_folder}/prompt_cuts.jsonl")
+    if assembled.cuts:
+        removed = sum(len(lines) for lines in assembled.cuts.values())
+        print(f"プロンプトが予算（{assembled.budget} トークン）を超えたため、前の回答を {removed} 行省略しました。")
+    return assembled.text
+
+def save_response_text(response_text, phase_name, service, flow_folder):
+    """回答テキストを保存し、最終記事に追記する"""
+    artifacts(flow_folder).write_text(f"{service}_output/{phase_name}.txt", response_text)
+    append_to_final_article(response_text, phase_name, flow_folder)
+
+def page_service(page):
+    """ページのURLからサービス名（gemini / chatgpt）を判定する"""
+    return "gemini" if "gemini" in str(page.url) else "chatgpt"
+
+def begin_phase(phase_name, target_page, prompt, target_selectors):
+    """プロンプトをターゲットの入力欄に貼り付け、送信前の回答の状態（基準値）を返す"""
     print(f"\n=== フェーズ開始: {phase_name} ===")
     
+    # 送信前の回答数を記録しておき、新しい回答が出たことを判定する基準にする
+    baseline = snapshot_responses(target_page, target_selectors['latest_response'])
+    
     # 1. Copy Prompt
     pyperclip.copy(prompt)
     print(f"プロンプトをクリップボードにコピーしました。")
@@ -131,45 +235,61 @@ def run_phase(phase_name, source_page, target_page, prompt, source_selectors, ta
     except:
         pass
     
-    try:
-        target_page.click(target_selectors['input_area'])
-        print("入力欄への貼り付けを試みています...")
-        target_page.locator(target_selectors['input_area']).fill(prompt)
-    except Exception as e:
-        print(f"自動入力に失敗しました: {e}")
-        print("手動でプロンプトを貼り付けてください (Ctrl+V)。")
+    service = page_service(target_page)
+    input_area = target_selectors['input_area']
+    if selector_resolver.is_broken(service, 'input_area'):
+        # 起動時の確認や前のフェーズで見つからなかった入力欄は、クリックを待たずに候補を調べ直す
+        input_area = selector_resolver.recover(target_page, service, 'input_area')
+    while input_area is not None:
+        try:
+            target_page.click(input_area, timeout=INPUT_AREA_TIMEOUT_MS)
+            print("入力欄への貼り付けを試みています...")
+            target_page.locator(input_area).fill(prompt)
+            return baseline
+        except Exception as e:
+            print(f"自動入力に失敗しました: {e}")
+            recovered = selector_resolver.recover(target_page, service, 'input_area')
+            if recovered == input_area:
+                break
+            input_area = recovered
+            if input_area:
+                print(f"入力欄のセレクターを切り替えました: {input_area}")
+    print("手動でプロンプトを貼り付けてください (Ctrl+V)。")
     
-    target_service = "Gemini" if "gemini" in str(target_page.url) else "ChatGPT"
-    print(f"\n>>> アクションが必要です: 【{target_service}】 のブラウザで送信ボタン(Enter)を押してください <<<")
-    print(">>> 回答が完了したら、このターミナルで Enter キーを押して進んでください <<<")
-    input() 
+    return baseline
+
+def finish_phase(phase_name, target_page, target_selectors, flow_folder, detected):
+    """回答を抽出して保存する（抽出できなければ手動入力を求める）"""
+    service = page_service(target_page)
+    
+    span = phase_span(flow_folder, service)
     
     # 3. Extract Response
     print(f"回答を抽出しています...")
-    response_text, response_element = get_latest_response(target_page, target_selectors['latest_response'])
+    # 完了を検出済みなら要素は既にあるので、長く待たない
+    with span.timed("extract_s"):
+        response_text, response_element = get_latest_response(
+            target_page, target_selectors['latest_response'], timeout=5000 if detected else 120000
+        )
     
     if response_text:
         print("回答の抽出に成功しました。")
         
         # Save text
-        if "gemini" in str(target_page.url):
-            filename = f"{flow_folder}/gemini_output/{phase_name}.txt"
-        else:
-            filename = f"{flow_folder}/chatgpt_output/{phase_name}.txt"
-        
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(response_text)
+        with span.timed("io_s"):
+            save_response_text(response_text, phase_name, service, flow_folder)
         
-        append_to_final_article(response_text, phase_name, flow_folder)
-        
-        # Save screenshot
+        # Save screenshot（撮影だけここで行い、保存はバックグラウンド）
         if response_element:
-            screenshot_path = f"{flow_folder}/screenshots/{phase_name}.png"
-            response_element.screenshot(path=screenshot_path)
+            options = screenshot_options(config.get('artifacts', {}))
+            with span.timed("screenshot_s"):
+                image = response_element.screenshot(**options)
+            artifacts(flow_folder).save_screenshot(phase_name, image, options["type"])
     else:
         print("警告: 回答テキストを抽出できませんでした。")
         print("次のステップのために、回答テキストを手動で入力（貼り付け）してください（スキップする場合はそのままEnter）:")
-        manual_input = input()
+        with span.timed("human_wait_s"):
+            manual_input = input()
         if manual_input.strip():
             response_text = manual_input
         else:
@@ -177,260 +297,1061 @@ def run_phase(phase_name, source_page, target_page, prompt, source_selectors, ta
         
     return response_text
 
-def main():
-    flow_folder = ensure_directories()
-    print(f"\n=== 出力フォルダ: {flow_folder} ===")
+def run_phase(phase_name, source_page, target_page, prompt, source_selectors, target_selectors, flow_folder):
+    completion_config = config.get('completion', {})
+    span = phase_span(flow_folder, page_service(target_page))
+    with span.timed("paste_s"):
+        baseline = begin_phase(phase_name, target_page, prompt, target_selectors)
     
-    # User Input for Phase 1
-    print("\n=== 初期設定 ===")
-    problem_settings = input("『問題設定』を入力してください (または貼り付け): ")
-    solution_hints = input("『解決手法のヒント』を入力してください (任意、スキップはEnter): ")
+    target_service = "Gemini" if page_service(target_page) == "gemini" else "ChatGPT"
+    print(f"\n>>> アクションが必要です: 【{target_service}】 のブラウザで送信ボタン(Enter)を押してください <<<")
     
-    with sync_playwright() as p:
-        browser_config = config['browser_config']
-        
-        args = [
-            "--disable-blink-features=AutomationControlled",
-            "--no-sandbox",
-            "--disable-infobars"
-        ]
-
-        # Launch Gemini Browser
-        gemini_user_data = os.path.abspath(browser_config['gemini_user_data_dir'])
-        print(f"Gemini ブラウザを起動中 (User Data: {gemini_user_data})...")
-        context_gemini = p.chromium.launch_persistent_context(
-            gemini_user_data,
-            headless=browser_config['headless'],
-            channel=browser_config.get('channel', 'chrome'),
-            args=args,
-            ignore_default_args=["--enable-automation"]
+    detected = False
+    if completion_config.get('enabled', True):
+        print(">>> 回答の完了は自動で検出します。送信後はそのままお待ちください <<<")
+        result = wait_for_completion(
+            target_page, target_selectors, baseline,
+            completion_config.get('quiet_period_ms', 2000),
+            completion_config.get('timeout_ms', 600000),
         )
-        page_gemini = context_gemini.pages[0]
-        page_gemini.goto(config['browser_config']['gemini_url'])
-
-        # Launch ChatGPT Browser
-        chatgpt_user_data = os.path.abspath(browser_config['chatgpt_user_data_dir'])
-        print(f"ChatGPT ブラウザを起動中 (User Data: {chatgpt_user_data})...")
-        context_chatgpt = p.chromium.launch_persistent_context(
-            chatgpt_user_data,
-            headless=browser_config['headless'],
-            channel=browser_config.get('channel', 'chrome'),
-            args=args,
-            ignore_default_args=["--enable-automation"]
-        )
-        page_chatgpt = context_chatgpt.pages[0]
-        page_chatgpt.goto(config['browser_config']['chatgpt_url'])
-        
-        print("\n--- 両方のサービスにログインしてください ---")
-        print("準備ができたら、このターミナルで Enter キーを押してフローを開始してください。")
-        input()
-        
-        gemini_sel = config['selectors']['gemini']
-        chatgpt_sel = config['selectors']['chatgpt']
-        prompts = config['prompts']
-        
-        # --- Phase 0: Format Definition ---
-        # User -> Gemini
-        run_phase("Phase_0_Format", None, page_gemini, prompts['phase_0'], None, gemini_sel, flow_folder)
-        
-        # --- Phase 1: Intro & Step 1 ---
-        # User -> Gemini
-        p1_prompt = prompts['phase_1'].replace("{problem_settings}", problem_settings).replace("{solution_hints}", solution_hints)
-        gemini_resp_1 = run_phase("Phase_1_Intro_Step1", None, page_gemini, p1_prompt, None, gemini_sel, flow_folder)
+        log_completion(result, phase_name, page_service(target_page), flow_folder)
+        trace_completion(span, result)
+        detected = result["reason"] == "stable"
+    
+    if not detected:
+        print(">>> 回答が完了したら、このターミナルで Enter キーを押して進んでください <<<")
+        with span.timed("human_wait_s"):
+            input() 
+    
+    return finish_phase(phase_name, target_page, target_selectors, flow_folder, detected)
+
+def lookup_cached_response(service, prompt, flow_folder):
+    """同じ会話のキャッシュ済み回答を探す。戻り値は (キー, 回答 または None)"""
+    if response_cache is None:
+        return None, None
+    # 同じチャット内のそれまでのやり取り（Phase_0 のフォーマット定義を含む）もキーに含める
+    context = conversation_context.get((flow_folder, service), "")
+    key = response_cache.make_key(f"{service}-web", None, context, prompt)
+    cached = response_cache.get(key)  # リプレイモードではミス時に CacheMiss
+    if cached is None:
+        cached = find_similar_response(service, prompt)
+    return key, cached
+
+def similar_services():
+    return config.get('similar_prompts', {}).get('services', ["chatgpt"])
+
+def find_similar_response(service, prompt):
+    """似たプロンプトの過去の回答を探し、使うなら返す（通常モードでは使うか確認する）"""
+    if similar_index is None or service not in similar_services():
+        return None
+    threshold = config.get('similar_prompts', {}).get('threshold', DEFAULT_THRESHOLD)
+    match = similar_index.find(f"{service}-web", prompt, threshold)
+    if match is None:
+        return None
+    print(f"\n似たプロンプトへの過去の回答があります（類似度 {match.similarity:.2f}）:")
+    print("  " + match.response[:200].replace("\n", "\n  ") + ("…" if len(match.response) > 200 else ""))
+    if not similar_auto and input("この回答を使いますか？ [y/N]: ").strip().lower() not in ("y", "yes"):
+        similar_index.used(accepted=False)
+        return None
+    similar_index.used()
+    return match.response
+
+def record_response(service, prompt, response_text, key, cached, phase_name, flow_folder):
+    """ブラウザで得た回答をキャッシュに保存し、会話履歴ハッシュを進める"""
+    if response_cache is None:
+        return
+    chat = (flow_folder, service)
+    if cached is None and response_text:
+        response_cache.put(key, response_text, phase=phase_name, service=service)
+        if similar_index is not None and service in similar_services():
+            similar_index.add(f"{service}-web", prompt, response_text)
+    
+    if cached is not None:
+        replayed_services.add(chat)
+    else:
+        replayed_services.discard(chat)
+    advance_conversation(service, prompt, response_text, flow_folder)
+
+def advance_conversation(service, prompt, response_text, flow_folder):
+    """会話履歴ハッシュに1往復分を加える"""
+    chat = (flow_folder, service)
+    context = conversation_context.get(chat, "")
+    conversation_context[chat] = hashlib.sha256(
+        json.dumps([context, prompt, response_text], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+def phase_span(flow_folder, service):
+    """service のタブで計測中のフェーズのスパンを返す（計測していなければ何も書き出さないスパン）"""
+    span = active_spans.get((flow_folder, service))
+    return span if span is not None else Tracer(None).span("phase")
+
+def trace_completion(span, result):
+    """完了検出の結果をスパンに記録する
+    
+    ttft_s は貼り付けから回答が出始めるまでの時間で、人が送信ボタンを押すまでの時間を含む。
+    """
+    if result.get("first_change_ms") is not None:
+        span.set(ttft_s=result["first_change_ms"] / 1000)
+    if result.get("wall_ms") is not None:
+        span.set(detect_s=result["wall_ms"] / 1000)
+    span.set(completion=result["reason"])
+
+def use_cached_response(phase_name, service, cached, flow_folder):
+    """キャッシュ済みの回答をブラウザで得た回答と同じように保存する"""
+    print(f"\n=== フェーズ開始: {phase_name}（キャッシュ済みの回答を使用） ===")
+    phase_span(flow_folder, service).set(cached=True)
+    save_response_text(cached, phase_name, service, flow_folder)
+    return cached
+
+def warn_if_replayed(service, flow_folder):
+    if (flow_folder, service) in replayed_services:
+        print(f"注意: {service} の前のフェーズはキャッシュから再生したため、ブラウザ側の会話には含まれていません。")
+
+def run_cached_phase(phase_name, source_page, target_page, prompt, source_selectors, target_selectors, flow_folder):
+    """キャッシュに同じ会話の回答があればブラウザ操作を省略し、なければ run_phase を実行する"""
+    service = page_service(target_page)
+    key, cached = lookup_cached_response(service, prompt, flow_folder)
+    
+    if cached is not None:
+        response_text = use_cached_response(phase_name, service, cached, flow_folder)
+    else:
+        warn_if_replayed(service, flow_folder)
+        response_text = run_phase(phase_name, source_page, target_page, prompt, source_selectors, target_selectors, flow_folder)
+    
+    record_response(service, prompt, response_text, key, cached, phase_name, flow_folder)
+    return response_text
+
+class PhaseRequest:
+    """フローからの依頼: target のタブにプロンプトを送り、回答テキストを受け取る（attempt は再試行の何回目か）"""
+    def __init__(self, phase_name, source, target, prompt, attempt=1):
+        self.phase_name = phase_name
+        self.source = source
+        self.target = target
+        self.prompt = prompt
+        self.attempt = attempt
+
+class ManualRequest:
+    """フローからの依頼: 自動実行に失敗したので人が実行し、target の最新の回答を読み取る"""
+    def __init__(self, phase_name, target):
+        self.phase_name = phase_name
+        self.target = target
+        self.prompt = None
+        self.attempt = 1
+
+def pause_before_retry(flow_folder, seconds=2):
+    """再試行の前に少し待つ（待った時間は次の試行のスパンに retry_sleep_s として記録する）"""
+    time.sleep(seconds)
+    retry_sleeps[flow_folder] = retry_sleeps.get(flow_folder, 0) + seconds
+
+def service_label(service):
+    return SERVICE_LABELS.get(service, service)
+
+@functools.lru_cache(maxsize=16)
+def extraction(text):
+    """回答の抽出結果（同じ回答からプロンプトとステップ数の両方を読むので、結果を使い回す）"""
+    return extract(text or "")
+
+def node_prompt(graph, node, values, flow_folder):
+    """ノードに送るプロンプト。extractor で抽出できなかった場合は None"""
+    previous = graph.value(node.source_node) if node.source_node else None
+    if node.extractor:
+        return extraction(previous).prompt
+    if not previous and "previous_response" in node.inputs:
+        previous = MISSING_RESPONSE
+    values = dict(values, previous_response=previous or "")
+    if node.template in get_prompt_assembler().templates:
+        return build_prompt(node.template, {key: values[key] for key in node.inputs}, flow_folder)
+    # config.json の prompts にない名前は、テンプレートの本文として扱う
+    return PromptTemplate(node.template, node.id).render(values)
+
+def repeat_count(graph, group):
+    """繰り返しグループの周回数を、count_from の回答の総ステップ数から決める"""
+    print("\n=== 設定確認 ===")
+    extracted_steps = extraction(graph.value(group.count_from)).total_steps
+    if extracted_steps:
+        print(f"Geminiの回答から総ステップ数を検出しました: {extracted_steps}")
+        total_steps = extracted_steps
+    else:
+        try:
+            total_steps = int(input("総ステップ数を自動検出できませんでした。Geminiが決めたステップ数を入力してください (例: 3): "))
+        except:
+            total_steps = group.default
+    return max(0, total_steps + group.offset)
+
+def check_conformance(node, response, total_steps, flow_folder):
+    """回答をフォーマット定義と照らし合わせて問題の一覧を返し、conformance_log.jsonl に記録する"""
+    if conformance is None or not node.expect or not (response and response.strip()):
+        return []
+    problems = conformance["spec"].check(response, node.expect, total_steps)
+    entry = {"phase": node.name, "timestamp": time.time(), "problems": problems}
+    with open(f"{flow_folder}/conformance_log.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return problems
+
+def reask_prompt(problems):
+    """問題の箇所だけを直してもらうプロンプト"""
+    template = PromptTemplate(conformance["reask_prompt"], "conformance.reask_prompt")
+    return template.render({"problems": "\n".join(f"- {problem}" for problem in problems)})
+
+def manual_fallback(node, flow_folder):
+    """自動実行に失敗したノードを人に実行してもらい、その回答を返す"""
+    label = service_label(node.target)
+    print("\n自動実行に失敗しました。手動で実行してください。")
+    for line in node.manual.get('instructions', []):
+        print(line)
+    print(f">>> {label}の回答が出たら、ここで Enter キーを押してください。 <<<")
+    response = yield ManualRequest(node.name, node.target)
+    if response:
+        append_to_final_article(response, node.manual.get('article', node.name), flow_folder)
+        if node.manual.get('save_as'):
+            artifacts(flow_folder).write_text(node.manual['save_as'], response)
+        return response
+    print(f"警告: {label}の回答を自動取得できませんでした。")
+    print("次のステップのために、回答テキストを手動で入力（貼り付け）してください:")
+    return input()
+
+def article_flow(problem_settings, solution_hints, flow_folder, graph=None):
+    """記事1本分のフェーズを、config.json の phases（フェーズのグラフ）に従って進めるジェネレーター
+    
+    ブラウザ操作が必要になるたびに PhaseRequest / ManualRequest を yield し、
+    回答テキストを受け取る。依存関係のないノードが別々のサービス宛てに同時に
+    実行できるときは PhaseRequest のリストを yield し、回答（失敗したものは例外）の
+    リストを受け取る。ブラウザの操作は drive_flow（通常モード）または
+    run_pool（プールモード）が担当する。
+    
+    失敗（例外、retry_empty のノードでは空の回答）は、全ノード共通の RetryPolicy で
+    待ち時間を延ばしながら再試行し、使い切ったら manual の手順で人に実行してもらう。
+    
+    expect のあるノードの回答は conformance で検証し、問題があれば次のノード（ChatGPT への
+    送信など）に進む前に、同じ会話で問題の箇所を直してもらう（reasks 回まで）。
+    """
+    graph = graph or PhaseGraph(config['phases'])
+    policy = RetryPolicy.from_config(config.get('retry', {}))
+    values = {"problem_settings": problem_settings, "solution_hints": solution_hints}
+    attempts = {}
+    announced = set()
+    # 直してもらう依頼のプロンプトと回数、繰り返しグループから分かった総ステップ数
+    reasks = {}
+    reask_counts = {}
+    total_steps = None
+    
+    while not graph.finished():
+        for group in graph.expandable():
+            count = repeat_count(graph, group)
+            total_steps = count - group.offset
+            graph.expand(group.id, count)
+        ready = graph.ready()
+        if not ready:
+            raise RuntimeError("phases: 実行できるノードがありません（依存関係を確認してください）")
         
-        # --- Phase 2: Execute Step 1 ---
-        # Gemini (Step 1 Prompt) -> ChatGPT
-        print("\n=== フェーズ 2: ChatGPTでステップ1を実行 ===")
-        step1_prompt = extract_code_block(gemini_resp_1)
+        # 同じサービスのタブ（会話）には1件ずつしか送れないので、サービスごとに1ノード
+        batch, targets = [], set()
+        for node in ready:
+            if node.target not in targets:
+                batch.append(node)
+                targets.add(node.target)
         
-        chatgpt_resp_1 = None
-        max_retries = 3
+        requests = []
+        for node in batch:
+            if node.title and node.id not in announced:
+                print(f"\n=== {node.title} ===")
+                announced.add(node.id)
+            prompt = reasks.get(node.id) or node_prompt(graph, node, values, flow_folder)
+            if prompt is None:
+                # 同じ回答から抽出し直しても結果は変わらないので、すぐ手動実行に切り替える
+                print("警告: プロンプトの自動抽出に失敗しました。")
+                graph.complete(node.id, (yield from manual_fallback(node, flow_folder)))
+                continue
+            attempt = attempts.get(node.id, 0) + 1
+            if node.extractor:
+                print(f"{service_label(node.source)}の回答からプロンプトを自動抽出しました。（試行 {attempt}/{policy.attempts}）")
+            requests.append((node, PhaseRequest(node.name, node.source, node.target, prompt, attempt)))
+        if not requests:
+            continue
         
-        for attempt in range(max_retries):
-            if step1_prompt:
-                print(f"Geminiの回答からプロンプトを自動抽出しました。（試行 {attempt + 1}/{max_retries}）")
-                try:
-                    chatgpt_resp_1 = run_phase("Phase_2_Step1_Execution", page_gemini, page_chatgpt, step1_prompt, gemini_sel, chatgpt_sel, flow_folder)
-                    if chatgpt_resp_1 and chatgpt_resp_1.strip():
-                        print("ChatGPTからの回答取得に成功しました。")
-                        break
-                    else:
-                        print(f"回答が空でした。再試行します...（{attempt + 1}/{max_retries}）")
-                        time.sleep(2)
-                except Exception as e:
-                    print(f"エラーが発生しました: {e}")
-                    if attempt < max_retries - 1:
-                        print("再試行します...")
-                        time.sleep(2)
-            else:
-                print(f"警告: プロンプトの自動抽出に失敗しました。（試行 {attempt + 1}/{max_retries}）")
-                if attempt < max_retries - 1:
-                    print("再度抽出を試みます...")
-                    step1_prompt = extract_code_block(gemini_resp_1)
-                    time.sleep(1)
+        if len(requests) == 1:
+            try:
+                results = [(yield requests[0][1])]
+            except Exception as e:
+                results = [e]
+        else:
+            results = yield [request for _, request in requests]
         
-        # 3回試行しても失敗した場合は手動フォールバック
-        if not chatgpt_resp_1 or not chatgpt_resp_1.strip():
-            print("\n自動実行に失敗しました。手動で実行してください。")
-            print("1. Geminiのタブに移動します。")
-            print("2. 『ステップ1のプロンプト』（コードブロック）をコピーしてください。")
-            print("3. ChatGPTに貼り付けて実行してください。")
-            print("4. ChatGPTの回答完了を待ってください。")
-            print(">>> ChatGPTの回答が出たら、ここで Enter キーを押してください。 <<<")
-            input()
+        delay = 0
+        for (node, request), result in zip(requests, results):
+            failed = isinstance(result, Exception) or (node.retry_empty and not (result and result.strip()))
+            if not failed:
+                if node.retry_empty:
+                    print(f"{service_label(node.target)}からの回答取得に成功しました。")
+                problems = check_conformance(node, result, total_steps, flow_folder)
+                if problems:
+                    print(f"{service_label(node.target)}の回答がフォーマットと合っていません:")
+                    for problem in problems:
+                        print(f"  - {problem}")
+                    if reask_counts.get(node.id, 0) < conformance["reasks"]:
+                        reask_counts[node.id] = reask_counts.get(node.id, 0) + 1
+                        print(f"次に進む前に、同じ会話で直してもらいます。（{reask_counts[node.id]}/{conformance['reasks']}）")
+                        reasks[node.id] = reask_prompt(problems)
+                        continue
+                    print("直してもらう回数の上限に達したため、このまま先に進みます。")
+                reasks.pop(node.id, None)
+                graph.complete(node.id, result)
+                continue
             
-            # Scrape ChatGPT response
-            chatgpt_resp_1, _ = get_latest_response(page_chatgpt, chatgpt_sel['latest_response'])
-            if chatgpt_resp_1:
-                append_to_final_article(chatgpt_resp_1, "Phase_2_Step1_Result", flow_folder)
-                with open(f"{flow_folder}/chatgpt_output/phase_2.txt", "w", encoding="utf-8") as f: 
-                    f.write(chatgpt_resp_1)
+            attempts[node.id] = request.attempt
+            retrying = request.attempt < policy.attempts
+            if isinstance(result, Exception):
+                print(f"エラーが発生しました: {result}")
+                if retrying:
+                    print("再試行します...")
             else:
-                print("警告: ChatGPTの回答を自動取得できませんでした。")
-                print("次のステップのために、回答テキストを手動で入力（貼り付け）してください:")
-                chatgpt_resp_1 = input()
-
-        # --- Determine Loop Count ---
-        print("\n=== 設定確認 ===")
-        extracted_steps = extract_total_steps(gemini_resp_1)
-        if extracted_steps:
-            print(f"Geminiの回答から総ステップ数を検出しました: {extracted_steps}")
-            total_steps = extracted_steps
-        else:
+                print(f"回答が空でした。再試行します...（{request.attempt}/{policy.attempts}）")
+            if retrying:
+                delay = max(delay, policy.delay(request.attempt))
+            elif node.manual:
+                graph.complete(node.id, (yield from manual_fallback(node, flow_folder)))
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                graph.complete(node.id, result)
+        if delay:
+            pause_before_retry(flow_folder, delay)
+    
+    print("\n=== フロー完了 ===")
+    print(f"すべての成果物は以下に保存されました: {os.path.abspath(flow_folder)}")
+
+def perform_request(request, pages, flow_folder):
+    """依頼を1件ブラウザで実行して回答テキストを返す"""
+    if isinstance(request, ManualRequest):
+        with phase_span(flow_folder, request.target).timed("human_wait_s"):
+            input()
+        response_text, _ = get_latest_response(pages[request.target], selector_resolver.current(request.target)['latest_response'])
+        return response_text
+    return run_cached_phase(request.phase_name, pages.get(request.source), pages[request.target], request.prompt,
+                            selector_resolver.current(request.source) if request.source else None, selector_resolver.current(request.target), flow_folder)
+
+def perform_batch(requests, pages, flow_folder):
+    """別々のサービス宛ての依頼をまとめて貼り付け、両方の回答を待って、回答（失敗は例外）のリストを返す
+    
+    回答の保存（最終記事への追記を含む）は、完了した順ではなく依頼の順に行う。
+    """
+    completion_config = config.get('completion', {})
+    if not completion_config.get('enabled', True):
+        # 完了を検出しない場合は、Enter キーで1件ずつ進める
+        results = []
+        for request in requests:
             try:
-                total_steps = int(input("総ステップ数を自動検出できませんでした。Geminiが決めたステップ数を入力してください (例: 3): "))
-            except:
-                total_steps = 3
-        
-        loop_count = max(0, total_steps - 2)
-        previous_chatgpt_response = chatgpt_resp_1
-        
-        # --- Phase 3: Loop ---
-        for i in range(loop_count):
-            step_num = i + 2
-            print(f"\n=== フェーズ 3: 中間ステップ {step_num} ===")
-            
-            # Gemini writes next prompt
-            if not previous_chatgpt_response:
-                 previous_chatgpt_response = "（前のステップの回答が取得できませんでした）"
+                results.append(perform_request(request, pages, flow_folder))
+            except CacheMiss:
+                raise
+            except Exception as e:
+                results.append(e)
+        return results
+    
+    quiet_period_ms = completion_config.get('quiet_period_ms', 2000)
+    timeout_ms = completion_config.get('timeout_ms', 600000)
+    results = [None] * len(requests)
+    cached = {}
+    watching = {}
+    for index, request in enumerate(requests):
+        try:
+            key, hit = lookup_cached_response(request.target, request.prompt, flow_folder)
+            if hit is not None:
+                cached[index] = (key, hit)
+                continue
+            warn_if_replayed(request.target, flow_folder)
+            page = pages[request.target]
+            with phase_span(flow_folder, request.target).timed("paste_s"):
+                baseline = begin_phase(request.phase_name, page, request.prompt, selector_resolver.current(request.target))
+            start_watch(page, selector_resolver.current(request.target), baseline, quiet_period_ms, timeout_ms)
+            watching[index] = key
+        except CacheMiss:
+            raise
+        except Exception as e:
+            results[index] = e
+    
+    if watching:
+        labels = "・".join(service_label(requests[index].target) for index in watching)
+        print(f"\n>>> アクションが必要です: 【{labels}】 のブラウザでそれぞれ送信ボタン(Enter)を押してください <<<")
+        print(">>> 回答の完了は自動で検出します。送信後はそのままお待ちください <<<")
+    statuses = {}
+    while len(statuses) < len(watching):
+        for index in watching:
+            if index not in statuses:
+                status = poll_watch(pages[requests[index].target])
+                if status and status.get('reason'):
+                    statuses[index] = status
+        if len(statuses) < len(watching):
+            time.sleep(0.5)
+    
+    for index, request in enumerate(requests):
+        try:
+            if index in cached:
+                key, hit = cached[index]
+                results[index] = use_cached_response(request.phase_name, request.target, hit, flow_folder)
+                record_response(request.target, request.prompt, results[index], key, hit, request.phase_name, flow_folder)
+            elif index in watching:
+                status = statuses[index]
+                page = pages[request.target]
+                log_completion(status, request.phase_name, request.target, flow_folder)
+                span = phase_span(flow_folder, request.target)
+                trace_completion(span, status)
+                detected = status['reason'] == "stable"
+                if not detected:
+                    page.bring_to_front()
+                    print(f">>> 【{service_label(request.target)}】の回答が完了したら、このターミナルで Enter キーを押してください <<<")
+                    with span.timed("human_wait_s"):
+                        input()
+                results[index] = finish_phase(request.phase_name, page, selector_resolver.current(request.target), flow_folder, detected)
+                record_response(request.target, request.prompt, results[index], watching[index], None, request.phase_name, flow_folder)
+        except CacheMiss:
+            raise
+        except Exception as e:
+            results[index] = e
+    return results
 
-            p3_prompt = prompts['phase_3_loop'].replace("{previous_response}", previous_chatgpt_response)
-            gemini_resp_loop = run_phase(f"Phase_3_Step{step_num}_Plan", page_chatgpt, page_gemini, p3_prompt, chatgpt_sel, gemini_sel, flow_folder)
-            
-            # User executes in ChatGPT
-            print(f"\n=== ChatGPTでステップ {step_num} を実行 ===")
-            step_loop_prompt = extract_code_block(gemini_resp_loop)
-            
-            chatgpt_resp_loop = None
-            max_retries = 3
+def drive_flow(flow, pages, flow_folder):
+    """フローのジェネレーターを1件ずつ実行する（通常モード）
+    
+    依頼のリストは perform_batch でまとめて実行する。
+    終了時（例外で止まった場合も）は、書き出し待ちの成果物を書き終えるまで待つ。
+    """
+    response, error = None, None
+    try:
+        while True:
+            try:
+                request = flow.throw(error) if error else flow.send(response)
+            except StopIteration:
+                return
+            response, error = None, None
+            if isinstance(request, list):
+                response = perform_batch(request, pages, flow_folder)
+                continue
+            try:
+                response = perform_request(request, pages, flow_folder)
+            except CacheMiss:
+                raise
+            except Exception as e:
+                # 例外はフロー側（再試行ループ）に渡す
+                error = e
+    finally:
+        close_artifacts(flow_folder)
+
+def new_checkpoint(flow_folder, problem_settings, solution_hints):
+    """フローの開始時にチェックポイントを作る（問題設定も保存し、--resume で入力を省く）"""
+    checkpoint = Checkpoint(os.path.join(flow_folder, CHECKPOINT_FILE))
+    checkpoint.data.update(problem_settings=problem_settings, solution_hints=solution_hints, article=[])
+    checkpoint.save()
+    return checkpoint
+
+def is_same_request(phase, request):
+    kind = "manual" if isinstance(request, ManualRequest) else "phase"
+    return (phase["kind"], phase["phase"], phase["target"], phase["prompt"]) == \
+        (kind, request.phase_name, request.target, request.prompt)
+
+def stop_restoring(checkpoint, restored, flow_folder):
+    """復元を終えて、ここから先のフェーズを実際に実行できる状態にする
+    
+    final_article.md は、最初に実行し直すフェーズより前の追記分だけに作り直す。
+    """
+    data = checkpoint.data
+    phases = checkpoint.phases
+    if restored < len(phases):
+        print(f"{phases[restored]['phase']} 以降はチェックポイントと一致しないため、もう一度実行します。")
+        keep = phases[restored]['article_before']
+    elif 'pending' in data:
+        keep = data['pending']['article_before']
+    else:
+        keep = len(data['article'])
+    del phases[restored:]
+    del data['article'][keep:]
+    data.pop('pending', None)
+    checkpoint.save()
+    
+    artifacts(flow_folder).set_sections((part['phase'], part['text']) for part in data['article'])
+    restoring_flows.discard(flow_folder)
+
+def checkpointed_flow(flow, checkpoint, pages, flow_folder):
+    """フローのジェネレーターを包み、完了したフェーズをチェックポイントに保存する
+    
+    チェックポイントに同じ依頼（フェーズ名・送信先・プロンプトが一致）が残っていれば、
+    ブラウザを使わずに保存済みの回答を返してフローの状態を組み立て直す。
+    最初に一致しなかった依頼から先は通常どおり実行する。
+    """
+    data = checkpoint.data
+    data.setdefault('article', [])
+    active_checkpoints[flow_folder] = checkpoint
+    restored = 0
+    if checkpoint.phases:
+        restoring_flows.add(flow_folder)
+    
+    response, error = None, None
+    try:
+        while True:
+            try:
+                request = flow.throw(error) if error else flow.send(response)
+            except StopIteration:
+                if flow_folder in restoring_flows:
+                    # すべて復元できた場合も、書き出し前に止まった最終記事を作り直す
+                    stop_restoring(checkpoint, restored, flow_folder)
+                data['completed'] = True
+                checkpoint.save()
+                return
+            response, error = None, None
             
-            for attempt in range(max_retries):
-                if step_loop_prompt:
-                    print(f"Geminiの回答からプロンプトを自動抽出しました。（試行 {attempt + 1}/{max_retries}）")
-                    try:
-                        chatgpt_resp_loop = run_phase(f"Phase_3_Step{step_num}_Execution", page_gemini, page_chatgpt, step_loop_prompt, gemini_sel, chatgpt_sel, flow_folder)
-                        if chatgpt_resp_loop and chatgpt_resp_loop.strip():
-                            print("ChatGPTからの回答取得に成功しました。")
-                            previous_chatgpt_response = chatgpt_resp_loop
-                            break
-                        else:
-                            print(f"回答が空でした。再試行します...（{attempt + 1}/{max_retries}）")
-                            time.sleep(2)
-                    except Exception as e:
-                        print(f"エラーが発生しました: {e}")
-                        if attempt < max_retries - 1:
-                            print("再試行します...")
-                            time.sleep(2)
-                else:
-                    print(f"警告: プロンプトの自動抽出に失敗しました。（試行 {attempt + 1}/{max_retries}）")
-                    if attempt < max_retries - 1:
-                        print("再度抽出を試みます...")
-                        step_loop_prompt = extract_code_block(gemini_resp_loop)
-                        time.sleep(1)
+            # 同時に実行する依頼のリストは、全件が続けてチェックポイントと一致したときだけ復元する
+            batch = request if isinstance(request, list) else [request]
+            if flow_folder in restoring_flows:
+                saved = checkpoint.phases[restored:restored + len(batch)]
+                if len(saved) == len(batch) and all(is_same_request(phase, item) for phase, item in zip(saved, batch)):
+                    restored += len(batch)
+                    for phase, item in zip(saved, batch):
+                        print(f"\n=== フェーズ復元: {item.phase_name}（チェックポイントの回答を使用） ===")
+                        if phase['kind'] == "phase":
+                            advance_conversation(item.target, item.prompt, phase['response'], flow_folder)
+                    responses = [phase['response'] for phase in saved]
+                    response = responses if isinstance(request, list) else responses[0]
+                    continue
+                stop_restoring(checkpoint, restored, flow_folder)
             
-            # 3回試行しても失敗した場合は手動フォールバック
-            if not chatgpt_resp_loop or not chatgpt_resp_loop.strip():
-                print("\n自動実行に失敗しました。手動で実行してください。")
-                print(f"1. Geminiから『ステップ {step_num} のプロンプト』をコピーしてください。")
-                print("2. ChatGPTに貼り付けて実行してください。")
-                print(">>> ChatGPTの回答が出たら、ここで Enter キーを押してください。 <<<")
-                input()
+            # 実行中に落ちた場合に、最終記事をどこまで残すかの目印
+            article_before = len(data['article'])
+            data['pending'] = {"phase": batch[0].phase_name, "article_before": article_before}
+            checkpoint.save()
+            try:
+                response = yield request
+            except Exception as e:
+                error = e
+                continue
+            data.pop('pending', None)
+            results = response if isinstance(request, list) else [response]
+            for item, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    # 失敗した依頼は記録しない（再開時にもう一度実行する）
+                    continue
+                checkpoint.record(
+                    kind="manual" if isinstance(item, ManualRequest) else "phase",
+                    phase=item.phase_name,
+                    target=item.target,
+                    prompt=item.prompt,
+                    response=result,
+                    article_before=article_before,
+                    pages={service: page.url for service, page in pages.items()},
+                )
+    finally:
+        active_checkpoints.pop(flow_folder, None)
+        restoring_flows.discard(flow_folder)
+
+def forget_from_step(checkpoint, step):
+    """ステップ step（番号、または "last"）を書いたフェーズから先をチェックポイントから外す
+    
+    そのステップより後のフェーズは、前のフェーズの回答と同じ会話の文脈を受け取っているので、
+    すべてやり直しになる。外したフェーズ名のリストを返す。
+    """
+    pattern = re.compile(r"LastStep" if step == "last" else rf"Step{step}(?!\d)")
+    index = next((i for i, phase in enumerate(checkpoint.phases) if pattern.search(phase['phase'])), None)
+    if index is None:
+        raise ValueError(f"ステップ {step} を書いたフェーズがチェックポイントにありません")
+    removed = [phase['phase'] for phase in checkpoint.phases[index:]]
+    del checkpoint.data['article'][checkpoint.phases[index]['article_before']:]
+    del checkpoint.phases[index:]
+    checkpoint.data.pop('completed', None)
+    checkpoint.data.pop('pending', None)
+    # 前の会話には外したフェーズのやり取りが残っているので開き直さず、新しいチャットに引き継ぐ
+    checkpoint.data['reseed'] = list(SERVICE_LABELS)
+    checkpoint.save()
+    return removed
+
+def regenerate(argv):
+    """python main.py regenerate FLOW_FOLDER --step N: ステップ N とそれ以降のフェーズだけをやり直す"""
+    parser = argparse.ArgumentParser(prog="main.py regenerate", description="完了したフローの1つのステップから先だけをやり直す")
+    parser.add_argument("flow_folder", help="フローのフォルダー（output/flow_...）")
+    parser.add_argument("--step", required=True, help="やり直すステップの番号（1 は Phase_1 で書いたステップ）、または last")
+    args = parser.parse_args(argv)
+    path = os.path.join(args.flow_folder, CHECKPOINT_FILE)
+    try:
+        checkpoint = Checkpoint.load(path)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"エラー: チェックポイントを読み込めません（{path}）: {e}")
+        return 1
+    try:
+        removed = forget_from_step(checkpoint, args.step)
+    except ValueError as e:
+        print(f"エラー: {e}")
+        return 1
+    print(f"やり直すフェーズ: {', '.join(removed)}")
+    print("前の会話には外したフェーズのやり取りが残っているため、新しいチャットを開き、残したフェーズの会話を引き継いでから続けます。")
+    # 同じ会話・同じプロンプトのキャッシュがあると同じ回答が返るので、キャッシュは使わない
+    return main(["--resume", args.flow_folder, "--no-cache"])
+
+def conversation_history(checkpoint, service):
+    """チェックポイントに残っている service のやり取りを、送った順に1つの文にする"""
+    turns = []
+    for phase in checkpoint.phases:
+        if phase['target'] != service:
+            continue
+        prompt = phase['prompt'] if phase['kind'] == "phase" else "（手動で送った依頼）"
+        number = len(turns) + 1
+        turns.append(f"【依頼 {number}】\n{prompt}\n\n【あなたの回答 {number}】\n{phase['response']}")
+    return "\n\n".join(turns)
+
+def reseed_reason(flow_folder, service, page):
+    """service のタブを新しいチャットに切り替える理由（切り替えなくてよければ None）"""
+    checkpoint = active_checkpoints.get(flow_folder)
+    if checkpoint is not None and service in checkpoint.data.get('reseed', ()):
+        return "やり直すステップより後のやり取りが残っている会話の代わり"
+    # 引き継いだ後に増えた分で判定する（引き継ぎのメッセージだけで上限を超えても、毎回切り替えない）
+    if lean and lean["max_dom_nodes"] and \
+            dom_size(page) - dom_baselines.get((flow_folder, service), 0) > lean["max_dom_nodes"]:
+        return f"ページの要素数が {lean['max_dom_nodes']} を超えたため"
+    return None
+
+def reseed_request(flow_folder, service, page, reason):
+    """新しいチャットを開き、それまでの会話を引き継ぐ依頼を返す（引き継ぐやり取りがなければ None）
+    
+    会話履歴ハッシュも新しいチャットに合わせて空から数え直す。
+    """
+    open_fresh_chat(page, config['browser_config'][f'{service}_url'], reason)
+    chat = (flow_folder, service)
+    conversation_context.pop(chat, None)
+    replayed_services.discard(chat)
+    checkpoint = active_checkpoints.get(flow_folder)
+    history = conversation_history(checkpoint, service) if checkpoint is not None else ""
+    if not history:
+        return None
+    return PhaseRequest(RESEED_PHASE, None, service, RESEED_PROMPT.replace("{history}", history))
+
+def finish_reseed(flow_folder, service):
+    """引き継ぎを終えたタブを、チェックポイントの引き継ぎ待ちから外す"""
+    checkpoint = active_checkpoints.get(flow_folder)
+    if checkpoint is not None and service in checkpoint.data.get('reseed', ()):
+        checkpoint.data['reseed'].remove(service)
+        if not checkpoint.data['reseed']:
+            del checkpoint.data['reseed']
+        checkpoint.save()
+
+def reseeding_flow(flow, pages, flow_folder):
+    """フローのジェネレーターを包み、切り替えが必要なタブでは、依頼の前に新しいチャットへ会話を引き継ぐ
+    
+    checkpointed_flow の外側に置くので、引き継ぎの依頼はチェックポイントに記録されず、
+    再開時に article_flow の依頼と食い違わない。復元したフェーズもここには届かない。
+    """
+    response, error = None, None
+    while True:
+        try:
+            request = flow.throw(error) if error else flow.send(response)
+        except StopIteration:
+            return
+        response, error = None, None
+        
+        batch = request if isinstance(request, list) else [request]
+        for service in dict.fromkeys(item.target for item in batch if isinstance(item, PhaseRequest)):
+            reason = reseed_reason(flow_folder, service, pages[service])
+            if reason is None:
+                continue
+            seed = reseed_request(flow_folder, service, pages[service], reason)
+            if seed is not None:
+                print(f"{SERVICE_LABELS[service]} の新しいチャットに、これまでの会話を引き継ぎます。")
+                try:
+                    yield seed
+                except Exception as e:
+                    print(f"警告: 会話の引き継ぎに失敗しました（{e}）。前の文脈なしで続けます。")
+            dom_baselines[(flow_folder, service)] = dom_size(pages[service]) if lean else 0
+            finish_reseed(flow_folder, service)
+        try:
+            response = yield request
+        except Exception as e:
+            error = e
+
+def phase_group(phase_name):
+    """レポートでまとめる単位（中間ステップの番号は区別しない）"""
+    return re.sub(r"^Phase_3_Step\d+", "Phase_3_StepN", phase_name)
+
+def traced_flow(flow, flow_folder):
+    """フローのジェネレーターを包み、ブラウザで実行した依頼ごとの時間を trace.jsonl に記録する
+    
+    checkpointed_flow の外側に置くので、チェックポイントから復元したフェーズは記録しない。
+    各スパンの内訳（貼り付け・人の操作待ち・抽出・スクリーンショット・保存）は、
+    実行中の関数が phase_span() を通じて書き込む。
+    """
+    tracer = Tracer(os.path.join(flow_folder, TRACE_FILE), flow=os.path.basename(flow_folder))
+    phases = 0
+    response, error = None, None
+    with tracer.span("flow") as flow_span:
+        try:
+            while True:
+                try:
+                    request = flow.throw(error) if error else flow.send(response)
+                except StopIteration:
+                    flow_span.set(completed=True)
+                    return
+                response, error = None, None
                 
-                # Scrape ChatGPT
-                chatgpt_resp_loop, _ = get_latest_response(page_chatgpt, chatgpt_sel['latest_response'])
-                if chatgpt_resp_loop:
-                    append_to_final_article(chatgpt_resp_loop, f"Phase_3_Step{step_num}_Result", flow_folder)
-                    previous_chatgpt_response = chatgpt_resp_loop
+                # 同時に実行する依頼のリストなら、依頼ごとにスパンを作る
+                batch = request if isinstance(request, list) else [request]
+                spans = []
+                for item in batch:
+                    span = flow_span.child(
+                        "phase", group=phase_group(item.phase_name), phase=item.phase_name,
+                        service=item.target, kind="manual" if isinstance(item, ManualRequest) else "phase",
+                        attempt=item.attempt, retries=item.attempt - 1, batch=len(batch),
+                    )
+                    if item.prompt:
+                        span.set(**text_stats(item.prompt, "in"))
+                    if flow_folder in retry_sleeps:
+                        span.set(retry_sleep_s=retry_sleeps.pop(flow_folder))
+                    active_spans[(flow_folder, item.target)] = span
+                    spans.append(span)
+                try:
+                    response = yield request
+                except Exception as e:
+                    spans[0].fail(e)
+                    error = e
+                except BaseException:
+                    for span in spans:
+                        span.end("cancelled")
+                    raise
                 else:
-                    print("警告: ChatGPTの回答を自動取得できませんでした。")
-                    print("次のステップのために、回答テキストを手動で入力（貼り付け）してください:")
-                    previous_chatgpt_response = input()
+                    results = response if isinstance(request, list) else [response]
+                    for span, result in zip(spans, results):
+                        if isinstance(result, Exception):
+                            span.fail(result)
+                        else:
+                            span.set(**text_stats(result, "out"))
+                finally:
+                    for span, item in zip(spans, batch):
+                        active_spans.pop((flow_folder, item.target), None)
+                        span.end()
+                phases += len(batch)
+        finally:
+            flow_span.set(phases=phases)
+            retry_sleeps.pop(flow_folder, None)
+
+def reopen_conversations(pages, checkpoint):
+    """前回の実行で使っていた会話のURLを開き直す（同じチャットの文脈で続きを送れるように）"""
+    if not checkpoint.phases:
+        return
+    for service, url in checkpoint.phases[-1].get('pages', {}).items():
+        if service in checkpoint.data.get('reseed', ()):
+            # 引き継ぎ待ちの会話は開き直さない（reseeding_flow が新しいチャットに引き継ぐ）
+            continue
+        if service in pages and url and pages[service].url != url:
+            print(f"{service} の前回の会話を開きます: {url}")
+            pages[service].goto(url)
+
+def sync_playwright():
+    """Playwright を起動する（読み込みに時間がかかるので、ブラウザを使うときだけ import する）"""
+    from playwright.sync_api import sync_playwright as start_playwright
+    return start_playwright()
+
+def launch_browsers(p):
+    """Gemini / ChatGPT のブラウザをそれぞれのユーザーデータで起動する
+    
+    両方のユーザーデータが同じフォルダー（軽量モードでは shared_user_data_dir）なら、
+    ブラウザを1つだけ起動して両方のタブを開く。
+    """
+    browser_config = config['browser_config']
+    
+    args = [
+        "--disable-blink-features=AutomationControlled",
+        "--no-sandbox",
+        "--disable-infobars"
+    ]
+    user_data = {service: os.path.abspath((lean or {}).get('shared_user_data_dir')
+                                          or browser_config[f'{service}_user_data_dir'])
+                 for service in ("gemini", "chatgpt")}
+    
+    contexts, pages = {}, {}
+    for service in ("gemini", "chatgpt"):
+        shared = next((contexts[other] for other in contexts if user_data[other] == user_data[service]), None)
+        if shared is not None:
+            # 同じプロファイルのブラウザにタブを追加する
+            context = shared
+            page = context.new_page()
+        else:
+            print(f"{SERVICE_LABELS[service]} ブラウザを起動中 (User Data: {user_data[service]})...")
+            context = p.chromium.launch_persistent_context(
+                user_data[service],
+                headless=browser_config['headless'],
+                channel=browser_config.get('channel', 'chrome'),
+                args=args,
+                ignore_default_args=["--enable-automation"]
+            )
+            if lean:
+                install_blocking(context, lean, lean_stats)
+            page = context.pages[0]
+        page.goto(browser_config[f'{service}_url'])
+        contexts[service], pages[service] = context, page
+    
+    print("\n--- 両方のサービスにログインしてください ---")
+    print("準備ができたら、このターミナルで Enter キーを押してフローを開始してください。")
+    input()
+    probe_selectors(pages)
+    
+    return contexts, pages
 
+def probe_selectors(pages):
+    """ログイン直後に各サービスのセレクターの候補をまとめて確かめ、使うものを選ぶ"""
+    for service, page in pages.items():
+        status, elapsed_ms = selector_resolver.probe(page, service)
+        if not status:
+            print(f"{SERVICE_LABELS[service]} のセレクターを確認できませんでした（キャッシュか先頭の候補を使います）。")
+            continue
+        print(f"{SERVICE_LABELS[service]} のセレクターを確認しました（{elapsed_ms:.0f}ms）: "
+              + ", ".join(f"{key}={state}" for key, state in status.items()))
+        for key, selector in selector_resolver.current(service).items():
+            if status.get(key) == "ok" and selector != selector_resolver.candidates[service][key][0]:
+                print(f"  {key}: 先頭の候補が見つからないため {selector} を使います")
+        broken = [key for key, state in status.items() if state == "broken"]
+        if broken:
+            print(f"警告: {SERVICE_LABELS[service]} で {', '.join(broken)} が見つかりません。"
+                  "この操作は待たずに手動の手順に切り替えます（config.json の selectors に候補を追加してください）。")
+
+def run_flow(resume_folder=None):
+    if resume_folder:
+        # 中断したフローを、完了済みのフェーズを飛ばして続ける
+        checkpoint = Checkpoint.load(os.path.join(resume_folder, CHECKPOINT_FILE))
+        flow_folder = resume_folder
+        for sub in ("screenshots", "gemini_output", "chatgpt_output"):
+            os.makedirs(f"{flow_folder}/{sub}", exist_ok=True)
+        problem_settings = checkpoint.data['problem_settings']
+        solution_hints = checkpoint.data['solution_hints']
+        print(f"\n=== 再開: {flow_folder}（完了済み {len(checkpoint.phases)} フェーズ） ===")
+    else:
+        flow_folder = ensure_directories()
+        print(f"\n=== 出力フォルダ: {flow_folder} ===")
         
-        # --- Phase 4: Last Step Plan ---
-        print("\n=== フェーズ 4: ラストステップの計画 ===")
-        if not previous_chatgpt_response:
-             previous_chatgpt_response = "（前のステップの回答が取得できませんでした）"
-             
-        p4_prompt = prompts['phase_4_last'].replace("{previous_response}", previous_chatgpt_response)
-        gemini_resp_last = run_phase("Phase_4_LastStep_Plan", page_chatgpt, page_gemini, p4_prompt, chatgpt_sel, gemini_sel, flow_folder)
+        # User Input for Phase 1
+        print("\n=== 初期設定 ===")
+        problem_settings = input("『問題設定』を入力してください (または貼り付け): ")
+        solution_hints = input("『解決手法のヒント』を入力してください (任意、スキップはEnter): ")
+        checkpoint = new_checkpoint(flow_folder, problem_settings, solution_hints)
+    
+    with sync_playwright() as p:
+        _, pages = launch_browsers(p)
+        reopen_conversations(pages, checkpoint)
+        flow = article_flow(problem_settings, solution_hints, flow_folder)
+        drive_flow(traced_flow(reseeding_flow(checkpointed_flow(flow, checkpoint, pages, flow_folder), pages, flow_folder),
+                               flow_folder), pages, flow_folder)
+    archive_finished_flow(flow_folder)
+
+def load_pool_entries(path):
+    """プールモードの入力を読み込む
+    
+    .json は [{"problem_settings": ..., "solution_hints": ...}, ...]、
+    それ以外は1行1記事（問題設定とヒントはタブ区切り）。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            return [(e['problem_settings'], e.get('solution_hints', '')) for e in json.load(f)]
+        entries = []
+        for line in f:
+            if line.strip():
+                problem, _, hints = line.rstrip("\n").partition("\t")
+                entries.append((problem, hints))
+        return entries
+
+def run_pool(entries, pool_size):
+    """複数の記事を、Gemini/ChatGPT のタブの組を使って並行に進める"""
+    completion_config = config.get('completion', {})
+    quiet_period_ms = completion_config.get('quiet_period_ms', 2000)
+    timeout_ms = completion_config.get('timeout_ms', 600000)
+    queue = list(entries)
+    
+    with sync_playwright() as p:
+        contexts, first_pages = launch_browsers(p)
         
-        # --- Phase 5: Execute Last Step ---
-        print("\n=== フェーズ 5: ChatGPTでラストステップを実行 ===")
-        last_step_prompt = extract_code_block(gemini_resp_last)
+        # 同じログイン済みコンテキストにタブの組を追加で開く
+        slots = [FlowSlot(1, first_pages)]
+        for index in range(2, min(pool_size, len(queue)) + 1):
+            pages = {}
+            for service in ("gemini", "chatgpt"):
+                page = contexts[service].new_page()
+                page.goto(config['browser_config'][f'{service}_url'])
+                pages[service] = page
+            slots.append(FlowSlot(index, pages))
         
-        chatgpt_resp_last = None
-        max_retries = 3
+        def next_request(slot, response, error):
+            """フローに回答を渡して次の依頼を受け取る
+            
+            依頼のリストはこのタブの組で1件ずつ実行し、全件の回答（失敗は例外）をまとめてフローに返す。
+            プールでは複数のフローが並行に進むので、1本のフローの中までは並行にしない。
+            """
+            if slot.batch is not None:
+                slot.batch_results.append(error if error else response)
+                if len(slot.batch_results) < len(slot.batch):
+                    return slot.batch[len(slot.batch_results)]
+                response, error = slot.batch_results, None
+                slot.batch, slot.batch_results = None, []
+            request = slot.flow.throw(error) if error else slot.flow.send(response)
+            if isinstance(request, list):
+                slot.batch, slot.batch_results = request, []
+                return request[0]
+            return request
         
-        for attempt in range(max_retries):
-            if last_step_prompt:
-                print(f"Geminiの回答からプロンプトを自動抽出しました。（試行 {attempt + 1}/{max_retries}）")
+        def advance(slot, response=None, error=None):
+            """フローを次のブラウザ待ちまで進める（キャッシュ・手動操作はその場で処理）"""
+            while True:
                 try:
-                    chatgpt_resp_last = run_phase("Phase_5_LastStep_Execution", page_gemini, page_chatgpt, last_step_prompt, gemini_sel, chatgpt_sel, flow_folder)
-                    if chatgpt_resp_last and chatgpt_resp_last.strip():
-                        print("ChatGPTからの回答取得に成功しました。")
-                        break
-                    else:
-                        print(f"回答が空でした。再試行します...（{attempt + 1}/{max_retries}）")
-                        time.sleep(2)
+                    request = next_request(slot, response, error)
+                except StopIteration:
+                    print(f"\n=== フロー #{slot.index} 完了: {slot.flow_folder} ===")
+                    close_artifacts(slot.flow_folder)
+                    archive_finished_flow(slot.flow_folder)
+                    start_next(slot)
+                    return
+                except CacheMiss:
+                    raise
                 except Exception as e:
-                    print(f"エラーが発生しました: {e}")
-                    if attempt < max_retries - 1:
-                        print("再試行します...")
-                        time.sleep(2)
-            else:
-                print(f"警告: プロンプトの自動抽出に失敗しました。（試行 {attempt + 1}/{max_retries}）")
-                if attempt < max_retries - 1:
-                    print("再度抽出を試みます...")
-                    last_step_prompt = extract_code_block(gemini_resp_last)
-                    time.sleep(1)
+                    # 1本の失敗で他のフローを止めない
+                    print(f"\nフロー #{slot.index} が失敗しました: {e}")
+                    close_artifacts(slot.flow_folder)
+                    start_next(slot)
+                    return
+                response, error = None, None
+                try:
+                    if isinstance(request, ManualRequest):
+                        print(f"（フロー #{slot.index} のタブで操作してください）")
+                        response = perform_request(request, slot.pages, slot.flow_folder)
+                        continue
+                    key, cached = lookup_cached_response(request.target, request.prompt, slot.flow_folder)
+                    if cached is not None:
+                        response = use_cached_response(request.phase_name, request.target, cached, slot.flow_folder)
+                        record_response(request.target, request.prompt, response, key, cached, request.phase_name, slot.flow_folder)
+                        continue
+                    warn_if_replayed(request.target, slot.flow_folder)
+                    page = slot.pages[request.target]
+                    with phase_span(slot.flow_folder, request.target).timed("paste_s"):
+                        baseline = begin_phase(request.phase_name, page, request.prompt, selector_resolver.current(request.target))
+                    start_watch(page, selector_resolver.current(request.target), baseline, quiet_period_ms, timeout_ms)
+                    slot.wait(request, key)
+                    return
+                except CacheMiss:
+                    raise
+                except Exception as e:
+                    error = e
         
-        # 3回試行しても失敗した場合は手動フォールバック
-        if not chatgpt_resp_last or not chatgpt_resp_last.strip():
-            print("\n自動実行に失敗しました。手動で実行してください。")
-            print("1. Geminiから『ラストステップのプロンプト』をコピーしてください。")
-            print("2. ChatGPTに貼り付けて実行してください。")
-            print(">>> ChatGPTの回答が出たら、ここで Enter キーを押してください。 <<<")
-            input()
-            
-            chatgpt_resp_last, _ = get_latest_response(page_chatgpt, chatgpt_sel['latest_response'])
-            if chatgpt_resp_last:
-                append_to_final_article(chatgpt_resp_last, "Phase_5_LastStep_Result", flow_folder)
-            else:
-                print("警告: ChatGPTの回答を自動取得できませんでした。")
-                print("次のステップのために、回答テキストを手動で入力（貼り付け）してください:")
-                chatgpt_resp_last = input()
+        def start_next(slot):
+            if not queue:
+                slot.finish()
+                return
+            problem_settings, solution_hints = queue.pop(0)
+            if lean and lean["fresh_chat_per_flow"] and slot.flow is not None:
+                # 前のフローの会話を閉じ、DOM が大きくなり続けないようにする
+                for service, page in slot.pages.items():
+                    open_fresh_chat(page, config['browser_config'][f'{service}_url'], f"フロー #{slot.index} の次の記事")
+            flow_folder = ensure_directories(f"_{slot.index}")
+            print(f"\n=== フロー #{slot.index} 開始: {flow_folder} ===")
+            # 途中で止まったフローは --resume <flow_folder> で1本ずつ再開できる
+            checkpoint = new_checkpoint(flow_folder, problem_settings, solution_hints)
+            flow = article_flow(problem_settings, solution_hints, flow_folder)
+            slot.start(traced_flow(reseeding_flow(checkpointed_flow(flow, checkpoint, slot.pages, flow_folder),
+                                                  slot.pages, flow_folder), flow_folder),
+                       flow_folder, problem_settings)
+            advance(slot)
         
-        # --- Phase 6: Summary ---
-        print("\n=== フェーズ 6: まとめ ===")
-        if not chatgpt_resp_last:
-             chatgpt_resp_last = "（前のステップの回答が取得できませんでした）"
-
-        p6_prompt = prompts['phase_6_summary'].replace("{previous_response}", chatgpt_resp_last)
-        run_phase("Phase_6_Summary", page_chatgpt, page_gemini, p6_prompt, chatgpt_sel, gemini_sel, flow_folder)
+        for slot in slots:
+            start_next(slot)
+        print(render_status(slots, len(queue)))
+        
+        while any(slot.active for slot in slots):
+            changed = False
+            for slot in slots:
+                if not slot.active:
+                    continue
+                request = slot.request
+                page = slot.pages[request.target]
+                status = poll_watch(page)
+                if status and status.get('reason'):
+                    log_completion(status, request.phase_name, request.target, slot.flow_folder)
+                    span = phase_span(slot.flow_folder, request.target)
+                    trace_completion(span, status)
+                    detected = status['reason'] == "stable"
+                    if not detected:
+                        page.bring_to_front()
+                        print(f">>> フロー #{slot.index}: 回答が完了したら、このターミナルで Enter キーを押してください <<<")
+                        with span.timed("human_wait_s"):
+                            input()
+                    try:
+                        response = finish_phase(request.phase_name, page, selector_resolver.current(request.target), slot.flow_folder, detected)
+                        record_response(request.target, request.prompt, response, slot.cache_key, None, request.phase_name, slot.flow_folder)
+                        advance(slot, response)
+                    except CacheMiss:
+                        raise
+                    except Exception as e:
+                        advance(slot, error=e)
+                    changed = True
+                elif status and status.get('started') and not slot.generating:
+                    slot.generating = True
+                    changed = True
+            if changed:
+                print(render_status(slots, len(queue)))
+            time.sleep(0.5)
         
-        print("\n=== フロー完了 ===")
-        print(f"すべての成果物は以下に保存されました: {os.path.abspath(flow_folder)}")
+        print("\n=== すべてのフローが完了しました ===")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Gemini/ChatGPT ブラウザ半自動記事作成フロー")
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument("--no-cache", action="store_true", help="回答キャッシュを使わずに毎回ブラウザで実行する")
+    cache_mode.add_argument("--replay", action="store_true", help="キャッシュ済みの回答だけで実行し、ミスしたら停止する")
+    parser.add_argument("--pool-file", help="プールモード: 複数記事の問題設定ファイル（.json または1行1記事）")
+    parser.add_argument("--pool-size", type=int, default=2, help="プールモードで同時に開く Gemini/ChatGPT タブの組の数")
+    parser.add_argument("--resume", metavar="FLOW_FOLDER", help="中断したフロー（output/flow_...）を、完了済みのフェーズを飛ばして再開する")
+    parser.add_argument("--config", default=CONFIG_PATH, help="設定ファイル（既定はこのフォルダーの config.json）")
+    return parser
+
+def main(argv=None):
+    global response_cache, similar_index, similar_auto
+    # 引数なしで呼ばれた場合（テストなど）は既定の設定で実行する
+    argv = argv or []
+    if argv[:1] == ["report"]:
+        # python main.py report [output/...]: trace.jsonl をフェーズごとの p50/p95 に集計する
+        from tracing import main as report_main
+        return report_main(argv)
+    if argv[:1] == ["export"]:
+        # python main.py export [output/...]: final_article.md を HTML/PDF に書き出す（変わったセクションだけ描画し直す）
+        from export import main as export_main
+        return export_main(argv[1:] or ["output"])
+    if argv[:1] == ["regenerate"]:
+        # python main.py regenerate FLOW_FOLDER --step N: そのステップを書いたフェーズから先だけをやり直す
+        return regenerate(argv[1:])
+    if argv[:1] == ["archive"]:
+        # python main.py archive import|list|extract|export ...: フローの成果物を1つの SQLite ファイルで管理する
+        from archive import main as archive_main
+        return archive_main(argv[1:])
+    args = build_parser().parse_args(argv)
+    load_config(args.config)
+    response_cache = cache_from_env(replay=args.replay, enabled=not args.no_cache)
+    similar_index = None
+    if response_cache is not None and not args.replay and config.get('similar_prompts', {}).get('enabled', True):
+        similar_index = PromptIndex(os.getenv("ARTICLE_AGENT_SIMILAR")
+                                    or os.path.join(os.path.dirname(response_cache.path), "similar_prompts.sqlite3"))
+    similar_auto = bool(args.pool_file)
+    conversation_context.clear()
+    replayed_services.clear()
+    
+    try:
+        if args.resume:
+            run_flow(args.resume)
+        elif args.pool_file:
+            run_pool(load_pool_entries(args.pool_file), max(1, args.pool_size))
+        else:
+            run_flow()
+    except CacheMiss as e:
+        print(f"\nリプレイモードを終了します: {e}")
+    finally:
+        # 中断した場合も、受け付け済みの成果物は書き出してから終える
+        for flow_folder in list(artifact_writers):
+            close_artifacts(flow_folder)
+        if lean:
+            print(f"軽量モード: 読み込まなかったリクエスト {lean_stats.get('blocked', 0)} 件")
+        if similar_index is not None:
+            print(similar_index.summary())
+            similar_index.close()
+        if response_cache is not None:
+            print(response_cache.summary())
+            response_cache.close()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,244 @@
+"""config.json の phases（フェーズのグラフ）を読み込み、実行できるノードを順に返す
+
+ノードの例:
+
+    {"id": "intro", "name": "Phase_1_Intro_Step1", "target": "gemini", "after": ["format"],
+     "prompt_template": "phase_1", "inputs": ["problem_settings", "solution_hints"]}
+    {"id": "step1", "name": "Phase_2_Step1_Execution", "source": "gemini", "target": "chatgpt",
+     "from": "intro", "extractor": "prompt", "retry_empty": true, "manual": {...}}
+
+- from: このノードの回答を受け取る（テンプレートの {previous_response}、または extractor の入力）
+- after: from 以外に、先に終わっている必要があるノード
+- prompt_template: config.json の prompts の名前（見つからなければテンプレートの本文そのもの）
+- extractor: テンプレートの代わりに、from の回答からプロンプトを抽出する（"prompt"）
+- expect: 回答に必要な見出し・ブロック（conformance で検証する。"ステップ{step}" も書ける）
+
+repeat を持つノードは、本体（nodes）を count_from の回答から決めた回数だけ繰り返す。
+本体のノード名の {step} は周回の番号に置き換わり、from / after の "previous" は
+前の周回の最後のノード（1周目はグループの from）を指す。グループを参照すると、
+最後の周回の最後のノード（0周ならグループの from）を参照したことになる。
+
+ここではブラウザを操作しない。どのノードが実行できるか、どの回答を渡すかだけを扱う
+（実行は main.article_flow）。
+"""
+FLOW_INPUTS = ("problem_settings", "solution_hints")
+TEMPLATE_INPUTS = FLOW_INPUTS + ("previous_response",)
+EXTRACTORS = ("prompt",)
+PREVIOUS = "previous"
+
+
+class RetryPolicy:
+    """全ノード共通の再試行の方針（attempts 回まで、待ち時間は指数的に延ばす）"""
+
+    def __init__(self, attempts=3, backoff_s=2.0, multiplier=2.0, max_backoff_s=30.0):
+        self.attempts = max(1, attempts)
+        self.backoff_s = backoff_s
+        self.multiplier = multiplier
+        self.max_backoff_s = max_backoff_s
+
+    @classmethod
+    def from_config(cls, retry_config):
+        return cls(**{key: retry_config[key] for key in ("attempts", "backoff_s", "multiplier", "max_backoff_s")
+                      if key in retry_config})
+
+    def delay(self, attempt):
+        """attempt 回目（1 から）が失敗した後、次の試行までに待つ秒数"""
+        return min(self.backoff_s * self.multiplier ** (attempt - 1), self.max_backoff_s)
+
+
+class PhaseNode:
+    """ブラウザに送る1回分のフェーズ"""
+
+    def __init__(self, spec, step=None):
+        self.id = str(spec["id"])
+        self.step = step
+        self.name = self._with_step(spec.get("name", self.id))
+        self.title = self._with_step(spec.get("title", ""))
+        self.source = spec.get("source")
+        self.target = spec["target"]
+        self.template = spec.get("prompt_template")
+        self.inputs = tuple(spec.get("inputs", ()))
+        self.source_node = spec.get("from")
+        self.after = list(spec.get("after", ()))
+        self.extractor = spec.get("extractor")
+        self.retry_empty = spec.get("retry_empty", False)
+        self.expect = [self._with_step(name) for name in spec.get("expect", ())]
+        self.manual = spec.get("manual")
+        if self.manual:
+            self.manual = dict(self.manual, instructions=[self._with_step(line) for line in self.manual.get("instructions", ())])
+
+    def _with_step(self, text):
+        return text.replace("{step}", str(self.step)) if self.step is not None else text
+
+    @property
+    def dependencies(self):
+        return self.after + ([self.source_node] if self.source_node else [])
+
+
+class RepeatGroup:
+    """本体のノードを、実行中に決まる回数だけ繰り返すグループ"""
+
+    def __init__(self, spec):
+        self.id = str(spec["id"])
+        repeat = spec["repeat"]
+        self.count_from = repeat["count_from"]
+        self.offset = repeat.get("offset", 0)
+        self.default = repeat.get("default", 1)
+        self.start = repeat.get("start", 1)
+        self.source_node = spec.get("from")
+        self.after = list(spec.get("after", ()))
+        self.body = list(spec["nodes"])
+
+    @property
+    def dependencies(self):
+        return self.after + [self.count_from] + ([self.source_node] if self.source_node else [])
+
+
+class PhaseGraph:
+    """フェーズのグラフと、実行済みノードの回答"""
+
+    def __init__(self, phases):
+        self.items = {}
+        self.order = []
+        for spec in phases:
+            item = RepeatGroup(spec) if "repeat" in spec else PhaseNode(spec)
+            if item.id in self.items:
+                raise ValueError(f"phases: id が重複しています: {item.id}")
+            self.items[item.id] = item
+            self.order.append(item.id)
+        self.results = {}
+        self.aliases = {}
+        self._validate()
+
+    def _validate(self):
+        problems = []
+        for item in self.items.values():
+            for dep in item.dependencies:
+                if dep not in self.items:
+                    problems.append(f"{item.id}: 存在しないノード {dep} を参照しています")
+            if isinstance(item, RepeatGroup):
+                body_ids = {str(spec["id"]) for spec in item.body}
+                for spec in item.body:
+                    node = PhaseNode(spec, step=0)
+                    problems.extend(self._node_problems(node))
+                    for dep in node.dependencies:
+                        if dep not in body_ids and dep != PREVIOUS and dep not in self.items:
+                            problems.append(f"{item.id}.{node.id}: 存在しないノード {dep} を参照しています")
+            else:
+                problems.extend(self._node_problems(item))
+        if not problems:
+            problems.extend(self._cycle_problems())
+        if problems:
+            raise ValueError("phases の定義が正しくありません:\n  " + "\n  ".join(problems))
+        self.template_inputs()
+
+    @staticmethod
+    def _node_problems(node):
+        problems = []
+        if node.extractor and node.extractor not in EXTRACTORS:
+            problems.append(f"{node.id}: 不明な extractor {node.extractor}")
+        if node.extractor and not node.source_node:
+            problems.append(f"{node.id}: extractor には from（抽出元のノード）が必要です")
+        if not node.extractor and not node.template:
+            problems.append(f"{node.id}: prompt_template か extractor のどちらかが必要です")
+        unknown = set(node.inputs) - set(TEMPLATE_INPUTS)
+        if unknown:
+            problems.append(f"{node.id}: 不明な inputs {', '.join(sorted(unknown))}")
+        return problems
+
+    def _cycle_problems(self):
+        state = {}
+
+        def visit(item_id, path):
+            if state.get(item_id) == "done":
+                return None
+            if state.get(item_id) == "visiting":
+                return " -> ".join(path + [item_id])
+            state[item_id] = "visiting"
+            for dep in self.items[item_id].dependencies:
+                cycle = visit(dep, path + [item_id])
+                if cycle:
+                    return cycle
+            state[item_id] = "done"
+            return None
+
+        for item_id in self.order:
+            cycle = visit(item_id, [])
+            if cycle:
+                return [f"依存関係が循環しています: {cycle}"]
+        return []
+
+    def template_inputs(self):
+        """名前付きテンプレートごとに、渡される値（プレースホルダー）の集合を返す"""
+        found = {}
+        nodes = []
+        for item in self.items.values():
+            if isinstance(item, RepeatGroup):
+                nodes.extend(PhaseNode(spec, step=0) for spec in item.body)
+            else:
+                nodes.append(item)
+        for node in nodes:
+            if not node.template:
+                continue
+            inputs = set(node.inputs)
+            if found.setdefault(node.template, inputs) != inputs:
+                raise ValueError(f"phases: テンプレート {node.template} に渡す inputs がノードによって異なります")
+        return found
+
+    def resolve(self, ref):
+        while ref in self.aliases:
+            ref = self.aliases[ref]
+        return ref
+
+    def is_done(self, ref):
+        ref = self.resolve(ref)
+        if ref is None:
+            return True
+        return ref in self.results
+
+    def value(self, ref):
+        """ノード（グループなら最後のノード）の回答。参照先がなければ None"""
+        ref = self.resolve(ref)
+        return self.results.get(ref) if ref is not None else None
+
+    def complete(self, node_id, response):
+        self.results[node_id] = response
+
+    def expandable(self):
+        """繰り返し回数を決められるようになった（count_from が終わった）グループ"""
+        return [self.items[i] for i in self.order
+                if isinstance(self.items[i], RepeatGroup) and self.is_done(self.items[i].count_from)
+                and all(self.is_done(dep) for dep in self.items[i].after)]
+
+    def expand(self, group_id, count):
+        """グループを count 周分のノードに置き換える"""
+        group = self.items.pop(group_id)
+        previous = group.source_node
+        expanded = []
+        for step in range(group.start, group.start + count):
+            local = {str(spec["id"]): f"{group.id}.{spec['id']}#{step}" for spec in group.body}
+            last = None
+            for spec in group.body:
+                node = PhaseNode(dict(spec, id=local[str(spec["id"])]), step=step)
+
+                def rename(ref):
+                    return previous if ref == PREVIOUS else local.get(ref, ref)
+
+                node.source_node = rename(node.source_node) if node.source_node else None
+                node.after = [rename(dep) for dep in node.after] + group.after
+                self.items[node.id] = node
+                expanded.append(node.id)
+                last = node.id
+            previous = last
+        self.aliases[group.id] = previous
+        index = self.order.index(group_id)
+        self.order[index:index + 1] = expanded
+
+    def ready(self):
+        """依存先がすべて終わっていて、まだ実行していないノード（定義順）"""
+        return [self.items[i] for i in self.order
+                if isinstance(self.items[i], PhaseNode) and i not in self.results
+                and all(self.is_done(dep) for dep in self.items[i].dependencies)]
+
+    def finished(self):
+        return all(isinstance(self.items[i], PhaseNode) and i in self.results for i in self.order)
@@ -0,0 +1,66 @@
+"""プールモード: 複数の記事フローを並行に進めるためのタブの割り当てと状況表示"""
+import time
+
+SERVICE_LABELS = {"gemini": "Gemini", "chatgpt": "ChatGPT"}
+
+
+class FlowSlot:
+    """1本のフローと、そのフローが専有する Gemini/ChatGPT タブの組"""
+
+    def __init__(self, index, pages):
+        self.index = index
+        self.pages = pages
+        self.flow = None
+        self.flow_folder = None
+        self.title = ""
+        self.request = None
+        self.cache_key = None
+        # フローから受け取った依頼のリストと、それまでに得た回答
+        self.batch = None
+        self.batch_results = []
+        self.generating = False
+        self.since = time.monotonic()
+        self.completed = 0
+
+    @property
+    def active(self):
+        """ブラウザの回答を待っている間は True"""
+        return self.request is not None
+
+    def start(self, flow, flow_folder, title):
+        self.flow = flow
+        self.flow_folder = flow_folder
+        self.title = title
+        self.request = None
+        self.batch = None
+        self.batch_results = []
+
+    def wait(self, request, cache_key):
+        """送信待ちの依頼を登録する（ここから人の送信と回答完了を待つ）"""
+        self.request = request
+        self.cache_key = cache_key
+        self.generating = False
+        self.since = time.monotonic()
+
+    def finish(self):
+        self.flow = None
+        self.request = None
+
+
+def render_status(slots, queued):
+    """フローごとの待ち状況を一覧にした文字列を返す"""
+    now = time.monotonic()
+    lines = ["", "=== プールの状況 ==="]
+    for slot in slots:
+        if slot.request is None:
+            lines.append(f" #{slot.index}  （空き）")
+            continue
+        service = SERVICE_LABELS.get(slot.request.target, slot.request.target)
+        if slot.generating:
+            action = "回答生成中"
+        else:
+            action = f">>> 【{service}】タブ #{slot.index} で送信してください <<<"
+        title = slot.title[:20]
+        lines.append(f" #{slot.index}  {title:<20}  {slot.request.phase_name:<28} {service:<8} {action} ({now - slot.since:.0f}秒)")
+    lines.append(f" 待機中の記事: {queued} 本")
+    return "\n".join(lines)
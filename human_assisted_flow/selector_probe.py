@@ -0,0 +1,145 @@
+"""セレクターの候補リストと、使えるセレクターのキャッシュ（config.json の selectors）
+
+config.json の selectors の各要素は、1つのセレクター（文字列）か、上から順に試す候補のリスト。
+ログイン直後に probe() がすべての候補を1回の evaluate でまとめて数え、
+見つかった最初の候補をサービスごとに選ぶ（数ミリ秒）。選んだセレクターは
+.cache/selectors.json に保存して次の実行でも使い、失敗したとき（recover()）にだけ
+候補を調べ直す。どの候補も見つからない要素は「壊れている」と記録し、その後の
+フェーズでは長い待機をせずにすぐ手動の手順に切り替える。
+"""
+import json
+import os
+import sys
+import time
+
+# リポジトリ直下の共通モジュール（llm_cache）を読み込めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_cache import DEFAULT_CACHE_PATH
+
+DEFAULT_SELECTOR_CACHE = os.path.join(os.path.dirname(DEFAULT_CACHE_PATH), "selectors.json")
+# 新しいチャットでもページにあるはずの要素（回答や停止ボタンは、会話が始まるまで存在しない）
+ALWAYS_PRESENT = ("input_area",)
+
+# 候補ごとの一致数（書式が不正なセレクターは -1）
+COUNT_SCRIPT = """
+(selectors) => selectors.map(selector => {
+    try { return document.querySelectorAll(selector).length; } catch (e) { return -1; }
+})
+"""
+
+
+def candidates(value):
+    """config の値（文字列または候補のリスト）を候補のリストにする"""
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def count_matches(page, selectors):
+    """各セレクターに一致する要素の数（数えられなければ None）"""
+    try:
+        counts = page.evaluate(COUNT_SCRIPT, list(selectors))
+    except Exception:
+        return None
+    return counts if isinstance(counts, list) and len(counts) == len(selectors) else None
+
+
+class SelectorResolver:
+    """サービスごとに、要素の候補から今使うセレクターを選んで覚えておく"""
+
+    def __init__(self, config_selectors, cache_path=DEFAULT_SELECTOR_CACHE):
+        self.candidates = {service: {key: candidates(value) for key, value in elements.items()}
+                           for service, elements in config_selectors.items()}
+        self.cache_path = cache_path
+        self.broken = set()
+        cached = {}
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                cached = {}
+        # config から消えた候補はキャッシュにあっても使わない
+        self.chosen = {}
+        for service, elements in self.candidates.items():
+            for key, options in elements.items():
+                saved = cached.get(service, {}).get(key)
+                self.chosen[(service, key)] = saved if saved in options else (options[0] if options else None)
+
+    def current(self, service):
+        """service の要素ごとの、今使うセレクター（値は文字列。begin_phase などにそのまま渡す）"""
+        return {key: self.chosen[(service, key)] for key in self.candidates.get(service, {})}
+
+    def is_broken(self, service, key):
+        return (service, key) in self.broken
+
+    def fallbacks(self, service, key, selector):
+        """selector を先頭にした key の候補（selector が key の候補でなければ selector だけ）"""
+        options = self.candidates.get(service, {}).get(key, [])
+        if selector not in options:
+            return [selector]
+        return [selector] + [option for option in options if option != selector]
+
+    def _choose(self, service, key, counts, options):
+        for selector, count in zip(options, counts):
+            if count > 0:
+                self.chosen[(service, key)] = selector
+                self.broken.discard((service, key))
+                return selector
+        return None
+
+    def probe(self, page, service):
+        """ページ上ですべての候補を1回で数えて選び直し、(状態, 所要ミリ秒) の辞書を返す
+
+        状態は "ok"（見つかった）、"broken"（新しいチャットにもあるはずの要素が見つからない、
+        または書式が不正）、"unverified"（会話が始まるまで存在しない要素で、キャッシュか先頭の候補を使う）。
+        """
+        started = time.perf_counter()
+        flat = [(key, selector) for key, options in self.candidates.get(service, {}).items() for selector in options]
+        counts = count_matches(page, [selector for _, selector in flat])
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if counts is None:
+            return {}, elapsed_ms
+        by_key = {}
+        for (key, selector), count in zip(flat, counts):
+            by_key.setdefault(key, ([], []))
+            by_key[key][0].append(selector)
+            by_key[key][1].append(count)
+        status = {}
+        for key, (options, key_counts) in by_key.items():
+            if self._choose(service, key, key_counts, options):
+                status[key] = "ok"
+            elif key in ALWAYS_PRESENT or all(count < 0 for count in key_counts):
+                self.broken.add((service, key))
+                status[key] = "broken"
+            else:
+                status[key] = "unverified"
+        self.save()
+        return status, elapsed_ms
+
+    def recover(self, page, service, key):
+        """key のセレクターが失敗したときに候補を調べ直し、見つかったセレクター（なければ None）を返す
+
+        見つからなければ壊れていると記録するので、次からは待たずに手動の手順に切り替えられる。
+        """
+        options = self.candidates.get(service, {}).get(key, [])
+        counts = count_matches(page, options)
+        selector = self._choose(service, key, counts, options) if counts is not None else None
+        if selector is None:
+            self.broken.add((service, key))
+        else:
+            self.save()
+        return selector
+
+    def save(self):
+        if not self.cache_path:
+            return
+        data = {}
+        for (service, key), selector in self.chosen.items():
+            if selector is not None and (service, key) not in self.broken:
+                data.setdefault(service, {})[key] = selector
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.cache_path)
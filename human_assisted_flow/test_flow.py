@@ -1,19 +1,39 @@
 import unittest
 from unittest.mock import MagicMock, patch
+import io
 import json
 import os
 import sys
+import tempfile
 
 # Add the directory to path so we can import main
-sys.path.append(os.path.abspath("."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from main import ensure_directories, append_to_final_article, get_latest_response
+from artifacts import ArtifactWriter, screenshot_options
+from completion import log_completion, snapshot_responses, wait_for_completion
+from pool import FlowSlot, render_status
+from extractor import extract
+import bench_extractor
+import main as flow_main
+import tracing
 
 class TestHumanAssistedFlow(unittest.TestCase):
     
     def setUp(self):
-        # Create dummy config if needed, but we rely on the real one or mocked one
-        pass
+        # The real config.json, read once and shared by every test
+        flow_main.load_config()
+
+    def test_config_is_read_on_first_use_from_the_module_folder(self):
+        import subprocess
+        code = ("import sys; sys.path.insert(0, sys.argv[1]); import main; assert main.config is None; "
+                "main.load_config(); print(len(main.get_prompt_assembler().templates))")
+        with tempfile.TemporaryDirectory() as tmp:
+            result = subprocess.run([sys.executable, "-c", code, os.path.dirname(flow_main.__file__)],
+                                    cwd=tmp, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(int(result.stdout), len(flow_main.config['prompts']))
+        self.assertIs(flow_main.load_config(), flow_main.config)
 
     def test_ensure_directories(self):
         ensure_directories()
@@ -50,6 +70,587 @@ class TestHumanAssistedFlow(unittest.TestCase):
         self.assertIsNone(text)
         self.assertIsNone(element)
 
+    def test_wait_for_completion_passes_baseline_and_selectors(self):
+        mock_page = MagicMock()
+        mock_page.evaluate.return_value = {"reason": "stable", "first_change_ms": 800, "chars": 42}
+        selectors = {"latest_response": ".answer", "stop_button": ".stop"}
+        
+        result = wait_for_completion(mock_page, selectors, [2, "old"], quiet_period_ms=1500, timeout_ms=9000)
+        
+        self.assertEqual(result["reason"], "stable")
+        self.assertEqual(result["quiet_period_ms"], 1500)
+        self.assertIn("wall_ms", result)
+        args = mock_page.evaluate.call_args[0][1]
+        self.assertEqual(args, [".answer", ".stop", 2, "old", 1500, 9000])
+
+    def test_wait_for_completion_reports_errors(self):
+        mock_page = MagicMock()
+        mock_page.evaluate.side_effect = Exception("page closed")
+        
+        result = wait_for_completion(mock_page, {"latest_response": ".answer"}, [0, None])
+        
+        self.assertEqual(result["reason"], "error")
+        self.assertEqual(snapshot_responses(mock_page, ".answer"), [0, None])
+
+    def test_log_completion_appends_jsonl(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log_completion({"reason": "stable", "first_change_ms": 100, "wall_ms": 3000, "chars": 10}, "Phase_X", "gemini", tmp)
+            with open(os.path.join(tmp, "completion_log.jsonl"), encoding="utf-8") as f:
+                entry = json.loads(f.readline())
+        self.assertEqual(entry["phase"], "Phase_X")
+        self.assertEqual(entry["wall_ms"], 3000)
+
+    def test_article_flow_runs_every_phase_in_order(self):
+        gemini_step = "全部で3個のステップで解決します。\n#### 【プロンプト】\n```\nステップのプロンプト\n```"
+        replies = {
+            "Phase_0_Format": "理解しました",
+            "Phase_1_Intro_Step1": gemini_step,
+            "Phase_3_Step2_Plan": gemini_step,
+            "Phase_4_LastStep_Plan": gemini_step,
+        }
+        calls = []
+        
+        def fake_phase(phase_name, source_page, target_page, prompt, source_selectors, target_selectors, flow_folder):
+            calls.append((phase_name, target_page))
+            return replies.get(phase_name, f"{phase_name} の回答")
+        
+        pages = {"gemini": "gemini-page", "chatgpt": "chatgpt-page"}
+        # 回答は記事の形になっていないので、フォーマット検証（直してもらう依頼）は止めておく
+        with tempfile.TemporaryDirectory() as tmp, patch("main.run_cached_phase", side_effect=fake_phase), \
+                patch("main.conformance", None):
+            flow_main.drive_flow(flow_main.article_flow("問題", "", tmp), pages, tmp)
+        
+        self.assertEqual(calls, [
+            ("Phase_0_Format", "gemini-page"),
+            ("Phase_1_Intro_Step1", "gemini-page"),
+            ("Phase_2_Step1_Execution", "chatgpt-page"),
+            ("Phase_3_Step2_Plan", "gemini-page"),
+            ("Phase_3_Step2_Execution", "chatgpt-page"),
+            ("Phase_4_LastStep_Plan", "gemini-page"),
+            ("Phase_5_LastStep_Execution", "chatgpt-page"),
+            ("Phase_6_Summary", "gemini-page"),
+        ])
+
+    def test_drive_flow_retries_failed_execution_phase(self):
+        attempts = []
+        
+        def flaky_phase(phase_name, *args):
+            attempts.append(phase_name)
+            if phase_name == "Phase_2_Step1_Execution" and attempts.count(phase_name) == 1:
+                raise RuntimeError("tab crashed")
+            return "全部で2個のステップ\n```\nプロンプト\n```"
+        
+        pages = {"gemini": MagicMock(), "chatgpt": MagicMock()}
+        with tempfile.TemporaryDirectory() as tmp, patch("main.run_cached_phase", side_effect=flaky_phase), patch("main.time.sleep"):
+            flow_main.drive_flow(flow_main.article_flow("問題", "", tmp), pages, tmp)
+        
+        self.assertEqual(attempts.count("Phase_2_Step1_Execution"), 2)
+        self.assertEqual(attempts[-1], "Phase_6_Summary")
+
+    def test_traced_flow_records_one_span_per_browser_request(self):
+        attempts = []
+        
+        def flaky_phase(phase_name, source, target, prompt, source_selectors, target_selectors, flow_folder):
+            attempts.append(phase_name)
+            if phase_name == "Phase_2_Step1_Execution" and attempts.count(phase_name) == 1:
+                raise RuntimeError("tab crashed")
+            with flow_main.phase_span(flow_folder, flow_main.page_service(target)).timed("human_wait_s"):
+                pass
+            return "全部で3個のステップ\n```\nプロンプト\n```"
+        
+        pages = {"gemini": MagicMock(url="https://gemini/app/1"), "chatgpt": MagicMock(url="https://chatgpt/c/1")}
+        with tempfile.TemporaryDirectory() as tmp, patch("main.run_cached_phase", side_effect=flaky_phase), patch("main.time.sleep"):
+            flow_main.drive_flow(flow_main.traced_flow(flow_main.article_flow("問題", "", tmp), tmp), pages, tmp)
+            spans = tracing.load_spans([os.path.join(tmp, flow_main.TRACE_FILE)])
+        
+        phases = [s for s in spans if s["name"] == "phase"]
+        self.assertEqual([s["phase"] for s in phases], attempts)
+        failed, retried = [s for s in phases if s["phase"] == "Phase_2_Step1_Execution"]
+        self.assertEqual((failed["status"], failed["attempt"]), ("error", 1))
+        self.assertEqual((retried["status"], retried["retries"], retried["retry_sleep_s"]), ("ok", 1, 2))
+        self.assertTrue(all("human_wait_s" in s and s["tokens_out"] > 0 for s in phases if s["status"] == "ok"))
+        flow_span = next(s for s in spans if s["name"] == "flow")
+        self.assertTrue(flow_span["completed"])
+        self.assertTrue(all(s["parent"] == flow_span["span"] for s in phases))
+        
+        summary = tracing.summarize(spans)
+        self.assertEqual(summary["Phase_3_StepN_Execution"]["spans"], 1)
+        self.assertEqual(summary["Phase_2_Step1_Execution"]["errors"], 1)
+        self.assertIn("p95", summary["Phase_0_Format"]["metrics"]["wall_s"])
+
+    def test_phase_graph_expands_repeat_groups_and_validates(self):
+        graph = flow_main.PhaseGraph(flow_main.config['phases'])
+        self.assertEqual([n.id for n in graph.ready()], ["format"])
+        for node_id in ("format", "intro", "step1"):
+            graph.complete(node_id, "回答")
+        graph.expand("middle", 2)
+        self.assertEqual([n.name for n in graph.ready()], ["Phase_3_Step2_Plan"])
+        self.assertEqual(graph.items["middle.plan#2"].source_node, "step1")
+        self.assertEqual(graph.items["middle.plan#3"].source_node, "middle.run#2")
+        self.assertEqual(graph.resolve("middle"), "middle.run#3")
+        
+        with self.assertRaisesRegex(ValueError, "循環"):
+            flow_main.PhaseGraph([{"id": "a", "target": "gemini", "prompt_template": "x", "after": ["b"]},
+                                  {"id": "b", "target": "gemini", "prompt_template": "x", "after": ["a"]}])
+        with self.assertRaisesRegex(ValueError, "missing"):
+            flow_main.PhaseGraph([{"id": "a", "target": "gemini", "prompt_template": "x", "from": "missing"}])
+        
+        policy = flow_main.RetryPolicy(attempts=4, backoff_s=2, multiplier=2, max_backoff_s=5)
+        self.assertEqual([policy.delay(n) for n in (1, 2, 3)], [2, 4, 5])
+
+    def test_independent_nodes_for_different_services_run_as_one_batch(self):
+        graph = flow_main.PhaseGraph([
+            {"id": "a", "name": "A", "target": "gemini", "prompt_template": "A: {problem_settings}", "inputs": ["problem_settings"]},
+            {"id": "b", "name": "B", "target": "chatgpt", "prompt_template": "B: {problem_settings}", "inputs": ["problem_settings"]},
+            {"id": "c", "name": "C", "target": "gemini", "from": "b", "after": ["a"],
+             "prompt_template": "C: {previous_response}", "inputs": ["previous_response"]},
+        ])
+        with tempfile.TemporaryDirectory() as tmp, patch("main.time.sleep"):
+            checkpoint = flow_main.new_checkpoint(tmp, "問題", "")
+            flow = flow_main.checkpointed_flow(flow_main.article_flow("問題", "", tmp, graph), checkpoint, {}, tmp)
+            batch = next(flow)
+            self.assertEqual([(r.phase_name, r.target, r.prompt) for r in batch],
+                             [("A", "gemini", "A: 問題"), ("B", "chatgpt", "B: 問題")])
+            retry = flow.send(["Aの回答", RuntimeError("tab crashed")])
+            self.assertEqual((retry.phase_name, retry.attempt), ("B", 2))
+            last = flow.send("Bの回答")
+            self.assertEqual((last.phase_name, last.prompt), ("C", "C: Bの回答"))
+            with self.assertRaises(StopIteration):
+                flow.send("Cの回答")
+        self.assertEqual([p["phase"] for p in checkpoint.phases], ["A", "B", "C"])
+
+    def test_resume_skips_completed_phases_and_rebuilds_article(self):
+        calls = []
+        
+        def browser_phase(phase_name, source, target, prompt, source_selectors, target_selectors, flow_folder):
+            calls.append(phase_name)
+            if phase_name == crash_at:
+                raise KeyboardInterrupt
+            response = f"{phase_name} の回答\n全3ステップ\n【プロンプト】\nMarkdown\n{phase_name} のプロンプト"
+            # finish_phase と同じく、回答を最終記事に追記する
+            flow_main.append_to_final_article(response, phase_name, flow_folder)
+            return response
+        
+        def run(folder, checkpoint):
+            pages = {"gemini": MagicMock(url="https://gemini/app/1"), "chatgpt": MagicMock(url="https://chatgpt/c/1")}
+            flow = flow_main.checkpointed_flow(flow_main.article_flow("問題", "ヒント", folder), checkpoint, pages, folder)
+            try:
+                flow_main.drive_flow(flow, pages, folder)
+            finally:
+                flow.close()
+        
+        with tempfile.TemporaryDirectory() as tmp, patch("main.run_cached_phase", side_effect=browser_phase), \
+                patch("main.conformance", None):
+            clean, interrupted = os.path.join(tmp, "clean"), os.path.join(tmp, "interrupted")
+            crash_at = None
+            run(clean, flow_main.new_checkpoint(clean, "問題", "ヒント"))
+            
+            crash_at = "Phase_4_LastStep_Plan"
+            with self.assertRaises(KeyboardInterrupt):
+                run(interrupted, flow_main.new_checkpoint(interrupted, "問題", "ヒント"))
+            
+            calls.clear()
+            crash_at = None
+            checkpoint = flow_main.Checkpoint.load(os.path.join(interrupted, flow_main.CHECKPOINT_FILE))
+            self.assertEqual(checkpoint.data["problem_settings"], "問題")
+            run(interrupted, checkpoint)
+            
+            with open(os.path.join(clean, "final_article.md"), encoding="utf-8") as f:
+                expected = f.read()
+            with open(os.path.join(interrupted, "final_article.md"), encoding="utf-8") as f:
+                resumed = f.read()
+        
+        self.assertEqual(calls, ["Phase_4_LastStep_Plan", "Phase_5_LastStep_Execution", "Phase_6_Summary"])
+        self.assertEqual(resumed, expected)
+        self.assertTrue(checkpoint.data["completed"])
+
+    def test_regenerate_reruns_only_the_phases_from_that_step(self):
+        calls, seeds = [], []
+        
+        def browser_phase(phase_name, source, target, prompt, source_selectors, target_selectors, flow_folder):
+            if phase_name == flow_main.RESEED_PHASE:
+                seeds.append((flow_main.page_service(target), prompt))
+                return "了解しました"
+            calls.append(phase_name)
+            response = f"{phase_name} の回答{len(calls)}\n全3ステップ\n【プロンプト】\nMarkdown\n{phase_name} のプロンプト"
+            flow_main.append_to_final_article(response, phase_name, flow_folder)
+            return response
+        
+        def run(folder, checkpoint):
+            pages = {"gemini": MagicMock(url="https://gemini/app/1"), "chatgpt": MagicMock(url="https://chatgpt/c/1")}
+            flow = flow_main.checkpointed_flow(flow_main.article_flow("問題", "", folder), checkpoint, pages, folder)
+            flow_main.drive_flow(flow_main.reseeding_flow(flow, pages, folder), pages, folder)
+            return pages
+        
+        with tempfile.TemporaryDirectory() as tmp, patch("main.run_cached_phase", side_effect=browser_phase), \
+                patch("main.conformance", None):
+            run(tmp, flow_main.new_checkpoint(tmp, "問題", ""))
+            checkpoint = flow_main.Checkpoint.load(os.path.join(tmp, flow_main.CHECKPOINT_FILE))
+            with self.assertRaises(ValueError):
+                flow_main.forget_from_step(checkpoint, 7)
+            removed = flow_main.forget_from_step(checkpoint, 2)
+            calls.clear()
+            with patch("sys.stdout", new_callable=io.StringIO):
+                pages = run(tmp, flow_main.Checkpoint.load(os.path.join(tmp, flow_main.CHECKPOINT_FILE)))
+            self.assertNotIn("reseed", flow_main.Checkpoint.load(os.path.join(tmp, flow_main.CHECKPOINT_FILE)).data)
+            with open(os.path.join(tmp, "final_article.md"), encoding="utf-8") as f:
+                article = f.read()
+        
+        self.assertEqual(removed[0], "Phase_3_Step2_Plan")
+        self.assertEqual(calls, removed)
+        self.assertIn("Phase_1_Intro_Step1 の回答2", article)
+        # 回答の番号は calls の長さなので、やり直したフェーズは 1 から数え直している
+        self.assertIn("Phase_3_Step2_Plan の回答1", article)
+        self.assertNotIn("Phase_3_Step2_Plan の回答4", article)
+        self.assertEqual(article.count("Phase_6_Summary の回答"), 1)
+        # 前の会話は開き直さず、新しいチャットに Phase_0 のフォーマット定義から残したフェーズまでを引き継ぐ
+        self.assertEqual([service for service, _ in seeds], ["gemini", "chatgpt"])
+        gemini_seed = seeds[0][1]
+        self.assertIn(flow_main.config['prompts']['phase_0'][:50], gemini_seed)
+        self.assertIn("Phase_1_Intro_Step1 の回答2", gemini_seed)
+        self.assertNotIn("Phase_3_Step2_Plan の回答", gemini_seed)
+        pages["gemini"].goto.assert_called_once_with(flow_main.config['browser_config']['gemini_url'])
+        self.assertNotIn(flow_main.RESEED_PHASE, article)
+
+        # チェックポイントのないフォルダーや壊れたチェックポイントは、ステップの指定の誤りと同じく終了コード 1 で終える
+        with tempfile.TemporaryDirectory() as tmp, patch("sys.stdout", new_callable=io.StringIO) as out:
+            self.assertEqual(flow_main.regenerate([os.path.join(tmp, "missing"), "--step", "2"]), 1)
+            with open(os.path.join(tmp, flow_main.CHECKPOINT_FILE), "w", encoding="utf-8") as f:
+                f.write("{")
+            self.assertEqual(flow_main.regenerate([tmp, "--step", "2"]), 1)
+        self.assertEqual(out.getvalue().count("エラー: チェックポイントを読み込めません"), 2)
+
+    def test_artifact_writer_keeps_article_by_section_and_dedupes_screenshots(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = ArtifactWriter(tmp)
+            writer.append_section("Phase_1", "導入")
+            writer.append_section("Phase_2", "古い回答")
+            writer.append_section("Phase_2", "回答")
+            writer.write_text("gemini_output/Phase_1.txt", "導入")
+            writer.save_screenshot("Phase_1", b"same image")
+            writer.save_screenshot("Phase_2", b"same image")
+            writer.save_screenshot("Phase_3", b"other image", "jpeg")
+            writer.close()
+            
+            with open(os.path.join(tmp, "final_article.md"), encoding="utf-8") as f:
+                self.assertEqual(f.read(), "\n\n導入\n\n回答")
+            with open(os.path.join(tmp, "screenshots", "index.jsonl"), encoding="utf-8") as f:
+                index = [json.loads(line) for line in f]
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp, "screenshots"))), ["Phase_1.png", "Phase_3.jpg", "index.jsonl"])
+            self.assertEqual(index[1]["duplicate_of"], "screenshots/Phase_1.png")
+            self.assertTrue(os.path.exists(os.path.join(tmp, "gemini_output", "Phase_1.txt")))
+            
+            # 再開したフローでも、前回の画像と同じものは保存しない
+            writer = ArtifactWriter(tmp)
+            writer.save_screenshot("Phase_4", b"other image", "jpeg")
+            writer.close()
+            self.assertFalse(os.path.exists(os.path.join(tmp, "screenshots", "Phase_4.jpg")))
+        
+        self.assertEqual(screenshot_options({"screenshot_format": "jpeg", "screenshot_quality": 60}),
+                         {"type": "jpeg", "quality": 60})
+        with self.assertRaises(ValueError):
+            screenshot_options({"screenshot_format": "bmp"})
+
+    def test_conformance_gate_reasks_before_chatgpt_sees_the_prompt(self):
+        spec = flow_main.conformance["spec"]
+        self.assertEqual(spec.order, ["タイトル", "原因", "解決策", "ステップ", "ラストステップ", "まとめ"])
+        good_intro = ("1-1：朝の準備が終わらない\n導入\n\n原因：時間が見えない\n説明\n\n"
+                      "解決策：逆算法\n全部で3つのステップで解決します。\nステップ1：書き出す\n\nラストステップ：調整\n\n"
+                      "ステップ1：書き出す\n説明\n\n【プロンプト】\nPlaintext\n朝やることを7時までに終わる順に並べてください。")
+        bad_intro = good_intro.replace("ステップ1：書き出す\n説明", "ステップ2：書き出す\n説明").replace(
+            "朝やること", "[あなたの朝の作業]")
+        problems = spec.check(bad_intro, ["タイトル", "原因", "解決策", "ステップ1", "【プロンプト】"])
+        self.assertIn("見出しの順番が違います（「ラストステップ」の後に「ステップ」があります）", problems)
+        self.assertTrue(any("[あなたの朝の作業]" in p for p in problems))
+        
+        replies = {
+            "Phase_0_Format": ["理解しました"],
+            "Phase_1_Intro_Step1": [bad_intro, good_intro],
+            "Phase_3_Step2_Plan": ["【ChatGPTからの回答例】\n> 一覧\n解説\nステップ2：並べる\n説明\n【プロンプト】\nPlaintext\n並べた一覧を時間順にしてください。"],
+            "Phase_4_LastStep_Plan": ["【ChatGPTからの回答例】\n> 計画\nラストステップ：調整\n説明\n【プロンプト】\nPlaintext\n5分短くしてください。"],
+            "Phase_6_Summary": ["【ChatGPTからの回答例】\n> 修正案\nまとめ：できそう\n明日から試せます。"],
+        }
+        calls = []
+        
+        def fake_phase(phase_name, source_page, target_page, prompt, source_selectors, target_selectors, flow_folder):
+            calls.append((phase_name, prompt))
+            return replies[phase_name].pop(0) if phase_name in replies else f"{phase_name} の回答"
+        
+        pages = {"gemini": "gemini-page", "chatgpt": "chatgpt-page"}
+        with tempfile.TemporaryDirectory() as tmp, patch("main.run_cached_phase", side_effect=fake_phase):
+            flow_main.drive_flow(flow_main.article_flow("問題", "", tmp), pages, tmp)
+            with open(os.path.join(tmp, "conformance_log.jsonl"), encoding="utf-8") as f:
+                log = [json.loads(line) for line in f]
+        
+        names = [name for name, _ in calls]
+        self.assertEqual(names[:4], ["Phase_0_Format", "Phase_1_Intro_Step1", "Phase_1_Intro_Step1", "Phase_2_Step1_Execution"])
+        self.assertIn("- 見出しの順番が違います", calls[2][1])
+        # ChatGPT には直った回答から抽出したプロンプトだけが届く
+        self.assertEqual(calls[3][1], "朝やることを7時までに終わる順に並べてください。")
+        self.assertEqual(names.count("Phase_1_Intro_Step1"), 2)
+        self.assertEqual([entry["phase"] for entry in log if entry["problems"]], ["Phase_1_Intro_Step1"])
+        self.assertEqual(len(log), 5)
+
+    def test_render_status_lists_pending_actions(self):
+        slot = FlowSlot(1, {})
+        slot.start(None, "output/flow_x_1", "締め切りを守れない")
+        slot.wait(flow_main.PhaseRequest("Phase_1_Intro_Step1", None, "gemini", "p"), None)
+        idle = FlowSlot(2, {})
+        
+        view = render_status([slot, idle], queued=3)
+        
+        self.assertIn("【Gemini】タブ #1 で送信してください", view)
+        self.assertIn("#2  （空き）", view)
+        self.assertIn("待機中の記事: 3 本", view)
+
+    def test_extract_plaintext_prompt_and_step_count(self):
+        text = ("解決策：全部で３つのステップで進めます。\n"
+                "ステップ1：書き出す\n"
+                "【プロンプト】\n"
+                "Plaintext\n"
+                "やることを全部書き出してください。\n"
+                "全体で5〜6ステップにまとめてください。\n"
+                "【ChatGPTからの回答例】\n"
+                "1. 洗濯\n")
+        
+        result = extract(text)
+        
+        self.assertEqual(result.prompt, "やることを全部書き出してください。\n全体で5〜6ステップにまとめてください。")
+        self.assertEqual(result.total_steps, 3)
+        self.assertEqual([s["title"] for s in result.sections],
+                         ["解決策：全部で３つのステップで進めます。", "ステップ1：書き出す", "【プロンプト】", "【ChatGPTからの回答例】"])
+        self.assertEqual(text[result.sections[-1]["start"]:result.sections[-1]["end"]], "【ChatGPTからの回答例】\n1. 洗濯\n")
+
+    def test_extractor_matches_saved_outputs(self):
+        results = bench_extractor.evaluate(bench_extractor.load_corpus())
+        
+        mismatches = [(r["file"], r["problems"]) for r in results if r["status"] == "mismatch"]
+        self.assertEqual(mismatches, [])
+        self.assertTrue(any(r["status"] == "ok" for r in results))
+
+    def test_archive_round_trip_dedupes_and_indexes(self):
+        from archive import RunArchive, find_flow_folders, main as archive_main
+        with tempfile.TemporaryDirectory() as tmp:
+            answer = "ステップ1の回答です。\n" * 30
+            flows = {}
+            for name in ("flow_20251129_133522", "flow_20251129_135104"):
+                folder = os.path.join(tmp, "output", name)
+                for sub in ("gemini_output", "chatgpt_output", "screenshots", "user_data"):
+                    os.makedirs(os.path.join(folder, sub))
+                files = {
+                    "gemini_output/Phase_1_Intro_Step1.txt": answer.encode("utf-8"),
+                    "chatgpt_output/Phase_2_Step1_Execution.txt": f"{name} の実行結果".encode("utf-8"),
+                    "screenshots/Phase_1_Intro_Step1.png": b"\x89PNG same image",
+                    "final_article.md": f"\n\n## Phase_1_Intro_Step1\n\n{answer}\n".encode("utf-8"),
+                    "checkpoint.json": json.dumps({"problem_settings": "家事", "completed": True}).encode("utf-8"),
+                }
+                for path, data in files.items():
+                    with open(os.path.join(folder, path), "wb") as f:
+                        f.write(data)
+                with open(os.path.join(folder, "user_data", "Cookies"), "wb") as f:
+                    f.write(b"secret")
+                flows[name] = files
+
+            self.assertEqual([os.path.basename(p) for p in find_flow_folders([os.path.join(tmp, "output")])], list(flows))
+            with RunArchive(os.path.join(tmp, "archive.sqlite3")) as archive:
+                for folder in find_flow_folders([os.path.join(tmp, "output")]):
+                    archive.import_folder(folder)
+                # 取り込み直しても増えない
+                archive.import_folder(os.path.join(tmp, "output", "flow_20251129_133522"))
+                stats = archive.stats()
+                self.assertEqual(stats["files"], 10)
+                # 回答とスクリーンショットは2本で共有、最終記事は回答への参照
+                self.assertEqual(stats["blobs"], 6)
+                self.assertLess(stats["stored_bytes"], stats["file_bytes"] / 4)
+
+                hits = archive.find(phase="Phase_2_Step1_Execution", service="chatgpt")
+                self.assertEqual([(row[0], row[1]) for row in hits],
+                                 [(name, "chatgpt_output/Phase_2_Step1_Execution.txt") for name in flows])
+
+                dest = os.path.join(tmp, "restored")
+                self.assertEqual(archive.extract("flow_20251129_135104", dest), 5)
+                for path, data in flows["flow_20251129_135104"].items():
+                    with open(os.path.join(dest, "flow_20251129_135104", path), "rb") as f:
+                        self.assertEqual(f.read(), data)
+                self.assertFalse(os.path.exists(os.path.join(dest, "flow_20251129_135104", "user_data")))
+                self.assertTrue(archive.verify("flow_20251129_133522", os.path.join(tmp, "output", "flow_20251129_133522")))
+                exported = archive.export_run("flow_20251129_133522")
+                self.assertEqual(exported["article"], flows["flow_20251129_133522"]["final_article.md"].decode("utf-8"))
+                self.assertEqual(sorted((r["phase"], r["service"]) for r in exported["responses"]),
+                                 [("Phase_1_Intro_Step1", "gemini"), ("Phase_2_Step1_Execution", "chatgpt")])
+
+            # 前回の取り込みの後に消したファイルがあっても、今回取り込んだファイルだけを確かめて消す
+            folder = os.path.join(tmp, "output", "flow_20251129_133522")
+            os.remove(os.path.join(folder, "screenshots", "Phase_1_Intro_Step1.png"))
+            with patch("sys.stdout", new_callable=io.StringIO):
+                archive_main(["--archive", os.path.join(tmp, "archive.sqlite3"), "import", folder, "--prune"])
+            self.assertEqual(os.listdir(folder), ["user_data"])
+
+    def test_similar_prompt_answers_are_offered_or_used_in_pool_mode(self):
+        from llm_cache import ResponseCache
+        from similar_prompts import PromptIndex
+        prompt = "毎朝の準備に時間がかかりすぎます。前日の夜にできる工夫を5つ、手順と一緒に挙げてください。" * 2
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(os.path.join(tmp, "cache.sqlite3"))
+            index = PromptIndex(os.path.join(tmp, "similar.sqlite3"))
+            with patch.object(flow_main, "response_cache", cache), patch.object(flow_main, "similar_index", index), \
+                    patch("sys.stdout", new_callable=io.StringIO):
+                key, cached = flow_main.lookup_cached_response("chatgpt", prompt, "flow_a")
+                self.assertIsNone(cached)
+                flow_main.record_response("chatgpt", prompt, "前日の夜の工夫", key, cached, "Phase_2", "flow_a")
+
+                near = prompt.replace("5つ", "3つ", 1)
+                with patch.object(flow_main, "similar_auto", False):
+                    with patch("builtins.input", return_value="n"):
+                        self.assertIsNone(flow_main.lookup_cached_response("chatgpt", near, "flow_b")[1])
+                    with patch("builtins.input", return_value="y"):
+                        self.assertEqual(flow_main.lookup_cached_response("chatgpt", near, "flow_b")[1], "前日の夜の工夫")
+                with patch.object(flow_main, "similar_auto", True), patch("builtins.input") as ask:
+                    self.assertEqual(flow_main.lookup_cached_response("chatgpt", near, "flow_c")[1], "前日の夜の工夫")
+                    ask.assert_not_called()
+                # Gemini への依頼は対象外
+                self.assertIsNone(flow_main.lookup_cached_response("gemini", near, "flow_c")[1])
+                stats = index.stats()
+                self.assertEqual((stats["hits"], stats["declined"]), (2, 1))
+            index.close()
+            cache.close()
+            flow_main.conversation_context.clear()
+
+    def test_lean_mode_shares_one_browser_and_blocks_heavy_requests(self):
+        from lean import lean_settings, should_block
+        settings = lean_settings({"lean": {"enabled": True, "shared_user_data_dir": "./user_data"}})
+        self.assertTrue(should_block("image", "https://chatgpt.com/logo.png", settings))
+        self.assertTrue(should_block("xhr", "https://chatgpt.com/ces/v1/t", settings))
+        self.assertFalse(should_block("document", "https://gemini.google.com/app", settings))
+        self.assertIsNone(lean_settings({}))
+
+        playwright = MagicMock()
+        context = playwright.chromium.launch_persistent_context.return_value
+        with patch.object(flow_main, "lean", settings), patch("builtins.input", return_value=""), \
+                patch("sys.stdout", new_callable=io.StringIO):
+            contexts, pages = flow_main.launch_browsers(playwright)
+        # プロファイルが同じなら Chromium は1つだけ起動し、ChatGPT はタブを追加する
+        playwright.chromium.launch_persistent_context.assert_called_once()
+        self.assertIs(contexts["gemini"], contexts["chatgpt"])
+        self.assertEqual(pages, {"gemini": context.pages[0], "chatgpt": context.new_page.return_value})
+        context.route.assert_called_once()
+
+        route = MagicMock()
+        route.request.resource_type, route.request.url = "font", "https://gemini.google.com/font.woff2"
+        context.route.call_args[0][1](route)
+        route.abort.assert_called_once()
+        route.continue_.assert_not_called()
+
+        # 要素数が上限を超えたページは、貼り付ける前に新しいチャットにし、それまでの会話を引き継ぐ
+        def one_request():
+            yield flow_main.PhaseRequest("Phase_3_Step2_Execution", "gemini", "chatgpt", "次のプロンプト")
+        
+        page = MagicMock(url="https://chatgpt.com/c/123")
+        page.evaluate.return_value = settings["max_dom_nodes"] + 1
+        with tempfile.TemporaryDirectory() as tmp, patch.object(flow_main, "lean", settings), \
+                patch("sys.stdout", new_callable=io.StringIO):
+            checkpoint = flow_main.new_checkpoint(tmp, "問題", "")
+            checkpoint.record(kind="phase", phase="Phase_2_Step1_Execution", target="chatgpt",
+                              prompt="最初のプロンプト", response="最初の回答", article_before=0, pages={})
+            flow_main.active_checkpoints[tmp] = checkpoint
+            flow_main.conversation_context[(tmp, "chatgpt")] = "前のチャットの履歴"
+            try:
+                flow = flow_main.reseeding_flow(one_request(), {"chatgpt": page}, tmp)
+                seed = next(flow)
+                self.assertEqual((seed.phase_name, seed.target), (flow_main.RESEED_PHASE, "chatgpt"))
+                self.assertIn("最初のプロンプト", seed.prompt)
+                self.assertIn("最初の回答", seed.prompt)
+                # 会話履歴ハッシュ（キャッシュのキー）も新しいチャットに合わせて空から数え直す
+                self.assertNotIn((tmp, "chatgpt"), flow_main.conversation_context)
+                # 引き継ぎのメッセージの分は数えないので、続く依頼の前にもう一度切り替えない
+                self.assertEqual(flow.send("了解しました").phase_name, "Phase_3_Step2_Execution")
+            finally:
+                flow_main.active_checkpoints.pop(tmp, None)
+                flow_main.dom_baselines.pop((tmp, "chatgpt"), None)
+        page.goto.assert_called_once_with(flow_main.config['browser_config']['chatgpt_url'])
+
+    def test_selector_fallbacks_are_probed_cached_and_fail_fast(self):
+        from selector_probe import SelectorResolver
+
+        class FakePage:
+            """present にあるセレクターだけが見つかるページ"""
+            url = "https://chatgpt.com/c/1"
+
+            def __init__(self, present):
+                self.present = present
+                self.waits = []
+                self.clicks = []
+
+            def __getattr__(self, name):
+                return MagicMock()
+
+            def evaluate(self, script, selectors=None):
+                if not isinstance(selectors, list):
+                    return [0, None]
+                return [self.present.get(selector, 0) for selector in selectors]
+
+            def query_selector(self, selector):
+                return MagicMock() if self.present.get(selector) else None
+
+            def wait_for_selector(self, selector, timeout):
+                self.waits.append((selector, timeout))
+                if not any(self.present.get(option.strip()) for option in selector.split(",")):
+                    raise TimeoutError(f"{selector}: timeout")
+
+            def query_selector_all(self, selector):
+                element = MagicMock()
+                element.inner_text.return_value = f"answer from {selector}"
+                return [element]
+
+            def click(self, selector, timeout):
+                self.clicks.append(selector)
+
+        config_selectors = {"chatgpt": {"input_area": ["#prompt-textarea", "form textarea"],
+                                        "latest_response": [".markdown", ".assistant"]}}
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, "selectors.json")
+            resolver = SelectorResolver(config_selectors, cache_path)
+            # ログイン直後: 先頭の入力欄の候補がないので次の候補を選ぶ。回答はまだないので未確認
+            status, elapsed_ms = resolver.probe(FakePage({"form textarea": 1}), "chatgpt")
+            self.assertEqual(status, {"input_area": "ok", "latest_response": "unverified"})
+            self.assertEqual(resolver.current("chatgpt"), {"input_area": "form textarea", "latest_response": ".markdown"})
+            # 選んだセレクターは次の実行でも使う（config から消えた候補は使わない）
+            self.assertEqual(SelectorResolver(config_selectors, cache_path).current("chatgpt")["input_area"], "form textarea")
+            self.assertEqual(SelectorResolver({"chatgpt": {"input_area": "#prompt-textarea"}}, cache_path)
+                             .current("chatgpt"), {"input_area": "#prompt-textarea"})
+
+            with patch.object(flow_main, "selector_resolver", resolver), patch.object(flow_main, "lean", {}), \
+                    patch("sys.stdout", new_callable=io.StringIO):
+                # 回答が後ろの候補でしか見つからなければ、そちらに切り替えて覚える
+                text, _ = get_latest_response(FakePage({".assistant": 1}), ".markdown")
+                self.assertEqual(text, "answer from .assistant")
+                self.assertEqual(resolver.current("chatgpt")["latest_response"], ".assistant")
+                with open(cache_path, encoding="utf-8") as f:
+                    self.assertEqual(json.load(f)["chatgpt"]["latest_response"], ".assistant")
+
+                # どの候補も見つからなければ一度だけ待ち、次のフェーズからは長く待たない
+                empty = FakePage({})
+                self.assertEqual(get_latest_response(empty, ".assistant"), (None, None))
+                self.assertTrue(resolver.is_broken("chatgpt", "latest_response"))
+                get_latest_response(empty, ".assistant")
+                self.assertEqual([timeout for _, timeout in empty.waits], [120000, flow_main.BROKEN_SELECTOR_TIMEOUT_MS])
+
+                # 入力欄が壊れていると分かっていれば、クリックを待たずに手動の貼り付けに切り替える
+                resolver.broken.add(("chatgpt", "input_area"))
+                with patch("main.pyperclip.copy"):
+                    flow_main.begin_phase("Phase_1", empty, "prompt", resolver.current("chatgpt"))
+                self.assertEqual(empty.clicks, [])
+
+            # config の候補が1つだけでも、見つからなければ同じように壊れていると記録する
+            single = SelectorResolver({"chatgpt": {"latest_response": ".markdown"}}, None)
+            with patch.object(flow_main, "selector_resolver", single), patch.object(flow_main, "lean", {}), \
+                    patch("sys.stdout", new_callable=io.StringIO):
+                empty = FakePage({})
+                self.assertEqual(get_latest_response(empty, ".markdown"), (None, None))
+                self.assertTrue(single.is_broken("chatgpt", "latest_response"))
+                get_latest_response(empty, ".markdown")
+                self.assertEqual([timeout for _, timeout in empty.waits], [120000, flow_main.BROKEN_SELECTOR_TIMEOUT_MS])
+
     @patch("main.sync_playwright")
     @patch("main.pyperclip.copy")
     @patch("builtins.input", return_value="") # Mock user pressing Enter
@@ -0,0 +1,395 @@
+"""Durable job queue for unattended API-mode generation.
+
+Topics are added to a SQLite file (by default articles/jobs.sqlite3) and
+worker processes, on this host or on others that share the volume, take them
+one at a time:
+
+- a worker claims a job with a lease and renews it with heartbeats while the
+  article is generated. A worker that loses its lease (it stalled past the
+  lease, so the job went to someone else) stops working on that job;
+- a lease that expires without a heartbeat puts the job back in the queue,
+  until its attempts are used up. Every attempt works in its own folder
+  (<output>/.work/<job>/attempt-<n>/) and continues from the checkpoint of the
+  previous attempt, so a crash loses at most the step in progress;
+- the finished article is moved to its final path in the same transaction
+  that marks the job done, and only by the current lease holder, so every
+  job is completed at least once and its file is written exactly once.
+
+    python cli.py queue add --topics-file topics.txt
+    python cli.py queue worker --processes 4
+    python cli.py queue status
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import time
+import uuid
+
+DEFAULT_QUEUE_PATH = os.path.join("articles", "jobs.sqlite3")
+DEFAULT_LEASE_S = 300.0
+DEFAULT_MAX_ATTEMPTS = 3
+WORK_DIR = ".work"
+ARTICLE_FILE = "article.md"
+
+
+class LeaseLost(Exception):
+    """The job was re-leased to another worker; this worker must stop working on it."""
+
+
+class JobQueue:
+    """The jobs table in one SQLite file. Paths are stored relative to the file's folder."""
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, clock=time.time):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.clock = clock
+        os.makedirs(self.root, exist_ok=True)
+        # No WAL: its shared-memory index does not work across hosts sharing a volume
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY,"
+            " topic TEXT NOT NULL,"
+            " filename TEXT NOT NULL UNIQUE,"
+            " options TEXT NOT NULL,"
+            " state TEXT NOT NULL,"  # queued, leased, done, failed
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " max_attempts INTEGER NOT NULL,"
+            " lease_owner TEXT,"
+            " lease_expires REAL,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, id)")
+
+    def close(self):
+        self._db.close()
+
+    def _transaction(self):
+        """BEGIN IMMEDIATE: one writer at a time, across processes and hosts."""
+        return _Transaction(self._db)
+
+    def add(self, topics, output_dir=None, max_attempts=DEFAULT_MAX_ATTEMPTS, **options):
+        """Queue one job per topic; returns the new job ids.
+
+        A topic already in the queue for the same output folder (and not failed)
+        is skipped, so adding the same topics file twice queues nothing new.
+        """
+        from main import article_filename
+        output_dir = os.path.relpath(os.path.abspath(output_dir or self.root), self.root)
+        ids = []
+        with self._transaction():
+            existing = {(topic, os.path.dirname(filename)) for topic, filename in self._db.execute(
+                "SELECT topic, filename FROM jobs WHERE state != 'failed'")}
+            index = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM jobs").fetchone()[0]
+            for topic in topics:
+                filename = article_filename(topic, index + 1, output_dir)
+                if (topic, os.path.dirname(filename)) in existing:
+                    continue
+                index += 1
+                cursor = self._db.execute(
+                    "INSERT INTO jobs (id, topic, filename, options, state, max_attempts, created_at)"
+                    " VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                    (index, topic, filename, json.dumps(options, ensure_ascii=False), max_attempts, self.clock()))
+                existing.add((topic, os.path.dirname(filename)))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def _expire_leases(self, now):
+        """Return jobs whose lease ran out to the queue, or fail them once their attempts are used up."""
+        self._db.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,"
+            " error = 'lease expired', lease_owner = NULL, lease_expires = NULL,"
+            " finished_at = CASE WHEN attempts >= max_attempts THEN ? ELSE finished_at END"
+            " WHERE state = 'leased' AND lease_expires < ?", (now, now))
+
+    def claim(self, worker, lease_s=DEFAULT_LEASE_S):
+        """Lease the oldest queued job to worker; returns the job as a dict, or None if nothing is queued."""
+        now = self.clock()
+        with self._transaction():
+            self._expire_leases(now)
+            row = self._db.execute("SELECT id FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET state = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1,"
+                " started_at = COALESCE(started_at, ?) WHERE id = ?", (worker, now + lease_s, now, row[0]))
+            return self.get(row[0])
+
+    def get(self, job_id):
+        cursor = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([column[0] for column in cursor.description], row))
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def heartbeat(self, job_id, worker, lease_s=DEFAULT_LEASE_S):
+        """Extend the lease; raises LeaseLost if worker no longer holds it."""
+        cursor = self._db.execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+            (self.clock() + lease_s, job_id, worker))
+        if not cursor.rowcount:
+            raise LeaseLost(f"job {job_id} is no longer leased to {worker}")
+
+    def _holds_lease(self, job_id, worker):
+        return self._db.execute("SELECT 1 FROM jobs WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                                (job_id, worker)).fetchone() is not None
+
+    def complete(self, job_id, worker, result_path):
+        """Move result_path to the job's file and mark it done, if worker still holds the lease.
+
+        Returns the final path; raises LeaseLost (and leaves the file alone) otherwise.
+        """
+        with self._transaction():
+            if not self._holds_lease(job_id, worker):
+                raise LeaseLost(f"job {job_id} is no longer leased to {worker}")
+            final_path = self.file_path(self.get(job_id))
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(result_path, final_path)
+            self._db.execute("UPDATE jobs SET state = 'done', lease_owner = NULL, lease_expires = NULL,"
+                             " finished_at = ?, error = NULL WHERE id = ?", (self.clock(), job_id))
+        return final_path
+
+    def fail(self, job_id, worker, error):
+        """Give the job back to the queue, or fail it once its attempts are used up."""
+        with self._transaction():
+            if not self._holds_lease(job_id, worker):
+                return
+            self._db.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,"
+                " finished_at = CASE WHEN attempts >= max_attempts THEN ? ELSE NULL END,"
+                " lease_owner = NULL, lease_expires = NULL, error = ? WHERE id = ?",
+                (self.clock(), str(error)[:1000], job_id))
+
+    def file_path(self, job):
+        return os.path.normpath(os.path.join(self.root, job["filename"]))
+
+    def work_dir(self, job):
+        return os.path.normpath(os.path.join(self.root, os.path.dirname(job["filename"]), WORK_DIR, str(job["id"])))
+
+    def pending(self):
+        """Jobs still queued or leased."""
+        return self._db.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'leased')").fetchone()[0]
+
+    def status(self, window_s=600):
+        now = self.clock()
+        counts = dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        recent, average = self._db.execute(
+            "SELECT COUNT(*), AVG(finished_at - started_at) FROM jobs WHERE state = 'done' AND finished_at >= ?",
+            (now - window_s,)).fetchone()
+        workers = self._db.execute(
+            "SELECT lease_owner, COUNT(*) FROM jobs WHERE state = 'leased' AND lease_expires >= ? GROUP BY lease_owner",
+            (now,)).fetchall()
+        expired = self._db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'leased' AND lease_expires < ?",
+                                   (now,)).fetchone()[0]
+        per_minute = recent / (window_s / 60)
+        queued = counts.get("queued", 0) + expired
+        return {
+            "queued": counts.get("queued", 0), "leased": counts.get("leased", 0) - expired, "expired": expired,
+            "done": counts.get("done", 0), "failed": counts.get("failed", 0),
+            "workers": dict(workers), "done_per_min": per_minute, "avg_job_s": average,
+            "eta_s": queued / per_minute * 60 if per_minute else None,
+        }
+
+    def failures(self):
+        return self._db.execute("SELECT id, topic, attempts, error FROM jobs WHERE state = 'failed' ORDER BY id").fetchall()
+
+
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def prepare_attempt(queue, job):
+    """Create this attempt's folder, seeded with the newest checkpoint of an earlier attempt."""
+    base = queue.work_dir(job)
+    attempt_dir = os.path.join(base, f"attempt-{job['attempts']}")
+    os.makedirs(attempt_dir, exist_ok=True)
+    target = os.path.join(attempt_dir, ARTICLE_FILE)
+    from main import checkpoint_path
+    for attempt in range(job["attempts"] - 1, 0, -1):
+        earlier = checkpoint_path(os.path.join(base, f"attempt-{attempt}", ARTICLE_FILE))
+        if os.path.exists(earlier):
+            shutil.copyfile(earlier, checkpoint_path(target))
+            break
+    return target
+
+
+async def run_job(queue, job, worker, writer_chain, simulator_llm, lease_s=DEFAULT_LEASE_S, prompt_budget=None):
+    """Generate one leased job, renewing the lease, and complete or fail it."""
+    from main import checkpoint_path, generate_and_save, model_path
+    target = prepare_attempt(queue, job)
+    options = job["options"]
+    task = asyncio.ensure_future(generate_and_save(job["topic"], target, writer_chain, simulator_llm,
+                                                   asyncio.Semaphore(1), resume=True, deadline=options.get("deadline"),
+                                                   prompt_budget=prompt_budget))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=lease_s / 3)
+            if done:
+                break
+            queue.heartbeat(job["id"], worker, lease_s)
+        task.result()
+        if os.path.exists(checkpoint_path(target)):
+            # The deadline stopped it early; the next attempt continues from the checkpoint
+            raise RuntimeError("unfinished within the deadline")
+        final_path = queue.complete(job["id"], worker, target)
+        if os.path.exists(model_path(target)):
+            os.replace(model_path(target), model_path(final_path))
+    except LeaseLost as e:
+        print(f"[job {job['id']}] {e}; leaving it to the new holder.")
+        return None
+    except Exception as e:
+        print(f"[job {job['id']}] attempt {job['attempts']}/{job['max_attempts']} failed: {e}")
+        queue.fail(job["id"], worker, e)
+        return None
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    shutil.rmtree(queue.work_dir(job), ignore_errors=True)
+    try:
+        os.rmdir(os.path.dirname(queue.work_dir(job)))
+    except OSError:
+        pass  # other jobs are still in progress
+    print(f"[job {job['id']}] done: {final_path}")
+    return final_path
+
+
+async def work(queue, worker, writer_chain, simulator_llm, lease_s=DEFAULT_LEASE_S, poll_s=5.0, exit_when_empty=True,
+               prompt_budget=None):
+    """Claim and run jobs until the queue is empty (or forever, polling, without exit_when_empty)."""
+    completed = 0
+    while True:
+        job = queue.claim(worker, lease_s)
+        if job is None:
+            if exit_when_empty and not queue.pending():
+                return completed
+            await asyncio.sleep(poll_s)
+            continue
+        print(f"[{worker}] job {job['id']}: {job['topic']} (attempt {job['attempts']}/{job['max_attempts']})")
+        if await run_job(queue, job, worker, writer_chain, simulator_llm, lease_s, prompt_budget):
+            completed += 1
+
+
+def worker_process(queue_path, worker, args):
+    """One worker process: its own clients, scheduler share and connection to the queue."""
+    import main
+    if not os.getenv("OPENAI_API_KEY") or not os.getenv("GOOGLE_API_KEY"):
+        # Without keys every leased job would fail inside the client and burn its attempts
+        print(f"[{worker}] Error: API keys not found. Please set OPENAI_API_KEY and GOOGLE_API_KEY in .env file.")
+        sys.exit(1)
+    with open(os.path.join(os.path.dirname(os.path.abspath(main.__file__)), "format.md"), "r", encoding="utf-8") as f:
+        format_content = f.read()
+    cache = main.cache_from_env(enabled=not args.no_cache)
+    scheduler = main.build_scheduler(args)
+    writer_chain, simulator_llm = main.build_chains(format_content, cache, scheduler, args.request_timeout)
+    queue = JobQueue(queue_path)
+    try:
+        completed = asyncio.run(work(queue, worker, writer_chain, simulator_llm, args.lease, args.poll,
+                                     not args.keep_polling, args.prompt_budget))
+        print(f"[{worker}] finished {completed} job(s). {scheduler.summary()}")
+    finally:
+        queue.close()
+        if cache is not None:
+            cache.close()
+
+
+def print_status(queue, as_json=False):
+    s = queue.status()
+    if as_json:
+        print(json.dumps(s, ensure_ascii=False))
+        return
+    eta = f", about {s['eta_s'] / 60:.0f} min left" if s["eta_s"] else ""
+    print(f"queued {s['queued']}, running {s['leased']}, expired leases {s['expired']}, "
+          f"done {s['done']}, failed {s['failed']}")
+    average = f", {s['avg_job_s']:.0f}s per job" if s["avg_job_s"] is not None else ""
+    print(f"throughput (last 10 min): {s['done_per_min']:.2f} jobs/min{average}{eta}")
+    for worker, count in sorted(s["workers"].items()):
+        print(f"  {worker}: {count} job(s)")
+    for job_id, topic, attempts, error in queue.failures():
+        print(f"  failed #{job_id} after {attempts} attempt(s): {topic}: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Durable job queue for API-mode generation.")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="Queue file; shared by every worker and host.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="Queue topics.")
+    add.add_argument("--topic", action="append", default=[])
+    add.add_argument("--topics-file")
+    add.add_argument("--output-dir", help="Where finished articles go (default: the queue file's folder).")
+    add.add_argument("--deadline", type=float, help="Seconds per attempt; an unfinished article continues next attempt.")
+    add.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    worker = sub.add_parser("worker", help="Start worker processes that take jobs until the queue is empty.")
+    worker.add_argument("--processes", "-n", type=int, default=os.cpu_count() or 1)
+    worker.add_argument("--lease", type=float, default=DEFAULT_LEASE_S, help="Seconds a job stays leased without a heartbeat.")
+    worker.add_argument("--poll", type=float, default=5.0, help="Seconds between claims while the queue is busy or empty.")
+    worker.add_argument("--keep-polling", action="store_true", help="Wait for new jobs instead of exiting when the queue is empty.")
+    worker.add_argument("--no-cache", action="store_true")
+    status = sub.add_parser("status", help="Queue depth, running jobs and throughput.")
+    status.add_argument("--json", action="store_true")
+    args, rest = parser.parse_known_args(argv)
+
+    if args.command == "worker":
+        # Provider limits as in main.py; each process gets an equal share of this host's quota
+        import main as main_module
+        if not os.getenv("OPENAI_API_KEY") or not os.getenv("GOOGLE_API_KEY"):
+            print("Error: API keys not found. Please set OPENAI_API_KEY and GOOGLE_API_KEY in .env file.")
+            return 1
+        limits = main_module.build_parser().parse_args(rest)
+        processes = max(1, args.processes)
+        for name in ("writer_rpm", "writer_tpm", "simulator_rpm", "simulator_tpm"):
+            if getattr(limits, name):
+                setattr(limits, name, max(1, getattr(limits, name) // processes))
+        limits.concurrency = 1
+        for name in ("lease", "poll", "keep_polling", "no_cache"):
+            setattr(limits, name, getattr(args, name))
+        host = socket.gethostname()
+        workers = [multiprocessing.get_context("spawn").Process(
+            target=worker_process, args=(args.queue, f"{host}-{os.getpid()}-{index}-{uuid.uuid4().hex[:6]}", limits))
+            for index in range(1, processes + 1)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        queue = JobQueue(args.queue)
+        print_status(queue)
+        queue.close()
+        return 0 if all(process.exitcode == 0 for process in workers) else 1
+
+    if rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    queue = JobQueue(args.queue)
+    try:
+        if args.command == "add":
+            topics = list(args.topic)
+            if args.topics_file:
+                from main import load_topics
+                topics.extend(load_topics(args.topics_file))
+            ids = queue.add(topics, args.output_dir, args.max_attempts, deadline=args.deadline)
+            print(f"Queued {len(ids)} job(s); {len(topics) - len(ids)} already queued.")
+        print_status(queue, getattr(args, "json", False))
+    finally:
+        queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
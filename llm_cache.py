@@ -0,0 +1,195 @@
+"""Persistent, content-addressed cache of LLM responses.
+
+Shared by main.py (API mode) and human_assisted_flow/main.py (browser mode).
+Entries are keyed on model, temperature, system prompt and user input, and
+are evicted least-recently-used first once the cache grows past max_bytes or
+an entry is older than max_age_seconds.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "llm_cache.sqlite3")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+
+class CacheMiss(Exception):
+    """Raised in replay mode when a response is not in the cache."""
+
+
+class CachedMessage:
+    """Minimal stand-in for a chat message returned from the cache."""
+
+    def __init__(self, content):
+        self.content = content
+
+
+def cache_from_env(replay=False, enabled=True):
+    """Build a ResponseCache from ARTICLE_AGENT_CACHE* environment variables."""
+    if not enabled or os.getenv("ARTICLE_AGENT_CACHE_DISABLED") == "1":
+        return None
+    return ResponseCache(
+        path=os.getenv("ARTICLE_AGENT_CACHE") or DEFAULT_CACHE_PATH,
+        replay=replay or os.getenv("ARTICLE_AGENT_CACHE_REPLAY") == "1",
+    )
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age_seconds=DEFAULT_MAX_AGE_SECONDS, replay=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " meta TEXT,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_access)")
+
+    @staticmethod
+    def make_key(model, temperature, system_prompt, user_input):
+        """Hash the request parameters into a stable cache key."""
+        payload = json.dumps([model, temperature, system_prompt or "", user_input],
+                             ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss.
+
+        In replay mode a miss raises CacheMiss instead of returning None.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and now - row[1] > self.max_age_seconds:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.evictions += 1
+                row = None
+
+            if row is None:
+                self.misses += 1
+                if self.replay:
+                    raise CacheMiss(f"No cached response for key {key[:12]} (replay mode)")
+                return None
+
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response, **meta):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, meta, size, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response, json.dumps(meta, ensure_ascii=False), size, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        cursor = self._db.execute(
+            "DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,)
+        )
+        self.evictions += max(cursor.rowcount, 0)
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"cache: {s['hits']} hits / {s['misses']} misses "
+                f"({s['hit_rate']:.0%}), {s['entries']} entries, {s['bytes'] / 1024:.0f} KiB")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedLLM:
+    """Wrap a chain or chat model so identical calls are answered from the cache.
+
+    astream() yields text chunks (a hit yields the whole response at once);
+    ainvoke() returns an object with a .content attribute.
+    """
+
+    def __init__(self, runnable, cache, model, temperature, system_prompt=""):
+        self.runnable = runnable
+        self.cache = cache
+        self.model = model
+        self.temperature = temperature
+        self.system_prompt = system_prompt
+
+    def _key(self, payload):
+        user_input = payload["input"] if isinstance(payload, dict) else payload
+        return self.cache.make_key(self.model, self.temperature, self.system_prompt, user_input)
+
+    async def astream(self, payload):
+        key = self._key(payload)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        async for chunk in self.runnable.astream(payload):
+            chunks.append(chunk)
+            yield chunk
+        # Only complete responses are stored
+        self.cache.put(key, "".join(chunks), model=self.model)
+
+    async def ainvoke(self, payload):
+        key = self._key(payload)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return CachedMessage(cached)
+
+        result = await self.runnable.ainvoke(payload)
+        content = getattr(result, "content", result)
+        self.cache.put(key, content, model=self.model)
+        return result
@@ -1,161 +1,882 @@
+import argparse
+import asyncio
+import json
 import os
 import re
+import sys
+import time
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from checkpoint import CHECKPOINT_VERSION, Checkpoint, write_atomic
+from hedging import HedgedLLM, LatencyTracker
+from llm_cache import CacheMiss, CachedLLM, CachedMessage, cache_from_env
+from prompt_budget import PromptAssembler, count_tokens
+from rate_limit import LLMScheduler, ProviderLimits, ScheduledLLM
+from similar_prompts import DEFAULT_THRESHOLD, PromptIndex, SimilarLLM
+from tag_stream import TagStreamParser
+from tracing import Tracer, text_stats
 
 # Load environment variables
 load_dotenv()
 
-def main():
-    # Check for API keys
-    if not os.getenv("OPENAI_API_KEY") or not os.getenv("GOOGLE_API_KEY"):
-        print("Error: API keys not found. Please set OPENAI_API_KEY and GOOGLE_API_KEY in .env file.")
-        print("You can copy .env.example to .env and fill in your keys.")
-        return
-
-    # Initialize Models
-    # Writer: Gemini 2.5 Pro (using langchain-google-genai)
-    writer_llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-pro",
-        temperature=0.7,
-        max_output_tokens=4096
-    )
-
-    # Simulator: GPT-4o (using langchain-openai)
-    simulator_llm = ChatOpenAI(
-        model="gpt-4o",
-        temperature=0.7,
-        request_timeout=60  # Add 60s timeout
-    )
+DEFAULT_TOPIC = "単純なミス（ケアレスミス）を繰り返す"
+DEFAULT_OUTPUT_FILE = "generated_article.md"
+DEFAULT_OUTPUT_DIR = "articles"
+DEFAULT_CONCURRENCY = 4
+MAX_STEPS = 5
 
-    topic = "単純なミス（ケアレスミス）を繰り返す"
-    print(f"Generating article for topic: {topic}")
+WRITER_MODEL = "gemini-2.5-pro"
+WRITER_TEMPERATURE = 0.7
+SIMULATOR_MODEL = "gpt-4o"
+SIMULATOR_TEMPERATURE = 0.7
+WRITER_MAX_OUTPUT_TOKENS = 4096
 
-    article_content = []
-    
-    # Read format.md
-    try:
-        with open("format.md", "r", encoding="utf-8") as f:
-            format_content = f.read()
-    except FileNotFoundError:
-        print("Error: format.md not found.")
-        return
+# Per-provider quotas shared by every article in a batch (0 disables a limit).
+# Set them just under your account's limits with --writer-rpm etc.
+WRITER_RPM, WRITER_TPM = 150, 2_000_000
+SIMULATOR_RPM, SIMULATOR_TPM = 500, 30_000
+REQUEST_TIMEOUT_S = 120
+# A hedged call is never duplicated sooner than this, however fast recent calls were
+HEDGE_MINIMUM_S = 3.0
+RETRY_ATTEMPTS = 5
+# Max tokens for a Writer input that quotes the previous Simulator answer
+NEXT_STEP_TOKEN_BUDGET = 6000
 
-    # --- Step 1: Initial Writer Call ---
-    print("\n--- Step 1: Writer is creating the introduction and first prompt ---")
-    
-    writer_system_prompt = f"""
+WRITER_SYSTEM_PROMPT = """
     あなたは「ChatGPT活用記事」の執筆者（Writer）です。
     指定されたテーマについて、読者が実践できるステップバイステップの記事を書いてください。
-    
+
     【重要】以下のフォーマット（format.mdの内容）に厳密に従って記事を構成してください。
-    
+
     --- format.md 開始 ---
     {format_content}
     --- format.md 終了 ---
-    
+
     あなたの役割は以下の2つです：
     1. 記事の解説文を書く（導入、理由、解決策の提示など）。
     2. 読者が実際にChatGPTに入力すべき「プロンプト」を作成する。
-    
+
     出力フォーマットは厳密に以下を守ってください：
-    
+
     <article>
     (ここに記事の本文を書く。Markdown形式で見出しや本文を構成する)
     </article>
-    
+
     <prompt>
     (ここにChatGPTに入力させるプロンプトの内容だけを書く)
     </prompt>
-    
+
     もし記事が完結し、これ以上プロンプトが必要ない場合は、<prompt>タグの代わりに <finished> と書いてください。
     """
 
-    writer_prompt_template = ChatPromptTemplate.from_messages([
-        ("system", writer_system_prompt),
-        ("user", "{input}")
-    ])
-    
-    writer_chain = writer_prompt_template | writer_llm | StrOutputParser()
+INITIAL_INPUT = "テーマ：「{topic}」。\nまずは導入部分と、最初のステップ（原因の特定など）の解説、そしてそのためのプロンプトを書いてください。"
 
-    # Initial input
-    current_input = f"テーマ：「{topic}」。\nまずは導入部分と、最初のステップ（原因の特定など）の解説、そしてそのためのプロンプトを書いてください。"
-    
-    step_count = 1
-    max_steps = 5
-    
-    while step_count <= max_steps:
-        print(f"Processing Step {step_count}...")
-        
-        # Call Writer
-        try:
-            writer_response = writer_chain.invoke({"input": current_input})
-        except Exception as e:
-            print(f"Error calling Writer: {e}")
-            break
-        
-        # Parse Writer Output
-        article_part = extract_tag_content(writer_response, "article")
-        prompt_part = extract_tag_content(writer_response, "prompt")
-        is_finished = "<finished>" in writer_response
-        
-        if article_part:
-            article_content.append(article_part)
-            print(f"Writer generated content ({len(article_part)} chars).")
-        
-        if is_finished:
-            print("Writer indicated the article is finished.")
-            break
-            
-        if prompt_part:
-            print(f"Writer generated prompt: {prompt_part[:50]}...")
-            
-            # --- Step 2: Simulator Call ---
-            print("--- Simulator (ChatGPT) is generating a response ---")
-            try:
-                simulator_response = simulator_llm.invoke(prompt_part).content
-                print(f"Simulator responded ({len(simulator_response)} chars).")
-            except Exception as e:
-                print(f"Error calling Simulator: {e}")
-                # Fallback or break? Let's break for now to see the error.
-                break
-            
-            # Prepare input for next Writer iteration
-            current_input = f"""
+NEXT_STEP_INPUT = """
             前回の続きをお願いします。
-            
+
             あなたが作成したプロンプトに対して、ChatGPT（Simulator）は以下の回答をしました：
-            
+
             --- ChatGPTの回答開始 ---
             {simulator_response}
             --- ChatGPTの回答終了 ---
-            
+
             この回答を記事内の「実行結果例」として引用・解説し、
             次のステップ（もしあれば）の解説と、次のプロンプトを書いてください。
             記事をまとめる段階であれば、まとめを書いて <finished> タグを出力してください。
             """
-            
-            # Append the simulator response to the article content (formatted)
-            # We let the Writer decide how to include it, or we can force append it.
-            # In this flow, we pass it to the Writer and ask the Writer to include it in the next <article> block.
-            # However, usually it's better to let the Writer weave it in.
-            
-        else:
-            print("No prompt found and not finished. Stopping loop to prevent error.")
-            break
-            
+
+# Templates are compiled and their placeholders checked once, at import
+PROMPTS = PromptAssembler(
+    {"initial": INITIAL_INPUT, "next_step": NEXT_STEP_INPUT},
+    budgets={"next_step": NEXT_STEP_TOKEN_BUDGET},
+    required={"initial": {"topic"}, "next_step": {"simulator_response"}},
+)
+
+
+def build_scheduler(args):
+    """One LLMScheduler for the whole batch, sized from the command line."""
+    return LLMScheduler({
+        "writer": ProviderLimits(args.writer_rpm, args.writer_tpm, args.concurrency,
+                                 expected_output_tokens=WRITER_MAX_OUTPUT_TOKENS // 2),
+        "simulator": ProviderLimits(args.simulator_rpm, args.simulator_tpm, args.concurrency),
+    }, attempts=args.retries + 1)
+
+
+def build_models(writer_model, simulator_model, writer_system_prompt, request_timeout=REQUEST_TIMEOUT_S,
+                 client_retries=None):
+    """Create the bare Writer chain and Simulator model (no hedging, scheduler or cache)."""
+    # The SDKs take over a second to import, so only runs that call the APIs pay for them
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langchain_openai import ChatOpenAI
+
+    client_retries = client_retries or {}
+    # Initialize Models
+    # Writer: Gemini 2.5 Pro (using langchain-google-genai)
+    writer_llm = ChatGoogleGenerativeAI(
+        model=writer_model,
+        temperature=WRITER_TEMPERATURE,
+        max_output_tokens=WRITER_MAX_OUTPUT_TOKENS,
+        timeout=request_timeout,
+        **client_retries
+    )
+
+    # Simulator: GPT-4o (using langchain-openai)
+    simulator_llm = ChatOpenAI(
+        model=simulator_model,
+        temperature=SIMULATOR_TEMPERATURE,
+        request_timeout=request_timeout,
+        **client_retries
+    )
+
+    writer_prompt_template = ChatPromptTemplate.from_messages([
+        ("system", writer_system_prompt),
+        ("user", "{input}")
+    ])
+
+    writer_chain = writer_prompt_template | writer_llm | StrOutputParser()
+    return writer_chain, simulator_llm
+
+
+def build_clients(writer_model, simulator_model, writer_system_prompt, cache=None, scheduler=None,
+                  request_timeout=REQUEST_TIMEOUT_S, hedge=None):
+    """Create one Writer chain and one Simulator model, wrapped by hedging, the scheduler and the cache."""
+    client_retries = {"max_retries": 0} if scheduler is not None else {}
+    writer_chain, simulator_llm = build_models(writer_model, simulator_model, writer_system_prompt,
+                                               request_timeout, client_retries)
+    if hedge is not None:
+        alternate_writer = alternate_simulator = None
+        if hedge.get("writer") or hedge.get("simulator"):
+            alternate_writer, alternate_simulator = build_models(
+                hedge.get("writer") or writer_model, hedge.get("simulator") or simulator_model,
+                writer_system_prompt, request_timeout, client_retries)
+        # Innermost, so only provider latency is measured and raced: cache hits never
+        # reach the tracker, and calls still waiting for quota are never duplicated.
+        # The duplicate runs inside the primary's scheduler slot but reserves its own
+        # request and tokens (see below).
+        # The Writer is hedged on its time to first chunk, the Simulator on its whole call
+        writer_chain = HedgedLLM(writer_chain, LatencyTracker(minimum_s=HEDGE_MINIMUM_S),
+                                 alternate_writer if hedge.get("writer") else None)
+        simulator_llm = HedgedLLM(simulator_llm, LatencyTracker(minimum_s=HEDGE_MINIMUM_S),
+                                  alternate_simulator if hedge.get("simulator") else None)
+    if scheduler is not None:
+        writer_chain = ScheduledLLM(writer_chain, scheduler, "writer", count_tokens(writer_system_prompt))
+        simulator_llm = ScheduledLLM(simulator_llm, scheduler, "simulator")
+        if hedge is not None:
+            writer_chain.runnable.reserve = writer_chain.reserve
+            simulator_llm.runnable.reserve = simulator_llm.reserve
+    if cache is not None:
+        # Outside the scheduler, so cache hits spend no quota.
+        # The system prompt carries format.md, so editing it invalidates the Writer entries
+        writer_chain = CachedLLM(writer_chain, cache, writer_model, WRITER_TEMPERATURE, writer_system_prompt)
+        simulator_llm = CachedLLM(simulator_llm, cache, simulator_model, SIMULATOR_TEMPERATURE)
+    return writer_chain, simulator_llm
+
+
+def build_chains(format_content, cache=None, scheduler=None, request_timeout=REQUEST_TIMEOUT_S, hedge=None):
+    """Create the Writer chain and the Simulator model.
+
+    With a ResponseCache, identical Writer/Simulator calls are answered from disk.
+    With an LLMScheduler, the remaining calls wait for quota and are retried by
+    it (the clients' own retries are turned off so attempts are not multiplied).
+    With hedge ({"writer": model or None, "simulator": model or None}), a call
+    slower than its role's p95 of provider latency (and than HEDGE_MINIMUM_S)
+    is duplicated, to the named alternate model or to the same one, and the
+    first response wins.
+    In replay mode no clients are created at all, so no API keys are needed.
+    """
+    # format.md is pasted verbatim into the system prompt
+    writer_system_prompt = WRITER_SYSTEM_PROMPT.replace("{format_content}", format_content)
+
+    if cache is not None and cache.replay:
+        return (CachedLLM(None, cache, WRITER_MODEL, WRITER_TEMPERATURE, writer_system_prompt),
+                CachedLLM(None, cache, SIMULATOR_MODEL, SIMULATOR_TEMPERATURE))
+
+    return build_clients(WRITER_MODEL, SIMULATOR_MODEL, writer_system_prompt, cache, scheduler, request_timeout,
+                         hedge)
+
+
+def hedged_llm(llm):
+    """The HedgedLLM inside the cache and scheduler wrappers of a client, or None."""
+    while llm is not None and not isinstance(llm, HedgedLLM):
+        llm = getattr(llm, "runnable", None)
+    return llm
+
+
+async def invoke_simulator(simulator_llm, prompt, span):
+    """Call the Simulator, timed as a "simulator" child of the step span."""
+    with span.child("simulator", **text_stats(prompt, "in")) as simulator_span:
+        response = await simulator_llm.ainvoke(prompt)
+        simulator_span.set(**text_stats(response.content, "out"))
+    return response
+
+
+async def stream_writer(writer_chain, current_input, simulator_llm, on_delta=None, span=None):
+    """Stream one Writer response, starting the Simulator as soon as </prompt> arrives.
+
+    Returns (parser, simulator_task). simulator_task is None when no prompt was produced.
+    The Writer and Simulator calls are traced as children of span.
+    """
+    parser = TagStreamParser()
+    simulator_task = None
+    if span is None:
+        span = Tracer(None).span("step")
+    writer_span = span.child("writer", **text_stats(current_input, "in"))
+    received = []
+
+    def handle(events):
+        nonlocal simulator_task
+        for kind, value in events:
+            if kind == "article_delta" and on_delta:
+                on_delta(value)
+            elif kind == "prompt" and simulator_task is None:
+                # Do not wait for the Writer to finish talking
+                simulator_task = asyncio.create_task(invoke_simulator(simulator_llm, value, span))
+
+    try:
+        with writer_span:
+            async for chunk in writer_chain.astream({"input": current_input}):
+                writer_span.first_token()
+                received.append(chunk)
+                handle(parser.feed(chunk))
+            handle(parser.close())
+            writer_span.set(**text_stats("".join(received), "out"))
+    except BaseException:
+        if simulator_task:
+            simulator_task.cancel()
+        raise
+    return parser, simulator_task
+
+
+async def generate_article(topic, writer_chain, simulator_llm, max_steps=MAX_STEPS, on_delta=None, cut_log=None,
+                           checkpoint=None, span=None, deadline=None, branch=None, on_step=None, prompt_budget=None):
+    """Run the Writer/Simulator loop for one topic and return the article parts.
+
+    on_delta, if given, receives article text while the Writer is still streaming.
+    Lines dropped to keep the Writer input within budget are appended to cut_log.
+    With a Checkpoint, every finished step is saved, and steps already in it
+    (with the same Writer input) are restored instead of calling the models.
+    checkpoint.data["completed"] tells whether the article reached its end.
+    Each step is traced as a "step" child of span.
+    With a deadline (seconds for the whole article), each step may use the
+    time left divided by the steps left; a step that runs past its budget
+    stops the article as unfinished, like a failed call.
+    branch, an (after_step, instruction) pair, adds the instruction to the
+    Writer input of the step after after_step (see generate_variants).
+    on_step, if given, is called with (step, article_part, finished) after each step.
+    prompt_budget overrides the token budget of each Writer input (NEXT_STEP_TOKEN_BUDGET);
+    the budget used is kept in checkpoint.data["prompt_budget"].
+    """
+    label = f"[{topic}]"
+    if prompt_budget is None:
+        prompt_budget = PROMPTS.budgets.get("next_step")
+    if span is None:
+        span = Tracer(None).span("article")
+    article_content = []
+    completed = False
+
+    # Initial input
+    current_input = PROMPTS.assemble("initial", {"topic": topic}).text
+
+    step_count = 1
+    finish_by = time.monotonic() + deadline if deadline else None
+
+    while step_count <= max_steps:
+        with span.child("step", step=step_count) as step_span:
+            print(f"{label} Processing Step {step_count}...")
+            step_budget = None
+            if finish_by is not None:
+                # Time not used by earlier steps carries over to the later ones
+                step_budget = (finish_by - time.monotonic()) / (max_steps - step_count + 1)
+                step_span.set(budget_s=step_budget)
+                if step_budget <= 0:
+                    print(f"{label} Article deadline of {deadline:.0f}s reached.")
+                    step_span.fail("deadline")
+                    break
+            step_ends = time.monotonic() + step_budget if step_budget is not None else None
+            if branch is not None and step_count == branch[0] + 1:
+                # Part of the input, so a resumed variant still matches its own checkpoint
+                current_input = f"{current_input}\n\n{branch[1]}"
+            if on_delta and article_content:
+                on_delta("\n\n")
+
+            saved = None
+            if checkpoint is not None and step_count <= len(checkpoint.phases):
+                saved = checkpoint.phases[step_count - 1]
+                if saved["input"] != current_input:
+                    # An earlier step changed (e.g. a new prompt budget), so the rest is stale
+                    print(f"{label} Checkpoint does not match from step {step_count}; running it again.")
+                    checkpoint.truncate(step_count - 1)
+                    saved = None
+
+            if saved is not None:
+                print(f"{label} Restored step {step_count} from checkpoint.")
+                step_span.set(restored=True)
+                article_part, prompt_part, is_finished = saved["article"], saved["prompt"], saved["finished"]
+                simulator_task = None
+                if on_delta and article_part:
+                    on_delta(article_part)
+            else:
+                # Call Writer
+                try:
+                    parser, simulator_task = await asyncio.wait_for(
+                        stream_writer(writer_chain, current_input, simulator_llm, on_delta, step_span), step_budget)
+                except CacheMiss:
+                    raise
+                except asyncio.TimeoutError:
+                    print(f"{label} Writer ran past the {step_budget:.0f}s budget of step {step_count}.")
+                    step_span.fail("deadline")
+                    break
+                except Exception as e:
+                    print(f"{label} Error calling Writer: {e}")
+                    step_span.fail(e)
+                    break
+
+                # Parse Writer Output
+                article_part = parser.article
+                prompt_part = parser.prompt
+                is_finished = parser.finished
+                # A response with neither a prompt nor <finished> is not kept, so a resume asks again
+                if checkpoint is not None and (prompt_part or is_finished):
+                    with step_span.timed("io_s"):
+                        saved = checkpoint.record(input=current_input, article=article_part, prompt=prompt_part,
+                                                  finished=is_finished)
+
+            if article_part:
+                article_content.append(article_part)
+                print(f"{label} Writer generated content ({len(article_part)} chars).")
+            if on_step:
+                on_step(step_count, article_part, is_finished)
+
+            if is_finished:
+                if simulator_task:
+                    simulator_task.cancel()
+                print(f"{label} Writer indicated the article is finished.")
+                completed = True
+                break
+
+            if prompt_part:
+                print(f"{label} Writer generated prompt: {prompt_part[:50]}...")
+
+                if saved is not None and saved.get("simulator_response") is not None:
+                    simulator_response = saved["simulator_response"]
+                else:
+                    # --- Simulator Call (already started while the Writer was streaming) ---
+                    print(f"{label} Simulator (ChatGPT) is generating a response")
+                    try:
+                        if simulator_task is None:
+                            simulator_task = asyncio.create_task(
+                                invoke_simulator(simulator_llm, prompt_part, step_span))
+                        # Only the part of the Simulator call that did not overlap the Writer
+                        with step_span.timed("simulator_wait_s"):
+                            remaining = step_ends - time.monotonic() if step_ends is not None else None
+                            simulator_response = (await asyncio.wait_for(simulator_task, remaining)).content
+                        print(f"{label} Simulator responded ({len(simulator_response)} chars).")
+                    except CacheMiss:
+                        raise
+                    except asyncio.TimeoutError:
+                        print(f"{label} Simulator ran past the {step_budget:.0f}s budget of step {step_count}.")
+                        step_span.fail("deadline")
+                        break
+                    except Exception as e:
+                        print(f"{label} Error calling Simulator: {e}")
+                        step_span.fail(e)
+                        break
+                    if saved is not None:
+                        saved["simulator_response"] = simulator_response
+                        with step_span.timed("io_s"):
+                            checkpoint.save()
+
+                # Prepare input for next Writer iteration.
+                # The Writer weaves the simulator response into its next <article> block.
+                next_input = PROMPTS.assemble("next_step", {"simulator_response": simulator_response},
+                                              condensable=("simulator_response",), log_path=cut_log,
+                                              budget=prompt_budget)
+                if next_input.cuts:
+                    removed = sum(len(lines) for lines in next_input.cuts.values())
+                    print(f"{label} Condensed Simulator answer to fit {next_input.budget} tokens ({removed} lines cut).")
+                    step_span.set(condensed_lines=removed)
+                current_input = next_input.text
+
+            else:
+                print(f"{label} No prompt found and not finished. Stopping loop to prevent error.")
+                break
+
         step_count += 1
+    else:
+        completed = True
+
+    span.set(steps=min(step_count, max_steps), completed=completed)
+    if checkpoint is not None:
+        checkpoint.data["completed"] = completed
+        checkpoint.data["prompt_budget"] = prompt_budget
+        checkpoint.save()
+    return article_content
+
+
+PREFIX_FILE = "prefix.md"
+VARIANT_TREE = "variants.json"
+
+
+def checkpoint_path(filename):
+    return filename + ".checkpoint.json"
+
+
+def trace_path(filename):
+    return filename + ".trace.jsonl"
+
+
+def model_path(filename):
+    return filename + ".steps.json"
+
+
+def save_article_model(filename, topic, phases, prompt_budget=None):
+    """Keep a finished article's steps next to it, for regenerate --step.
+
+    Each step records its Writer input, article text, prompt and the Simulator's
+    answer. The Writer and Simulator calls carry no history, so a step depends
+    only on the Simulator answer of the step before it (depends_on).
+    prompt_budget is the Writer input budget the steps were built with.
+    """
+    steps = [{"step": number, "depends_on": number - 1 if number > 1 else None, "input": phase["input"],
+              "article": phase["article"], "prompt": phase["prompt"], "finished": phase["finished"],
+              "simulator_response": phase.get("simulator_response")}
+             for number, phase in enumerate(phases, 1)]
+    model = Checkpoint(model_path(filename), {"version": CHECKPOINT_VERSION, "topic": topic,
+                                              "prompt_budget": prompt_budget, "phases": steps})
+    model.save()
+    return model
+
+
+def assemble_article(steps):
+    return "\n\n".join(step["article"] for step in steps if step["article"])
+
+
+async def generate_and_save(topic, filename, writer_chain, simulator_llm, semaphore, echo=False, resume=False,
+                            deadline=None, branch=None, events=None, prompt_budget=None):
+    """Generate one article under the concurrency limit and write it to filename.
+
+    While generating, article text is streamed to filename + ".partial"
+    (and to the terminal when echo is set). Progress is checkpointed next to
+    filename; with resume, finished articles are skipped and unfinished ones
+    continue from their checkpoint. Timings are appended to filename + ".trace.jsonl".
+    The deadline (seconds) starts once the article gets its concurrency slot.
+    events, if given, is called with ("delta", {"text"}) while text streams and
+    ("step", {"step", "chars", "finished"}) after each step.
+    """
+    partial_path = filename + ".partial"
+    if resume and os.path.exists(filename) and not os.path.exists(checkpoint_path(filename)):
+        print(f"[{topic}] Already generated: {filename}")
+        return filename
+
+    tracer = Tracer(trace_path(filename), topic=topic)
+    with tracer.span("article") as article_span:
+        queued = time.perf_counter()
+        async with semaphore:
+            article_span.set(queue_wait_s=time.perf_counter() - queued)
+            print(f"Generating article for topic: {topic}")
+            checkpoint = Checkpoint.open(checkpoint_path(filename), resume)
+            with open(partial_path, "w", encoding="utf-8") as partial:
+                def on_delta(text):
+                    with article_span.timed("io_s"):
+                        partial.write(text)
+                        partial.flush()
+                    if echo:
+                        print(text, end="", flush=True)
+                    if events:
+                        events("delta", {"text": text})
+
+                def on_step(step, article_part, finished):
+                    if events:
+                        events("step", {"step": step, "chars": len(article_part or ""), "finished": finished})
+
+                article_content = await generate_article(topic, writer_chain, simulator_llm, on_delta=on_delta,
+                                                         cut_log=filename + ".cuts.jsonl", checkpoint=checkpoint,
+                                                         span=article_span, deadline=deadline, branch=branch,
+                                                         on_step=on_step, prompt_budget=prompt_budget)
+            if echo:
+                print()
+
+        # Save Final Article
+        final_markdown = "\n\n".join(article_content)
+        with article_span.timed("io_s"):
+            with open(filename, "w", encoding="utf-8") as f:
+                f.write(final_markdown)
+            os.remove(partial_path)
+            # An unfinished article keeps its checkpoint so --resume can continue it
+            if checkpoint.data.get("completed"):
+                save_article_model(filename, topic, checkpoint.phases, checkpoint.data.get("prompt_budget"))
+                checkpoint.remove()
+        article_span.set(**text_stats(final_markdown, "out"))
+
+    print(f"Successfully generated article: {filename}")
+    return filename
+
+
+class KnownAnswer:
+    """Simulator that answers the prompt a step had before from the article model, and calls through otherwise."""
+
+    def __init__(self, simulator_llm, prompt, response):
+        self.simulator_llm = simulator_llm
+        self.prompt = prompt
+        self.response = response
+
+    async def ainvoke(self, prompt):
+        if self.response is not None and prompt == self.prompt:
+            return CachedMessage(self.response)
+        return await self.simulator_llm.ainvoke(prompt)
+
+
+async def regenerate_step(filename, step, writer_chain, simulator_llm, instruction=None, max_steps=MAX_STEPS,
+                          prompt_budget=None):
+    """Run one step of a finished article again, then only the steps that depend on it.
+
+    The step's Writer input is sent again (with instruction appended, if given).
+    When its new prompt is the same as before, the old Simulator answer still
+    holds and no later step changes. Otherwise the Simulator answers the new
+    prompt and the next step is run again with it, and so on. The article and
+    its model are rewritten only once every rerun step has succeeded.
+    Later Writer inputs are condensed to prompt_budget, by default the budget
+    the article was generated with, so unchanged answers give the same inputs.
+    Returns the numbers of the steps that were run again.
+    """
+    model = Checkpoint.load(model_path(filename))
+    steps = model.phases
+    if not 1 <= step <= len(steps):
+        raise ValueError(f"{filename} has steps 1-{len(steps)}, not {step}")
+    if prompt_budget is None:
+        prompt_budget = model.data.get("prompt_budget") or PROMPTS.budgets.get("next_step")
+    label = f"[{model.data['topic']}]"
+    tracer = Tracer(trace_path(filename), topic=model.data["topic"])
+    current_input = steps[step - 1]["input"] + (f"\n\n{instruction}" if instruction else "")
+    rerun = []
+    with tracer.span("regenerate", step=step) as span:
+        for index in range(step - 1, max_steps):
+            old = steps[index] if index < len(steps) else None
+            with span.child("step", step=index + 1) as step_span:
+                print(f"{label} Regenerating step {index + 1}...")
+                known = KnownAnswer(simulator_llm, old and old["prompt"], old and old.get("simulator_response"))
+                simulator_task = None
+                try:
+                    parser, simulator_task = await stream_writer(writer_chain, current_input, known, span=step_span)
+                    rerun.append(index + 1)
+                    new = {"step": index + 1, "depends_on": index or None, "input": current_input,
+                           "article": parser.article, "prompt": parser.prompt, "finished": parser.finished,
+                           "simulator_response": None}
+                    if parser.finished:
+                        steps[index:] = [new]
+                        break
+                    if not parser.prompt:
+                        raise RuntimeError(f"step {index + 1} produced neither a prompt nor <finished>; nothing was changed")
+                    if simulator_task is None:
+                        simulator_task = asyncio.create_task(invoke_simulator(known, parser.prompt, step_span))
+                    new["simulator_response"] = (await simulator_task).content
+                finally:
+                    # A Simulator call that is no longer needed (finished, or the step failed) is stopped and awaited
+                    if simulator_task is not None and not simulator_task.done():
+                        simulator_task.cancel()
+                        await asyncio.gather(simulator_task, return_exceptions=True)
+                steps[index:index + 1] = [new]
+                if old is not None and not old["finished"] and new["simulator_response"] == old.get("simulator_response"):
+                    # Later steps see only this answer, and it did not change
+                    print(f"{label} Step {index + 1} kept its prompt; later steps are unchanged.")
+                    break
+                current_input = PROMPTS.assemble("next_step", {"simulator_response": new["simulator_response"]},
+                                                 condensable=("simulator_response",),
+                                                 log_path=filename + ".cuts.jsonl", budget=prompt_budget).text
+        span.set(rerun=rerun)
+
+    # The finished article is replaced only as a whole: a crash leaves the old one
+    write_atomic(filename, assemble_article(steps))
+    model.data["prompt_budget"] = prompt_budget
+    model.save()
+    print(f"{label} Regenerated step(s) {', '.join(map(str, rerun))} of {filename}")
+    return rerun
+
+
+def regenerate_main(argv):
+    """python main.py regenerate ARTICLE --step N [--instruction TEXT]"""
+    parser = argparse.ArgumentParser(prog="main.py regenerate",
+                                     description="Run one step of a finished article again, and only the steps that depend on it.")
+    parser.add_argument("article", help="Article file generated in API mode (with its .steps.json next to it).")
+    parser.add_argument("--step", type=int, required=True, help="Step to run again (1 is the first Writer call).")
+    parser.add_argument("--instruction", help="Extra instruction for the Writer on that step, e.g. what to fix.")
+    parser.add_argument("--prompt-budget", type=int, help="Max tokens for each Writer input (default: the budget the article was generated with).")
+    add_limit_arguments(parser)
+    # Steps are rerun one after another
+    parser.set_defaults(concurrency=1)
+    args = parser.parse_args(argv)
+    if not os.path.exists(model_path(args.article)):
+        print(f"Error: {model_path(args.article)} not found (articles finished before steps were kept cannot be regenerated).")
+        return 1
+    if not os.getenv("OPENAI_API_KEY") or not os.getenv("GOOGLE_API_KEY"):
+        print("Error: API keys not found. Please set OPENAI_API_KEY and GOOGLE_API_KEY in .env file.")
+        return 1
+    with open("format.md", "r", encoding="utf-8") as f:
+        format_content = f.read()
+    # No response cache: the same Writer input must get a new answer.
+    # The scheduler gives the calls the same quotas and retries as a normal run
+    scheduler = build_scheduler(args)
+    writer_chain, simulator_llm = build_chains(format_content, None, scheduler, args.request_timeout)
+    try:
+        asyncio.run(regenerate_step(args.article, args.step, writer_chain, simulator_llm, args.instruction,
+                                    prompt_budget=args.prompt_budget))
+    except (ValueError, RuntimeError) as e:
+        print(f"Error: {e}")
+        return 1
+    except Exception as e:
+        # A provider error that outlasted the retries (429, timeout, auth); the article was not changed
+        print(f"Error: {type(e).__name__}: {e}")
+        return 1
+    finally:
+        print(scheduler.summary())
+    return 0
 
-    # Save Final Article
-    final_markdown = "\n\n".join(article_content)
-    filename = "generated_article.md"
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(final_markdown)
-        
-    print(f"\nSuccessfully generated article: {filename}")
+
+async def generate_variants(topic, folder, instructions, writer_chain, simulator_llm, semaphore, branch_after=1,
+                            resume=False, deadline=None, prompt_budget=None):
+    """Generate one article per instruction, all sharing their first branch_after steps.
+
+    The shared steps run once and stay in folder/prefix.md.checkpoint.json.
+    Each variant starts from a copy of them, so only its own steps call the
+    models, and the variants run concurrently under the same semaphore.
+    folder/variants.json records the tree: the prefix and, under it, every
+    variant with its instruction, file and whether it finished.
+    """
+    label = f"[{topic}]"
+    os.makedirs(folder, exist_ok=True)
+    prefix_file = os.path.join(folder, PREFIX_FILE)
+    prefix = Checkpoint.open(checkpoint_path(prefix_file), resume)
+    tracer = Tracer(trace_path(prefix_file), topic=topic)
+    with tracer.span("article", variant="prefix") as prefix_span:
+        async with semaphore:
+            print(f"{label} Generating the {branch_after} shared step(s)")
+            parts = await generate_article(topic, writer_chain, simulator_llm, max_steps=branch_after,
+                                           cut_log=prefix_file + ".cuts.jsonl", checkpoint=prefix, span=prefix_span,
+                                           deadline=deadline, prompt_budget=prompt_budget)
+    with open(prefix_file, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(parts))
+
+    shared = prefix.phases[:branch_after]
+    if any(phase["finished"] for phase in shared):
+        print(f"{label} The Writer finished within the shared steps; there is nothing to branch from.")
+        return [prefix_file]
+    if len(shared) < branch_after or shared[-1].get("simulator_response") is None:
+        raise RuntimeError("the shared steps did not complete; run again with --resume to continue them")
+
+    jobs = []
+    for index, instruction in enumerate(instructions, start=1):
+        filename = article_filename(instruction, index, folder)
+        if not (resume and (os.path.exists(filename) or os.path.exists(checkpoint_path(filename)))):
+            seeded = Checkpoint(checkpoint_path(filename))
+            seeded.phases.extend(dict(phase) for phase in shared)
+            seeded.save()
+        jobs.append((instruction, filename))
+
+    results = await asyncio.gather(*[
+        generate_and_save(topic, filename, writer_chain, simulator_llm, semaphore, resume=True, deadline=deadline,
+                          branch=(branch_after, instruction), prompt_budget=prompt_budget)
+        for instruction, filename in jobs
+    ], return_exceptions=True)
+
+    tree = {
+        "topic": topic,
+        "branch_after": branch_after,
+        "prefix": {"file": PREFIX_FILE, "steps": branch_after},
+        "variants": [
+            {"instruction": instruction, "file": os.path.basename(filename),
+             "completed": not isinstance(result, Exception) and not os.path.exists(checkpoint_path(filename)),
+             **({"error": str(result)} if isinstance(result, Exception) else {})}
+            for (instruction, filename), result in zip(jobs, results)
+        ],
+    }
+    with open(os.path.join(folder, VARIANT_TREE), "w", encoding="utf-8") as f:
+        json.dump(tree, f, ensure_ascii=False, indent=1)
+
+    failed = [(instruction, result) for (instruction, _), result in zip(jobs, results) if isinstance(result, Exception)]
+    for instruction, error in failed:
+        print(f"{label} Variant failed ({instruction}): {error}")
+    if failed:
+        raise RuntimeError(f"{len(failed)}/{len(jobs)} variants failed")
+    return [filename for _, filename in jobs]
+
+
+async def run_batch(jobs, writer_chain, simulator_llm, concurrency=DEFAULT_CONCURRENCY, resume=False, deadline=None,
+                    variants=None, branch_after=1, prompt_budget=None):
+    """Generate every (topic, filename) job, at most `concurrency` at a time, each within `deadline` seconds.
+
+    With variants (a list of instructions), each job becomes a folder named
+    after its filename holding one article per variant (see generate_variants).
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # Echo streamed text only when it cannot interleave with other articles
+    echo = (len(jobs) == 1 or concurrency <= 1) and not variants
+    if variants:
+        tasks = [
+            generate_variants(topic, os.path.splitext(filename)[0], variants, writer_chain, simulator_llm, semaphore,
+                              branch_after, resume, deadline, prompt_budget)
+            for topic, filename in jobs
+        ]
+    else:
+        tasks = [
+            generate_and_save(topic, filename, writer_chain, simulator_llm, semaphore, echo, resume, deadline,
+                              prompt_budget=prompt_budget)
+            for topic, filename in jobs
+        ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    failed = 0
+    for (topic, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"[{topic}] Failed: {result}")
+    print(f"\nFinished {len(jobs) - failed}/{len(jobs)} articles.")
+    return results
+
+
+def load_topics(path):
+    """Read one topic per line, skipping blank lines and # comments."""
+    topics = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                topics.append(line)
+    return topics
+
+
+def article_filename(topic, index, output_dir):
+    """Build a per-topic output path such as articles/001_<topic>.md."""
+    slug = re.sub(r'[\\/:*?"<>|\s]+', "_", topic).strip("_")[:40] or "article"
+    return os.path.join(output_dir, f"{index:03d}_{slug}.md")
+
+
+def plan_jobs(args):
+    """Turn the command line into a list of (topic, filename) jobs."""
+    topics = list(args.topic or [])
+    if args.topics_file:
+        topics.extend(load_topics(args.topics_file))
+
+    # No topics given: keep the single-article behaviour
+    if not topics:
+        return [(DEFAULT_TOPIC, DEFAULT_OUTPUT_FILE)]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    return [
+        (topic, article_filename(topic, index, args.output_dir))
+        for index, topic in enumerate(topics, start=1)
+    ]
+
+
+def add_limit_arguments(parser):
+    """Provider quota and retry options, read by build_scheduler."""
+    limits = parser.add_argument_group("provider limits", "Shared by all articles; 0 disables a limit.")
+    limits.add_argument("--writer-rpm", type=int, default=WRITER_RPM, help="Writer (Gemini) requests per minute.")
+    limits.add_argument("--writer-tpm", type=int, default=WRITER_TPM, help="Writer (Gemini) tokens per minute.")
+    limits.add_argument("--simulator-rpm", type=int, default=SIMULATOR_RPM, help="Simulator (OpenAI) requests per minute.")
+    limits.add_argument("--simulator-tpm", type=int, default=SIMULATOR_TPM, help="Simulator (OpenAI) tokens per minute.")
+    limits.add_argument("--retries", type=int, default=RETRY_ATTEMPTS - 1, help="Retries per call after a 429, 5xx or timeout.")
+    limits.add_argument("--request-timeout", type=float, default=REQUEST_TIMEOUT_S, help="Seconds before one API call times out.")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Generate ChatGPT guide articles with a Writer (Gemini) and a Simulator (ChatGPT).")
+    parser.add_argument("--topic", action="append", help="Article topic. Can be given several times.")
+    parser.add_argument("--topics-file", help="File with one topic per line.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Maximum number of articles generated at once.")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Directory for per-topic articles.")
+    parser.add_argument("--prompt-budget", type=int, default=NEXT_STEP_TOKEN_BUDGET, help="Max tokens for each Writer input; longer Simulator answers are condensed.")
+    parser.add_argument("--resume", action="store_true", help="Skip finished articles and continue unfinished ones from their checkpoints.")
+    add_limit_arguments(parser)
+    branching = parser.add_argument_group("variants")
+    branching.add_argument("--variants", metavar="FILE", help="One instruction per line; each topic becomes a folder with one article per variant.")
+    branching.add_argument("--branch-after", type=int, default=1, help="Steps shared by every variant before they branch.")
+    latency = parser.add_argument_group("tail latency")
+    latency.add_argument("--deadline", type=float, help="Seconds per article, split across its steps; unfinished articles can be resumed.")
+    latency.add_argument("--hedge", action="store_true", help="Duplicate a call once it is slower than the observed p95; the first response wins.")
+    latency.add_argument("--hedge-writer-model", help="Send hedged Writer calls to this model instead (implies --hedge).")
+    latency.add_argument("--hedge-simulator-model", help="Send hedged Simulator calls to this model instead (implies --hedge).")
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument("--no-cache", action="store_true", help="Always call the models, bypassing the response cache.")
+    cache_mode.add_argument("--replay", action="store_true", help="Answer only from the response cache and fail on a miss.")
+    parser.add_argument("--reuse-similar", type=float, nargs="?", const=DEFAULT_THRESHOLD, metavar="THRESHOLD",
+                        help=f"Reuse the Simulator answer to an earlier prompt at least this similar (default {DEFAULT_THRESHOLD}).")
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["report"]:
+        # python main.py report [paths...]: p50/p95 per phase from the trace files
+        from tracing import main as report_main
+        return report_main(argv)
+    if argv[:1] == ["regenerate"]:
+        # python main.py regenerate ARTICLE --step N: rerun one step and the steps that depend on it
+        return regenerate_main(argv[1:])
+    if argv[:1] == ["export"]:
+        # python main.py export [paths...]: HTML/PDF next to each article, re-rendering changed sections only
+        from export import main as export_main
+        return export_main(argv[1:])
+    args = build_parser().parse_args(argv)
+
+    # Check for API keys (replay mode never calls the APIs)
+    if not args.replay and (not os.getenv("OPENAI_API_KEY") or not os.getenv("GOOGLE_API_KEY")):
+        print("Error: API keys not found. Please set OPENAI_API_KEY and GOOGLE_API_KEY in .env file.")
+        print("You can copy .env.example to .env and fill in your keys.")
+        return
+
+    # Read format.md
+    try:
+        with open("format.md", "r", encoding="utf-8") as f:
+            format_content = f.read()
+    except FileNotFoundError:
+        print("Error: format.md not found.")
+        return
+
+    try:
+        jobs = plan_jobs(args)
+    except FileNotFoundError:
+        print(f"Error: topics file not found: {args.topics_file}")
+        return
+
+    variants = None
+    if args.variants:
+        try:
+            variants = load_topics(args.variants)
+        except FileNotFoundError:
+            print(f"Error: variants file not found: {args.variants}")
+            return
+        if not variants or not 1 <= args.branch_after < MAX_STEPS:
+            print(f"Error: --variants needs at least one instruction and 1 <= --branch-after < {MAX_STEPS}.")
+            return
+
+    cache = cache_from_env(replay=args.replay, enabled=not args.no_cache)
+    scheduler = build_scheduler(args)
+    hedge = None
+    if args.hedge or args.hedge_writer_model or args.hedge_simulator_model:
+        hedge = {"writer": args.hedge_writer_model, "simulator": args.hedge_simulator_model}
+    writer_chain, simulator_llm = build_chains(format_content, cache, scheduler, args.request_timeout, hedge)
+    hedged = (hedged_llm(writer_chain), hedged_llm(simulator_llm))
+    similar = None
+    if cache is not None and not cache.replay:
+        # Every Simulator answer is indexed; near-duplicate prompts reuse one only with --reuse-similar
+        similar = PromptIndex(os.getenv("ARTICLE_AGENT_SIMILAR") or os.path.join(os.path.dirname(cache.path), "similar_prompts.sqlite3"))
+        simulator_llm = SimilarLLM(simulator_llm, similar, SIMULATOR_MODEL, args.reuse_similar)
+    print(f"Generating {len(jobs)} article(s) with concurrency {args.concurrency}")
+    try:
+        asyncio.run(run_batch(jobs, writer_chain, simulator_llm, args.concurrency, args.resume, args.deadline,
+                              variants, args.branch_after, args.prompt_budget))
+    finally:
+        print(scheduler.summary())
+        if hedge is not None:
+            print("hedging: " + "; ".join(llm.summary(name) for name, llm in
+                                         zip(("writer", "simulator"), hedged)))
+        if similar is not None:
+            print(similar.summary())
+            similar.close()
+        if cache is not None:
+            print(cache.summary())
+            cache.close()
 
 def extract_tag_content(text, tag_name):
     """Extracts content between <tag> and </tag>."""
@@ -166,4 +887,4 @@ def extract_tag_content(text, tag_name):
     return None
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""Compiled prompt templates with token budgets.
+
+Templates use {name} placeholders (ASCII names only, so Japanese text such as
+{プレースホルダー} in the prompts stays literal). Each template is parsed once;
+rendering is a single pass, so a value that itself contains "{previous_response}"
+is never substituted twice.
+
+When a rendered prompt exceeds its budget, the condensable values (the previous
+ChatGPT answer) are shortened with a local extractive pass and every removed
+line is recorded.
+"""
+import json
+import re
+from collections import Counter
+
+PLACEHOLDER_RE = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+STRUCTURE_RE = re.compile(r"^\s*(#{1,6}\s|[-*・>]\s?|\d+[.)．、]\s?|【)")
+OMISSION_MARKER = "（…中略…）"
+
+_encoder = None
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken when it is installed, otherwise estimate.
+
+    tiktoken's o200k_base encoding is used for both models; it is exact for
+    GPT-4o and a close estimate for Gemini. Without tiktoken, one token per
+    character is assumed, which over-counts English but is about right for
+    Japanese.
+    """
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text, disallowed_special=()))
+    return len(text)
+
+
+class PromptTemplate:
+    """A template compiled once into literal and placeholder segments."""
+
+    def __init__(self, text, name=""):
+        self.name = name
+        self.text = text
+        self.segments = []
+        pos = 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            self.segments.append((False, text[pos:match.start()]))
+            self.segments.append((True, match.group(1)))
+            pos = match.end()
+        self.segments.append((False, text[pos:]))
+        self.placeholders = {value for is_field, value in self.segments if is_field}
+
+    def render(self, values):
+        missing = self.placeholders - set(values)
+        if missing:
+            raise KeyError(f"Template '{self.name}' is missing values for: {', '.join(sorted(missing))}")
+        return "".join(str(values[value]) if is_field else value for is_field, value in self.segments)
+
+
+def validate_templates(templates, required):
+    """Check that every template uses exactly the placeholders it is given.
+
+    templates maps name -> text, required maps name -> set of placeholder names.
+    Returns the compiled templates; raises ValueError listing every problem.
+    """
+    compiled = {}
+    problems = []
+    for name, expected in required.items():
+        if name not in templates:
+            problems.append(f"{name}: template not found")
+            continue
+        template = PromptTemplate(templates[name], name)
+        missing = set(expected) - template.placeholders
+        unknown = template.placeholders - set(expected)
+        if missing:
+            problems.append(f"{name}: missing placeholder(s) {', '.join('{' + p + '}' for p in sorted(missing))}")
+        if unknown:
+            problems.append(f"{name}: unknown placeholder(s) {', '.join('{' + p + '}' for p in sorted(unknown))}")
+        compiled[name] = template
+    if problems:
+        raise ValueError("Invalid prompt templates:\n  " + "\n  ".join(problems))
+    return compiled
+
+
+def _line_scores(lines):
+    """Score lines for the extractive pass: structure, position and salience."""
+    bigrams = Counter()
+    for line in lines:
+        text = line.strip()
+        bigrams.update(set(text[i:i + 2] for i in range(len(text) - 1)))
+
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    first, last = (content[0], content[-1]) if content else (-1, -1)
+    scores = []
+    for i, line in enumerate(lines):
+        text = line.strip()
+        if not text:
+            scores.append(None)
+            continue
+        grams = [text[j:j + 2] for j in range(len(text) - 1)] or [text]
+        # Lines sharing vocabulary with the rest of the answer carry its topic
+        score = sum(bigrams[g] for g in grams) / len(grams) / max(len(content), 1)
+        if STRUCTURE_RE.match(line):
+            score += 1.0
+        if i == first:
+            score += 2.0
+        elif i == last:
+            score += 0.5
+        scores.append(score)
+    return scores
+
+
+def condense(text, max_tokens):
+    """Shorten text to max_tokens by keeping its most informative lines.
+
+    Returns (condensed_text, cuts) where cuts lists every removed line as
+    {"line": line_number, "text": original_line}. Kept lines stay in order and
+    each gap is marked with OMISSION_MARKER.
+    """
+    if max_tokens <= 0:
+        lines = text.splitlines()
+        return "", [{"line": i + 1, "text": line} for i, line in enumerate(lines) if line.strip()]
+    if count_tokens(text) <= max_tokens:
+        return text, []
+
+    lines = text.splitlines()
+    scores = _line_scores(lines)
+    costs = [count_tokens(line) + 1 for line in lines]
+    marker_cost = count_tokens(OMISSION_MARKER) + 1
+
+    order = sorted((i for i, s in enumerate(scores) if s is not None), key=lambda i: -scores[i])
+    kept = set()
+    used = 0
+    for i in order:
+        # Reserve room for one omission marker per kept line in the worst case
+        if used + costs[i] + marker_cost <= max_tokens:
+            kept.add(i)
+            used += costs[i] + marker_cost
+
+    def assemble(kept_lines):
+        out = []
+        gap = False
+        for i, line in enumerate(lines):
+            if i in kept_lines:
+                if gap:
+                    out.append(OMISSION_MARKER)
+                    gap = False
+                out.append(line)
+            elif line.strip():
+                gap = True
+        if gap:
+            out.append(OMISSION_MARKER)
+        return "\n".join(out)
+
+    result = assemble(kept)
+    if not kept:
+        # Not even one line fits: keep the head of the first line
+        head = lines[order[0]] if order else text
+        while head and count_tokens(head + OMISSION_MARKER) > max_tokens:
+            head = head[:len(head) * 3 // 4]
+        result = head + OMISSION_MARKER if head else ""
+
+    cuts = [{"line": i + 1, "text": line} for i, line in enumerate(lines) if line.strip() and i not in kept]
+    return result, cuts
+
+
+class AssembledPrompt:
+    def __init__(self, name, text, tokens, budget, cuts):
+        self.name = name
+        self.text = text
+        self.tokens = tokens
+        self.budget = budget
+        self.cuts = cuts
+
+    def __str__(self):
+        return self.text
+
+
+class PromptAssembler:
+    """Render named templates under per-template token budgets.
+
+    budgets maps template name -> max prompt tokens; templates without a
+    budget are rendered as-is.
+    """
+
+    def __init__(self, templates, budgets=None, required=None):
+        if required is not None:
+            self.templates = validate_templates(templates, required)
+        else:
+            self.templates = {name: PromptTemplate(text, name) for name, text in templates.items()}
+        self.budgets = dict(budgets or {})
+
+    def assemble(self, name, values, condensable=("previous_response",), log_path=None, budget=None):
+        template = self.templates[name]
+        text = template.render(values)
+        tokens = count_tokens(text)
+        if budget is None:
+            budget = self.budgets.get(name)
+        cuts = {}
+
+        if budget and tokens > budget:
+            shrinkable = [key for key in condensable if key in values and values[key]]
+            if shrinkable:
+                # Tokens used by everything except the condensable values
+                fixed = count_tokens(template.render({**values, **{key: "" for key in shrinkable}}))
+                share = max(budget - fixed, 0) // len(shrinkable)
+                values = dict(values)
+                for key in shrinkable:
+                    values[key], removed = condense(str(values[key]), share)
+                    if removed:
+                        cuts[key] = removed
+                text = template.render(values)
+                tokens = count_tokens(text)
+
+        result = AssembledPrompt(name, text, tokens, budget, cuts)
+        if cuts and log_path:
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"template": name, "tokens": tokens, "budget": budget, "cuts": cuts},
+                                   ensure_ascii=False) + "\n")
+        return result
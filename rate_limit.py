@@ -0,0 +1,349 @@
+"""Shared scheduling for every LLM API call: quotas, retries and concurrency.
+
+Each provider (the Writer's Gemini, the Simulator's OpenAI) gets:
+
+- two token buckets, one for requests per minute and one for tokens per
+  minute. A call reserves one request plus its estimated tokens before it
+  starts, and the token estimate is corrected once the response is known;
+- an adaptive concurrency limit. It is halved when the provider throttles us
+  or when the recent error rate is high, and it grows by one after a full
+  window of successes, up to the configured maximum;
+- retries with exponential backoff and full jitter. A Retry-After from the
+  provider pauses every call to that provider, not just the one that got it.
+
+ScheduledLLM wraps a chain or chat model the same way CachedLLM does, so
+cache hits (the outer wrapper) never spend quota.
+"""
+import asyncio
+import collections
+import email.utils
+import random
+import time
+
+from prompt_budget import count_tokens
+
+# Statuses worth another try; anything else (400, 401, 404, ...) fails at once
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Refill `per_minute` units a minute, holding at most `burst` (default: one minute's worth).
+
+    reserve() debits the bucket immediately and returns how long the caller
+    must wait before its reservation is covered, so waiting callers are served
+    in the order they reserved. A limit of 0 (or None) disables the bucket.
+    """
+
+    def __init__(self, per_minute, burst=None, clock=time.monotonic):
+        self.rate = (per_minute or 0) / 60.0
+        self.capacity = burst if burst is not None else (per_minute or 0)
+        self.clock = clock
+        self.level = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        if not self.rate:
+            return 0.0
+        self._refill()
+        # A single call larger than the bucket would otherwise never fit
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, amount):
+        """Debit (positive) or refund (negative) units after the real usage is known."""
+        if self.rate:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit that backs off on throttling and errors and recovers on success.
+
+    Only one decrease happens per generation: calls that started before the
+    last decrease do not shrink the limit again when they fail too.
+    """
+
+    def __init__(self, maximum, minimum=1, window=20, error_threshold=0.2):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = self.maximum
+        self.error_threshold = error_threshold
+        self.outcomes = collections.deque(maxlen=window)
+        self.generation = 0
+        self.running = 0
+        self.streak = 0
+        self._changed = None
+
+    async def acquire(self):
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.running < self.limit)
+            self.running += 1
+        return self.generation
+
+    async def release(self):
+        async with self._changed:
+            self.running -= 1
+            self._changed.notify_all()
+
+    def record(self, outcome, generation):
+        """outcome is "ok", "throttled" or "error"."""
+        self.outcomes.append(outcome != "ok")
+        if outcome == "ok":
+            self.streak += 1
+            if self.streak >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self.streak = 0
+            return
+        self.streak = 0
+        error_rate = sum(self.outcomes) / len(self.outcomes)
+        overloaded = outcome == "throttled" or (len(self.outcomes) >= 5 and error_rate > self.error_threshold)
+        if overloaded and generation == self.generation:
+            self.limit = max(self.minimum, self.limit // 2)
+            self.generation += 1
+            self.outcomes.clear()
+
+
+class ProviderLimits:
+    """Quota and concurrency settings for one provider (0 disables a bucket)."""
+
+    def __init__(self, requests_per_min=0, tokens_per_min=0, max_concurrency=4, expected_output_tokens=1000):
+        self.requests_per_min = requests_per_min
+        self.tokens_per_min = tokens_per_min
+        self.max_concurrency = max_concurrency
+        # Reserved up front and corrected once the response length is known
+        self.expected_output_tokens = expected_output_tokens
+
+
+def error_status(error):
+    """HTTP status carried by an SDK error or anything it was raised from, or None."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        for attr in ("status_code", "code", "status"):
+            value = getattr(error, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def retry_after(error, now=None):
+    """Seconds requested by a Retry-After (or retry-after-ms) header, or None."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers is not None:
+            if headers.get("retry-after-ms"):
+                try:
+                    return float(headers["retry-after-ms"]) / 1000
+                except ValueError:
+                    pass
+            value = headers.get("retry-after")
+            if value:
+                try:
+                    return max(0.0, float(value))
+                except ValueError:
+                    try:
+                        parsed = email.utils.parsedate_to_datetime(value)
+                    except (TypeError, ValueError):
+                        # Neither seconds nor an HTTP date: fall back to the jittered backoff
+                        return None
+                    if parsed is not None:
+                        return max(0.0, parsed.timestamp() - (now or time.time()))
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def classify(error):
+    """"throttled", "transient" (worth a retry) or "fatal"."""
+    status = error_status(error)
+    if status == 429 or "RateLimit" in type(error).__name__:
+        return "throttled"
+    if status in RETRYABLE_STATUSES or isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return "transient"
+    # SDK timeouts and dropped connections (openai.APITimeoutError, httpx.ConnectError, ...)
+    if status is None and any(word in type(error).__name__ for word in ("Timeout", "Connection")):
+        return "transient"
+    return "fatal"
+
+
+class ProviderState:
+    def __init__(self, limits, clock):
+        self.limits = limits
+        self.requests = TokenBucket(limits.requests_per_min, clock=clock)
+        self.tokens = TokenBucket(limits.tokens_per_min, clock=clock)
+        self.concurrency = AdaptiveConcurrency(limits.max_concurrency)
+        self.paused_until = 0.0
+        self.stats = collections.Counter()
+
+
+class LLMScheduler:
+    """Admission, retries and adaptive concurrency for every provider.
+
+    attempts is the total number of tries per call; backoff grows from
+    backoff_s by `multiplier` up to max_backoff_s, with full jitter.
+    """
+
+    def __init__(self, limits, attempts=5, backoff_s=1.0, multiplier=2.0, max_backoff_s=60.0,
+                 clock=time.monotonic, sleep=asyncio.sleep, rng=None):
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.attempts = max(1, attempts)
+        self.backoff_s = backoff_s
+        self.multiplier = multiplier
+        self.max_backoff_s = max_backoff_s
+        self.providers = {name: ProviderState(provider_limits, clock) for name, provider_limits in limits.items()}
+
+    def backoff(self, attempt, error):
+        """Seconds to wait after the given failed attempt (1-based)."""
+        ceiling = min(self.max_backoff_s, self.backoff_s * self.multiplier ** (attempt - 1))
+        delay = self.rng.uniform(0, ceiling)
+        requested = retry_after(error)
+        return max(delay, requested) if requested is not None else delay
+
+    async def _admit(self, state, tokens):
+        """Wait for a concurrency slot, any provider-wide pause and both buckets."""
+        generation = await state.concurrency.acquire()
+        try:
+            pause = state.paused_until - self.clock()
+            if pause > 0:
+                await self.sleep(pause)
+            wait = max(state.requests.reserve(1), state.tokens.reserve(tokens))
+            if wait > 0:
+                state.stats["quota_wait_s"] += wait
+                await self.sleep(wait)
+        except BaseException:
+            await state.concurrency.release()
+            raise
+        return generation
+
+    async def reserve(self, provider, tokens_in=0):
+        """Debit one request and its tokens for a call made inside another call's slot, waiting for quota.
+
+        Used for a hedged duplicate: it shares the primary's concurrency slot,
+        but the provider counts it as a request of its own.
+        """
+        state = self.providers[provider]
+        pause = state.paused_until - self.clock()
+        if pause > 0:
+            await self.sleep(pause)
+        wait = max(state.requests.reserve(1), state.tokens.reserve(tokens_in + state.limits.expected_output_tokens))
+        if wait > 0:
+            state.stats["quota_wait_s"] += wait
+            await self.sleep(wait)
+        state.stats["duplicates"] += 1
+
+    async def _failed(self, provider, state, generation, error, attempt):
+        """Record a failed attempt; return the delay before the next one, or raise."""
+        kind = classify(error)
+        state.concurrency.record("throttled" if kind == "throttled" else "error", generation)
+        state.stats[kind] += 1
+        if kind == "fatal" or attempt >= self.attempts:
+            raise error
+        delay = self.backoff(attempt, error)
+        if kind == "throttled":
+            # Every call to this provider waits, not only the one that was told to
+            state.paused_until = max(state.paused_until, self.clock() + delay)
+        state.stats["retries"] += 1
+        state.stats["retry_sleep_s"] += delay
+        print(f"[{provider}] {type(error).__name__} ({kind}); retry {attempt}/{self.attempts - 1} in {delay:.1f}s")
+        return delay
+
+    async def call(self, provider, make_call, tokens_in=0):
+        """Await make_call() (a coroutine factory) under the provider's limits, retrying on failure."""
+        state = self.providers[provider]
+        estimate = tokens_in + state.limits.expected_output_tokens
+        for attempt in range(1, self.attempts + 1):
+            generation = await self._admit(state, estimate)
+            try:
+                result = await make_call()
+            except Exception as e:
+                delay = await self._failed(provider, state, generation, e, attempt)
+            else:
+                state.concurrency.record("ok", generation)
+                state.stats["calls"] += 1
+                state.tokens.adjust(tokens_in + count_tokens(getattr(result, "content", result) or "") - estimate)
+                return result
+            finally:
+                await state.concurrency.release()
+            await self.sleep(delay)
+
+    async def stream(self, provider, make_stream, tokens_in=0):
+        """Yield chunks from make_stream() under the provider's limits.
+
+        A failed attempt is retried only while nothing has been yielded yet;
+        after the first chunk, errors propagate so no text is duplicated.
+        """
+        state = self.providers[provider]
+        estimate = tokens_in + state.limits.expected_output_tokens
+        for attempt in range(1, self.attempts + 1):
+            generation = await self._admit(state, estimate)
+            received = []
+            delay = None
+            try:
+                try:
+                    async for chunk in make_stream():
+                        received.append(chunk)
+                        yield chunk
+                except Exception as e:
+                    if received:
+                        state.concurrency.record("error", generation)
+                        state.stats[classify(e)] += 1
+                        raise
+                    delay = await self._failed(provider, state, generation, e, attempt)
+                else:
+                    state.concurrency.record("ok", generation)
+                    state.stats["calls"] += 1
+                    state.tokens.adjust(tokens_in + count_tokens("".join(map(str, received))) - estimate)
+                    return
+            finally:
+                await state.concurrency.release()
+            await self.sleep(delay)
+
+    def summary(self):
+        parts = []
+        for name, state in self.providers.items():
+            stats = state.stats
+            parts.append(f"{name}: {stats['calls']} calls, {stats['retries']} retries "
+                         f"({stats['throttled']} throttled), concurrency {state.concurrency.limit}/"
+                         f"{state.concurrency.maximum}, waited {stats['quota_wait_s'] + stats['retry_sleep_s']:.1f}s")
+        return "scheduler: " + "; ".join(parts)
+
+
+class ScheduledLLM:
+    """Wrap a chain or chat model so its calls go through an LLMScheduler.
+
+    astream() yields the wrapped model's chunks; ainvoke() returns its result.
+    prefix_tokens covers input the payload does not show (e.g. a system prompt).
+    """
+
+    def __init__(self, runnable, scheduler, provider, prefix_tokens=0):
+        self.runnable = runnable
+        self.scheduler = scheduler
+        self.provider = provider
+        self.prefix_tokens = prefix_tokens
+
+    def _tokens(self, payload):
+        user_input = payload["input"] if isinstance(payload, dict) else payload
+        return self.prefix_tokens + count_tokens(str(user_input))
+
+    async def astream(self, payload):
+        async for chunk in self.scheduler.stream(self.provider, lambda: self.runnable.astream(payload),
+                                                 self._tokens(payload)):
+            yield chunk
+
+    async def ainvoke(self, payload):
+        return await self.scheduler.call(self.provider, lambda: self.runnable.ainvoke(payload), self._tokens(payload))
+
+    async def reserve(self, payload):
+        """Spend the quota of one more call with this payload, for a duplicate sent from inside this one."""
+        await self.scheduler.reserve(self.provider, self._tokens(payload))
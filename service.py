@@ -0,0 +1,276 @@
+"""Long-running article service: API-mode generation over a local HTTP API.
+
+Everything a single main.py run builds from scratch is built once and kept
+warm between requests: the imported SDKs, the Writer and Simulator clients
+(and the connection pools inside them, which stay bound to the one event
+loop that every job runs on), the compiled prompt templates, format.md, the
+scheduler's quotas and latency history, and the response cache.
+
+    POST /articles                {"topic": ..., "deadline": seconds}  -> 202 {"id", "status", "events"}
+    GET  /articles/<id>           state, file and (once done) the article
+    GET  /articles/<id>/events    Server-Sent Events: queued, started, delta, step, done / failed
+    GET  /health                  job counts, scheduler and cache summaries
+
+    python cli.py serve --port 8700 --concurrency 4
+"""
+import asyncio
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8700
+# Finished jobs kept in memory for status and event replay; their files stay on disk
+MAX_FINISHED_JOBS = 1000
+
+
+def next_free_index(output_dir):
+    """One past the highest NNN_ prefix in output_dir, so a restarted service never reuses a file name."""
+    highest = 0
+    if os.path.isdir(output_dir):
+        for name in os.listdir(output_dir):
+            match = re.match(r"(\d+)_", name)
+            if match:
+                highest = max(highest, int(match.group(1)))
+    return highest + 1
+
+
+class Job:
+    """One requested article and every event it produced, for replay to late subscribers."""
+
+    def __init__(self, job_id, topic, filename, deadline):
+        self.id = job_id
+        self.topic = topic
+        self.filename = filename
+        self.deadline = deadline
+        self.state = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.events = []
+        self.changed = threading.Condition()
+
+    def emit(self, kind, data=None):
+        with self.changed:
+            self.events.append((kind, data or {}))
+            self.changed.notify_all()
+
+    def summary(self, with_article=False):
+        body = {"id": self.id, "topic": self.topic, "state": self.state, "file": self.filename, "error": self.error,
+                "steps": sum(1 for kind, _ in self.events if kind == "step")}
+        if with_article and self.state == "done":
+            with open(self.filename, "r", encoding="utf-8") as f:
+                body["article"] = f.read()
+        return body
+
+
+class ArticleService:
+    """Warm clients on one background event loop, and the jobs submitted to them."""
+
+    def __init__(self, writer_chain, simulator_llm, output_dir, concurrency=4, scheduler=None, cache=None,
+                 prompt_budget=None):
+        self.writer_chain = writer_chain
+        self.simulator_llm = simulator_llm
+        self.output_dir = output_dir
+        self.prompt_budget = prompt_budget
+        self.scheduler = scheduler
+        self.cache = cache
+        self.jobs = {}
+        self._ids = itertools.count(next_free_index(output_dir))
+        self._lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.semaphore = asyncio.run_coroutine_threadsafe(self._semaphore(concurrency), self.loop).result()
+
+    @staticmethod
+    async def _semaphore(concurrency):
+        return asyncio.Semaphore(max(1, concurrency))
+
+    def submit(self, topic, deadline=None):
+        from main import article_filename, checkpoint_path
+        with self._lock:
+            while True:
+                job_id = next(self._ids)
+                filename = article_filename(topic, job_id, self.output_dir)
+                # Another process (a batch run, a second service) may be writing into the same directory
+                if not os.path.exists(filename) and not os.path.exists(checkpoint_path(filename)):
+                    break
+            job = Job(job_id, topic, filename, deadline)
+            self.jobs[job_id] = job
+            finished = [j for j in self.jobs.values() if j.state in ("done", "failed")]
+            for old in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self.jobs[old.id]
+        job.emit("queued", {"topic": topic})
+        asyncio.run_coroutine_threadsafe(self._run(job), self.loop)
+        return job
+
+    async def _run(self, job):
+        from main import checkpoint_path, generate_and_save
+
+        def events(kind, data):
+            if job.state == "queued":
+                job.state = "running"
+                job.emit("started")
+            job.emit(kind, data)
+
+        try:
+            await generate_and_save(job.topic, job.filename, self.writer_chain, self.simulator_llm, self.semaphore,
+                                    deadline=job.deadline, events=events, prompt_budget=self.prompt_budget)
+            if os.path.exists(checkpoint_path(job.filename)):
+                raise RuntimeError("the article did not finish (deadline or a failed call); it can be resumed")
+        except Exception as e:
+            job.state, job.error = "failed", str(e)
+            job.emit("failed", {"error": str(e)})
+        else:
+            job.state = "done"
+            job.emit("done", {"file": job.filename})
+
+    def health(self):
+        states = {}
+        for job in list(self.jobs.values()):
+            states[job.state] = states.get(job.state, 0) + 1
+        return {"status": "ok", "jobs": states,
+                "scheduler": self.scheduler.summary() if self.scheduler is not None else None,
+                "cache": self.cache.summary() if self.cache is not None else None}
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+def _make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _job(self, job_id):
+            job = service.jobs.get(int(job_id)) if job_id.isdigit() else None
+            if job is None:
+                self._send_json(404, {"error": f"no job {job_id}"})
+            return job
+
+        def do_GET(self):
+            parts = self.path.split("?", 1)[0].strip("/").split("/")
+            if parts == ["health"]:
+                self._send_json(200, service.health())
+            elif len(parts) == 2 and parts[0] == "articles":
+                job = self._job(parts[1])
+                if job:
+                    self._send_json(200, job.summary(with_article=True))
+            elif len(parts) == 3 and parts[0] == "articles" and parts[2] == "events":
+                job = self._job(parts[1])
+                if job:
+                    self._events(job)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path.split("?", 1)[0].rstrip("/") != "/articles":
+                return self._send_json(404, {"error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                topic = str(body["topic"]).strip()
+                deadline = float(body["deadline"]) if body.get("deadline") is not None else None
+            except (ValueError, KeyError, TypeError):
+                return self._send_json(400, {"error": 'expected JSON {"topic": ..., "deadline": seconds}'})
+            if not topic:
+                return self._send_json(400, {"error": "topic is empty"})
+            job = service.submit(topic, deadline)
+            self._send_json(202, {"id": job.id, "status": f"/articles/{job.id}",
+                                  "events": f"/articles/{job.id}/events"},
+                            {"Location": f"/articles/{job.id}"})
+
+        def _events(self, job):
+            """Replay the job's events so far, then stream new ones until it is done or failed."""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            sent = 0
+            try:
+                while True:
+                    with job.changed:
+                        job.changed.wait_for(lambda: len(job.events) > sent, timeout=15)
+                        pending = job.events[sent:]
+                    if not pending:
+                        self.wfile.write(b": keep-alive\n\n")
+                    for kind, data in pending:
+                        self.wfile.write(f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    sent += len(pending)
+                    if any(kind in ("done", "failed") for kind, _ in pending):
+                        return
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client went away; the job keeps running
+
+    return Handler
+
+
+def build_service(args):
+    """Import the SDKs, read format.md and build the clients once, for every request to come."""
+    import main
+    with open(os.path.join(os.path.dirname(os.path.abspath(main.__file__)), "format.md"), "r", encoding="utf-8") as f:
+        format_content = f.read()
+    cache = main.cache_from_env(replay=args.replay, enabled=not args.no_cache)
+    scheduler = main.build_scheduler(args)
+    hedge = None
+    if args.hedge or args.hedge_writer_model or args.hedge_simulator_model:
+        hedge = {"writer": args.hedge_writer_model, "simulator": args.hedge_simulator_model}
+    writer_chain, simulator_llm = main.build_chains(format_content, cache, scheduler, args.request_timeout, hedge)
+    os.makedirs(args.output_dir, exist_ok=True)
+    return ArticleService(writer_chain, simulator_llm, args.output_dir, args.concurrency, scheduler, cache,
+                          args.prompt_budget)
+
+
+def main(argv=None):
+    import main as main_module
+    parser = main_module.build_parser()
+    parser.description = "Serve article generation over a local HTTP API, keeping the clients warm."
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+    if not args.replay and (not os.getenv("OPENAI_API_KEY") or not os.getenv("GOOGLE_API_KEY")):
+        print("Error: API keys not found. Please set OPENAI_API_KEY and GOOGLE_API_KEY in .env file.")
+        return 1
+
+    service = build_service(args)
+    httpd = ThreadingHTTPServer((args.host, args.port), _make_handler(service))
+    httpd.daemon_threads = True
+    print(f"Serving on http://{args.host}:{httpd.server_address[1]} (concurrency {args.concurrency}, "
+          f"articles in {args.output_dir})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+        if service.scheduler is not None:
+            print(service.scheduler.summary())
+        if service.cache is not None:
+            print(service.cache.summary())
+            service.cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Index of every Simulator prompt/response pair, searchable by near-duplicate prompts.
+
+The exact cache (llm_cache.py) only answers a prompt it has seen byte for
+byte. The prompts the Writer (or Gemini in browser mode) writes for the
+Simulator are often the same request with a few words changed, so this index
+finds prompts whose character 5-grams overlap by at least a threshold
+(Jaccard similarity) and returns the answer stored for the closest one.
+
+Lookups use MinHash signatures split into LSH bands: only prompts sharing a
+band with the query are compared, and their real Jaccard similarity decides.
+Shared by main.py (API mode) and human_assisted_flow/main.py (browser mode).
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+
+from llm_cache import CachedMessage
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "similar_prompts.sqlite3")
+DEFAULT_THRESHOLD = 0.85
+SHINGLE_CHARS = 5
+NUM_PERM = 64
+BANDS = 16
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20251129)  # fixed, so stored signatures stay comparable
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def shingles(text):
+    """Character n-grams of the text with whitespace collapsed (works for Japanese too)."""
+    text = re.sub(r"\s+", " ", text).strip().lower()
+    if len(text) <= SHINGLE_CHARS:
+        return {text}
+    return {text[i:i + SHINGLE_CHARS] for i in range(len(text) - SHINGLE_CHARS + 1)}
+
+
+def minhash(grams):
+    hashes = [struct.unpack("<Q", hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest())[0] for g in grams]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_keys(signature):
+    rows = NUM_PERM // BANDS
+    return [f"{band}:" + hashlib.blake2b(repr(signature[band * rows:(band + 1) * rows]).encode(), digest_size=8).hexdigest()
+            for band in range(BANDS)]
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class SimilarMatch:
+    def __init__(self, similarity, prompt, response):
+        self.similarity = similarity
+        self.prompt = prompt
+        self.response = response
+
+
+class PromptIndex:
+    """Prompt/response pairs per scope (e.g. the Simulator model), with near-duplicate lookup."""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self.lookups = 0
+        self.hits = 0
+        self.declined = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pairs ("
+            " id INTEGER PRIMARY KEY,"
+            " scope TEXT NOT NULL,"
+            " prompt_hash TEXT NOT NULL,"
+            " prompt TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " UNIQUE (scope, prompt_hash))"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS bands (band TEXT NOT NULL, pair INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS bands_lookup ON bands(band)")
+
+    def add(self, scope, prompt, response):
+        """Store a pair; a prompt already stored for the scope keeps its first answer."""
+        if not prompt or not response:
+            return
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        keys = band_keys(minhash(shingles(prompt)))
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO pairs (scope, prompt_hash, prompt, response, created_at) VALUES (?, ?, ?, ?, ?)",
+                (scope, prompt_hash, prompt, response, time.time()))
+            if cursor.rowcount:
+                self._db.executemany("INSERT INTO bands (band, pair) VALUES (?, ?)",
+                                     [(f"{scope}|{key}", cursor.lastrowid) for key in keys])
+
+    def find(self, scope, prompt, threshold=DEFAULT_THRESHOLD):
+        """The stored pair whose prompt is most similar to prompt, if at least threshold; else None."""
+        grams = shingles(prompt)
+        keys = [f"{scope}|{key}" for key in band_keys(minhash(grams))]
+        with self._lock:
+            self.lookups += 1
+            rows = self._db.execute(
+                "SELECT DISTINCT p.prompt, p.response FROM bands b JOIN pairs p ON p.id = b.pair"
+                f" WHERE b.band IN ({','.join('?' * len(keys))})", keys).fetchall()
+        best = None
+        for stored_prompt, response in rows:
+            similarity = jaccard(grams, shingles(stored_prompt))
+            if similarity >= threshold and (best is None or similarity > best.similarity):
+                best = SimilarMatch(similarity, stored_prompt, response)
+        return best
+
+    def used(self, accepted=True):
+        """Count a match that was used (or offered and declined)."""
+        with self._lock:
+            if accepted:
+                self.hits += 1
+            else:
+                self.declined += 1
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM pairs").fetchone()[0]
+        return {"lookups": self.lookups, "hits": self.hits, "declined": self.declined,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0, "entries": entries}
+
+    def summary(self):
+        s = self.stats()
+        declined = f", {s['declined']} declined" if s["declined"] else ""
+        return (f"similar prompts: {s['hits']} reused / {s['lookups']} lookups "
+                f"({s['hit_rate']:.0%}){declined}, {s['entries']} pairs indexed")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SimilarLLM:
+    """Wrap the Simulator so a prompt close enough to an earlier one reuses its answer.
+
+    Every real answer is added to the index. With threshold None nothing is
+    reused, the index only grows.
+    """
+
+    def __init__(self, runnable, index, scope, threshold=None):
+        self.runnable = runnable
+        self.index = index
+        self.scope = scope
+        self.threshold = threshold
+
+    async def ainvoke(self, payload):
+        prompt = payload["input"] if isinstance(payload, dict) else payload
+        if self.threshold is not None:
+            match = self.index.find(self.scope, prompt, self.threshold)
+            if match is not None:
+                self.index.used()
+                print(f"[similar] Reusing an earlier Simulator answer (similarity {match.similarity:.2f}).")
+                return CachedMessage(match.response)
+        result = await self.runnable.ainvoke(payload)
+        self.index.add(self.scope, prompt, getattr(result, "content", result))
+        return result
+
+
+def import_checkpoints(index, paths, scope_for_target):
+    """Add the pairs recorded in browser-flow checkpoints (checkpoint.json) under paths.
+
+    scope_for_target maps a phase's target service to a scope, or None to skip it.
+    """
+    added = 0
+    for path in paths:
+        files = [path] if os.path.isfile(path) else glob.glob(os.path.join(path, "**", "checkpoint.json"), recursive=True)
+        for file in files:
+            with open(file, "r", encoding="utf-8") as f:
+                phases = json.load(f).get("phases", [])
+            for phase in phases:
+                scope = scope_for_target(phase.get("target"))
+                if scope and phase.get("kind") == "phase" and phase.get("prompt") and phase.get("response"):
+                    index.add(scope, phase["prompt"], phase["response"])
+                    added += 1
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index of Simulator prompt/response pairs.")
+    parser.add_argument("--index", default=os.getenv("ARTICLE_AGENT_SIMILAR") or DEFAULT_INDEX_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    importer = sub.add_parser("import", help="Add the ChatGPT phases of browser-flow checkpoints (files or folders).")
+    importer.add_argument("paths", nargs="+")
+    sub.add_parser("stats")
+    args = parser.parse_args(argv)
+    index = PromptIndex(args.index)
+    try:
+        if args.command == "import":
+            added = import_checkpoints(index, args.paths, lambda target: "chatgpt-web" if target == "chatgpt" else None)
+            print(f"Read {added} prompt/response pairs.")
+        print(index.summary())
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Incremental parser for the Writer's <article>/<prompt>/<finished> output."""
+
+ARTICLE = "article"
+PROMPT = "prompt"
+FINISHED_TAG = "<finished>"
+TAGS = (ARTICLE, PROMPT)
+
+
+def _partial_suffix_len(text, tokens):
+    """Length of the longest suffix of text that could start one of tokens."""
+    longest = 0
+    for token in tokens:
+        for size in range(min(len(token) - 1, len(text)), longest, -1):
+            if token.startswith(text[-size:]):
+                longest = size
+                break
+    return longest
+
+
+class TagStreamParser:
+    """Split a streamed Writer response into tagged blocks as chunks arrive.
+
+    feed() returns a list of (kind, value) events:
+      ("article_delta", text)  raw article text as soon as it is safe to emit
+      ("article", text)        the stripped article body once </article> arrives
+      ("prompt", text)         the stripped prompt body once </prompt> arrives
+      ("finished", None)       the <finished> marker was seen
+
+    Like extract_tag_content, only the first block of each tag is kept.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.current = None
+        self.parts = []
+        self.article = None
+        self.prompt = None
+        self.finished = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        events = []
+        while True:
+            if self.current is None:
+                if not self._scan_outside(events):
+                    break
+            elif not self._scan_inside(events):
+                break
+        return events
+
+    def close(self):
+        """Flush whatever is left once the stream ends."""
+        events = []
+        if self.current == ARTICLE and self.article is None and self.buffer:
+            self.parts.append(self.buffer)
+            events.append(("article_delta", self.buffer))
+        self.buffer = ""
+        return events
+
+    def _scan_outside(self, events):
+        openers = [f"<{tag}>" for tag in TAGS] + [FINISHED_TAG]
+        hits = [(self.buffer.find(token), token) for token in openers]
+        hits = [(pos, token) for pos, token in hits if pos != -1]
+        if not hits:
+            # Keep a possible half-received tag for the next chunk
+            keep = _partial_suffix_len(self.buffer, openers)
+            self.buffer = self.buffer[len(self.buffer) - keep:] if keep else ""
+            return False
+
+        pos, token = min(hits)
+        self.buffer = self.buffer[pos + len(token):]
+        if token == FINISHED_TAG:
+            if not self.finished:
+                self.finished = True
+                events.append(("finished", None))
+            return True
+
+        self.current = token[1:-1]
+        self.parts = []
+        return True
+
+    def _scan_inside(self, events):
+        closer = f"</{self.current}>"
+        pos = self.buffer.find(closer)
+        if pos == -1:
+            keep = _partial_suffix_len(self.buffer, [closer])
+            safe = self.buffer[:len(self.buffer) - keep]
+            if safe:
+                self._append(safe, events)
+            self.buffer = self.buffer[len(safe):]
+            return False
+
+        if pos:
+            self._append(self.buffer[:pos], events)
+        self.buffer = self.buffer[pos + len(closer):]
+
+        body = "".join(self.parts).strip()
+        if getattr(self, self.current) is None:
+            setattr(self, self.current, body)
+            events.append((self.current, body))
+        self.current = None
+        self.parts = []
+        return True
+
+    def _append(self, text, events):
+        self.parts.append(text)
+        if self.current == ARTICLE and self.article is None:
+            events.append(("article_delta", text))
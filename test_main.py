@@ -0,0 +1,1000 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# Add the directory to path so we can import main
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+import tracing
+import bench_startup
+import cli
+from bench_pipeline import compare, percentile
+import export
+from hedging import HedgedLLM, LatencyTracker
+import job_queue
+from job_queue import JobQueue, LeaseLost, work
+from service import ArticleService, _make_handler
+from fake_llm_server import FakeLLMServer, ProviderProfile, parse_latency
+from llm_cache import CacheMiss, CachedLLM, ResponseCache
+from prompt_budget import OMISSION_MARKER, PromptAssembler, PromptTemplate, condense, count_tokens, validate_templates
+from rate_limit import LLMScheduler, ProviderLimits, ScheduledLLM, TokenBucket, classify, retry_after
+from similar_prompts import PromptIndex, SimilarLLM
+from tag_stream import TagStreamParser
+
+
+class FakeWriter:
+    """Writer chain stand-in that replays scripted responses."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.inputs = []
+
+    async def astream(self, payload):
+        self.inputs.append(payload["input"])
+        response = self.responses.pop(0)
+        # Deliver the response in small chunks so tags get split across them
+        for i in range(0, len(response), 3):
+            await asyncio.sleep(0)
+            yield response[i:i + 3]
+
+
+class FakeSimulator:
+    def __init__(self, reply="simulated answer"):
+        self.reply = reply
+        self.prompts = []
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(prompt)
+        await asyncio.sleep(0)
+        return SimpleNamespace(content=self.reply)
+
+
+class TestArticlePipeline(unittest.TestCase):
+
+    def test_extract_tag_content(self):
+        text = "<article>\n本文\n</article>\n<prompt>質問</prompt>"
+        self.assertEqual(main.extract_tag_content(text, "article"), "本文")
+        self.assertEqual(main.extract_tag_content(text, "prompt"), "質問")
+        self.assertIsNone(main.extract_tag_content(text, "missing"))
+
+    def test_load_topics_skips_blanks_and_comments(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "topics.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("# nightly\nテーマA\n\n  テーマB  \n")
+            self.assertEqual(main.load_topics(path), ["テーマA", "テーマB"])
+
+    def test_article_filename_is_unique_per_topic(self):
+        first = main.article_filename("同じ テーマ", 1, "out")
+        second = main.article_filename("同じ テーマ", 2, "out")
+        self.assertEqual(first, os.path.join("out", "001_同じ_テーマ.md"))
+        self.assertNotEqual(first, second)
+
+    def test_generate_article_runs_writer_simulator_loop(self):
+        writer = FakeWriter([
+            "<article>導入</article><prompt>ステップ1</prompt>",
+            "<article>まとめ</article><finished>",
+        ])
+        simulator = FakeSimulator("回答例")
+
+        parts = asyncio.run(main.generate_article("テーマ", writer, simulator))
+
+        self.assertEqual(parts, ["導入", "まとめ"])
+        self.assertEqual(simulator.prompts, ["ステップ1"])
+        self.assertIn("回答例", writer.inputs[1])
+
+    def test_run_batch_writes_one_file_per_topic(self):
+        topics = ["A", "B", "C"]
+        writer = FakeWriter(["<article>本文</article><finished>"] * len(topics))
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs = [(t, main.article_filename(t, i, tmp)) for i, t in enumerate(topics, start=1)]
+            asyncio.run(main.run_batch(jobs, writer, FakeSimulator(), concurrency=2))
+            for _, filename in jobs:
+                with open(filename, encoding="utf-8") as f:
+                    self.assertEqual(f.read(), "本文")
+
+    def test_prompt_budget_applies_to_one_run_only(self):
+        long_answer = "\n".join(f"行{i}：とても長いシミュレーターの回答です。" for i in range(200))
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = main.article_filename("短い予算", 1, tmp)
+            writer = FakeWriter(["<article>導入</article><prompt>ステップ1</prompt>",
+                                 "<article>まとめ</article><finished>"])
+            asyncio.run(main.run_batch([("短い予算", filename)], writer, FakeSimulator(long_answer),
+                                       prompt_budget=400))
+            self.assertTrue(os.path.exists(filename + ".cuts.jsonl"))
+        self.assertLessEqual(count_tokens(writer.inputs[1]), 400)
+        # The module-level assembler keeps its own budget for the runs that follow
+        self.assertEqual(main.PROMPTS.budgets["next_step"], main.NEXT_STEP_TOKEN_BUDGET)
+        self.assertEqual(main.PROMPTS.assemble("next_step", {"simulator_response": long_answer}).cuts, {})
+
+    def test_generate_article_streams_article_text(self):
+        writer = FakeWriter([
+            "<article>導入</article><prompt>Q</prompt>",
+            "<article>まとめ</article><finished>",
+        ])
+        streamed = []
+
+        asyncio.run(main.generate_article("テーマ", writer, FakeSimulator(), on_delta=streamed.append))
+
+        self.assertEqual("".join(streamed), "導入\n\nまとめ")
+
+    def test_simulator_starts_before_writer_finishes(self):
+        events = []
+
+        class SlowTailWriter:
+            async def astream(self, payload):
+                yield "<article>本文</article><prompt>Q</prompt>"
+                await asyncio.sleep(0.05)
+                events.append("writer_done")
+                yield "..."
+
+        class RecordingSimulator(FakeSimulator):
+            async def ainvoke(self, prompt):
+                events.append("simulator_started")
+                return await super().ainvoke(prompt)
+
+        asyncio.run(main.generate_article("テーマ", SlowTailWriter(), RecordingSimulator(), max_steps=1))
+
+        self.assertEqual(events[:2], ["simulator_started", "writer_done"])
+
+    def test_resume_continues_unfinished_article_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "article.md")
+            simulator = FakeSimulator("答え")
+            # The second Writer call fails, leaving the article unfinished
+            first = FakeWriter(["<article>一</article><prompt>p1</prompt>"])
+            asyncio.run(main.run_batch([("テーマ", filename)], first, simulator, 1))
+            self.assertTrue(os.path.exists(main.checkpoint_path(filename)))
+
+            second = FakeWriter(["<article>二</article><finished>"])
+            asyncio.run(main.run_batch([("テーマ", filename)], second, simulator, 1, resume=True))
+            with open(filename, encoding="utf-8") as f:
+                content = f.read()
+
+            self.assertEqual(len(second.inputs), 1)
+            self.assertIn("答え", second.inputs[0])
+            self.assertEqual(simulator.prompts, ["p1"])
+            self.assertEqual(content, "一\n\n二")
+            self.assertFalse(os.path.exists(main.checkpoint_path(filename)))
+
+            # Finished articles are skipped
+            third = FakeWriter([])
+            asyncio.run(main.run_batch([("テーマ", filename)], third, simulator, 1, resume=True))
+            self.assertEqual(third.inputs, [])
+
+    def test_variants_share_the_prefix_and_branch_concurrently(self):
+        class BranchWriter(FakeWriter):
+            async def astream(self, payload):
+                self.inputs.append(payload["input"])
+                await asyncio.sleep(0)
+                for variant in ("案A", "案B"):
+                    if variant in payload["input"]:
+                        yield f"<article>{variant}のまとめ</article><finished>"
+                        return
+                yield "<article>導入</article><prompt>p1</prompt>"
+
+        writer, simulator = BranchWriter([]), FakeSimulator("答え")
+        with tempfile.TemporaryDirectory() as tmp:
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(main.run_batch([("テーマ", os.path.join(tmp, "001_テーマ.md"))], writer, simulator, 2,
+                                           variants=["案A", "案B"]))
+            folder = os.path.join(tmp, "001_テーマ")
+            with open(os.path.join(folder, main.VARIANT_TREE), encoding="utf-8") as f:
+                tree = json.load(f)
+            contents = []
+            for variant in tree["variants"]:
+                with open(os.path.join(folder, variant["file"]), encoding="utf-8") as f:
+                    contents.append(f.read())
+
+        # The shared step ran once: one Writer call for it plus one per variant
+        self.assertEqual(len(writer.inputs), 3)
+        self.assertEqual(simulator.prompts, ["p1"])
+        self.assertEqual(contents, ["導入\n\n案Aのまとめ", "導入\n\n案Bのまとめ"])
+        self.assertEqual([v["instruction"] for v in tree["variants"]], ["案A", "案B"])
+        self.assertTrue(all(v["completed"] for v in tree["variants"]))
+
+    def test_regenerate_step_reruns_only_the_steps_that_depend_on_it(self):
+        class EchoSimulator(FakeSimulator):
+            async def ainvoke(self, prompt):
+                self.prompts.append(prompt)
+                return SimpleNamespace(content=f"{prompt}への回答")
+
+        simulator = EchoSimulator()
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            filename = os.path.join(tmp, "article.md")
+            writer = FakeWriter(["<article>導入</article><prompt>p1</prompt>",
+                                 "<article>手順</article><prompt>p2</prompt>",
+                                 "<article>まとめ</article><finished>"])
+            asyncio.run(main.run_batch([("テーマ", filename)], writer, simulator, 1))
+            model = main.Checkpoint.load(main.model_path(filename))
+            self.assertEqual([(s["step"], s["depends_on"]) for s in model.phases], [(1, None), (2, 1), (3, 2)])
+
+            # Same prompt: the old Simulator answer still holds, so only step 2 is rerun
+            writer = FakeWriter(["<article>手順（改）</article><prompt>p2</prompt>"])
+            rerun = asyncio.run(main.regenerate_step(filename, 2, writer, simulator, instruction="もっと具体的に"))
+            self.assertEqual(rerun, [2])
+            self.assertTrue(writer.inputs[0].endswith("もっと具体的に"))
+            self.assertIn("p1への回答", writer.inputs[0])
+
+            # A new prompt changes the Simulator answer, so the next step is rerun too
+            writer = FakeWriter(["<article>導入（改）</article><prompt>p1b</prompt>",
+                                 "<article>手順（再）</article><prompt>p2</prompt>"])
+            rerun = asyncio.run(main.regenerate_step(filename, 1, writer, simulator))
+            with open(filename, encoding="utf-8") as f:
+                content = f.read()
+            model = main.Checkpoint.load(main.model_path(filename))
+
+            # A provider error is reported like the rest of main, and the article is left as it was
+            class RejectedWriter(FakeWriter):
+                async def astream(self, payload):
+                    raise PermissionError("401 invalid API key")
+                    yield
+
+            out = io.StringIO()
+            with patch.object(main, "build_chains", return_value=(RejectedWriter([]), simulator)), \
+                    patch.dict(os.environ, {"OPENAI_API_KEY": "k", "GOOGLE_API_KEY": "k"}), contextlib.redirect_stdout(out):
+                status = main.regenerate_main([filename, "--step", "2"])
+            with open(filename, encoding="utf-8") as f:
+                self.assertEqual(f.read(), content)
+        self.assertEqual(status, 1)
+        self.assertIn("Error: PermissionError: 401 invalid API key", out.getvalue())
+
+        self.assertEqual(rerun, [1, 2])
+        self.assertIn("p1bへの回答", writer.inputs[1])
+        self.assertEqual(simulator.prompts, ["p1", "p2", "p1b"])
+        self.assertEqual(content, "導入（改）\n\n手順（再）\n\nまとめ")
+        self.assertEqual(model.phases[2]["input"], main.PROMPTS.assemble("next_step", {"simulator_response": "p2への回答"}).text)
+
+    def test_regenerate_keeps_the_prompt_budget_and_replaces_the_article_atomically(self):
+        long_answer = "\n".join(f"行{i}：とても長いシミュレーターの回答です。" for i in range(200))
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            filename = os.path.join(tmp, "article.md")
+            writer = FakeWriter(["<article>導入</article><prompt>p1</prompt>", "<article>まとめ</article><finished>"])
+            asyncio.run(main.run_batch([("テーマ", filename)], writer, FakeSimulator(long_answer), prompt_budget=400))
+            self.assertEqual(main.Checkpoint.load(main.model_path(filename)).data["prompt_budget"], 400)
+
+            # A changed answer reruns step 2 with the budget the article was generated with
+            writer = FakeWriter(["<article>導入（改）</article><prompt>p1b</prompt>",
+                                 "<article>まとめ（改）</article><finished>"])
+            rerun = asyncio.run(main.regenerate_step(filename, 1, writer, FakeSimulator(long_answer + "改")))
+            self.assertEqual(rerun, [1, 2])
+            self.assertLessEqual(count_tokens(writer.inputs[1]), 400)
+
+            # A crash while writing leaves the previous article whole
+            writer = FakeWriter(["<article>導入（再）</article><finished>"])
+            with patch("checkpoint.os.fsync", side_effect=OSError("disk full")), self.assertRaises(OSError):
+                asyncio.run(main.regenerate_step(filename, 1, writer, FakeSimulator()))
+            with open(filename, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "導入（改）\n\nまとめ（改）")
+            self.assertEqual([name for name in os.listdir(tmp) if name.endswith(".tmp")], [])
+
+    def test_run_batch_traces_steps_and_reports_percentiles(self):
+        writer = FakeWriter([
+            "<article>導入</article><prompt>ステップ1</prompt>",
+            "<article>まとめ</article><finished>",
+        ])
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = main.article_filename("テーマ", 1, tmp)
+            asyncio.run(main.run_batch([("テーマ", filename)], writer, FakeSimulator("回答例"), concurrency=1))
+            spans = tracing.load_spans(tracing.find_traces([tmp]))
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(main.main(["report", tmp]), 0)
+
+        by_name = {}
+        for span in spans:
+            by_name.setdefault(span["name"], []).append(span)
+        self.assertEqual({name: len(group) for name, group in by_name.items()},
+                         {"article": 1, "step": 2, "writer": 2, "simulator": 1})
+        article = by_name["article"][0]
+        self.assertEqual((article["topic"], article["steps"], article["completed"]), ("テーマ", 2, True))
+        self.assertTrue(all(s["parent"] == article["span"] for s in by_name["step"]))
+        writer_span = by_name["writer"][0]
+        self.assertLessEqual(writer_span["ttft_s"], writer_span["wall_s"])
+        self.assertGreater(writer_span["tokens_in"], 0)
+        self.assertEqual(by_name["simulator"][0]["chars_out"], len("回答例"))
+        self.assertIn("== writer", output.getvalue())
+
+    def test_plan_jobs_defaults_to_single_article(self):
+        args = main.build_parser().parse_args([])
+        self.assertEqual(main.plan_jobs(args), [(main.DEFAULT_TOPIC, main.DEFAULT_OUTPUT_FILE)])
+
+
+class TestTagStreamParser(unittest.TestCase):
+
+    RESPONSE = "前置き<article>\n# 見出し\n本文 a<b\n</article>\n<prompt>\nプロンプト\n</prompt>"
+
+    def test_matches_extract_tag_content_for_every_split(self):
+        for size in range(1, len(self.RESPONSE) + 1):
+            parser = TagStreamParser()
+            deltas = []
+            for i in range(0, len(self.RESPONSE), size):
+                for kind, value in parser.feed(self.RESPONSE[i:i + size]):
+                    if kind == "article_delta":
+                        deltas.append(value)
+            parser.close()
+            self.assertEqual(parser.article, main.extract_tag_content(self.RESPONSE, "article"))
+            self.assertEqual(parser.prompt, main.extract_tag_content(self.RESPONSE, "prompt"))
+            self.assertEqual("".join(deltas).strip(), parser.article)
+            self.assertFalse(parser.finished)
+
+    def test_prompt_event_is_emitted_on_closing_tag(self):
+        parser = TagStreamParser()
+        self.assertEqual(parser.feed("<prompt>質問</pro"), [])
+        self.assertEqual(parser.feed("mpt> 後続"), [("prompt", "質問")])
+
+    def test_finished_marker(self):
+        parser = TagStreamParser()
+        events = parser.feed("<article>まとめ</article>\n<fini")
+        events += parser.feed("shed>")
+        self.assertIn(("finished", None), events)
+        self.assertTrue(parser.finished)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache.sqlite3")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key_covers_every_request_parameter(self):
+        base = ResponseCache.make_key("gpt-4o", 0.7, "system", "input")
+        self.assertEqual(base, ResponseCache.make_key("gpt-4o", 0.7, "system", "input"))
+        self.assertNotEqual(base, ResponseCache.make_key("gpt-4o-mini", 0.7, "system", "input"))
+        self.assertNotEqual(base, ResponseCache.make_key("gpt-4o", 0.2, "system", "input"))
+        self.assertNotEqual(base, ResponseCache.make_key("gpt-4o", 0.7, "format v2", "input"))
+        self.assertNotEqual(base, ResponseCache.make_key("gpt-4o", 0.7, "system", "other"))
+
+    def test_hit_miss_counters_and_persistence(self):
+        cache = ResponseCache(self.path)
+        self.assertIsNone(cache.get("k"))
+        cache.put("k", "応答")
+        self.assertEqual(cache.get("k"), "応答")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.close()
+
+        reopened = ResponseCache(self.path)
+        self.assertEqual(reopened.get("k"), "応答")
+        reopened.close()
+
+    def test_size_eviction_drops_least_recently_used(self):
+        cache = ResponseCache(self.path, max_bytes=10)
+        cache.put("old", "aaaa")
+        cache.put("new", "bbbb")
+        cache.get("old")  # "new" is now the least recently used entry
+        cache.put("third", "cccc")
+        self.assertIsNotNone(cache.get("old"))
+        self.assertIsNone(cache.get("new"))
+        self.assertGreaterEqual(cache.evictions, 1)
+        cache.close()
+
+    def test_age_eviction(self):
+        cache = ResponseCache(self.path, max_age_seconds=-1)
+        cache.put("k", "stale")
+        self.assertIsNone(cache.get("k"))
+        cache.close()
+
+    def test_replay_mode_fails_on_miss(self):
+        cache = ResponseCache(self.path, replay=True)
+        with self.assertRaises(CacheMiss):
+            cache.get("missing")
+        cache.close()
+
+    def test_cached_llm_answers_repeat_calls_from_disk(self):
+        cache = ResponseCache(self.path)
+        writer = FakeWriter(["<article>本文</article><finished>"])
+        simulator = FakeSimulator("回答")
+        cached_writer = CachedLLM(writer, cache, "writer", 0.7, "system")
+        cached_simulator = CachedLLM(simulator, cache, "simulator", 0.7)
+
+        async def run():
+            first = "".join([c async for c in cached_writer.astream({"input": "x"})])
+            second = "".join([c async for c in cached_writer.astream({"input": "x"})])
+            answers = [(await cached_simulator.ainvoke("q")).content for _ in range(2)]
+            return first, second, answers
+
+        first, second, answers = asyncio.run(run())
+        self.assertEqual(first, second)
+        self.assertEqual(writer.inputs, ["x"])
+        self.assertEqual(answers, ["回答", "回答"])
+        self.assertEqual(simulator.prompts, ["q"])
+        cache.close()
+
+
+class TestSimilarPrompts(unittest.TestCase):
+
+    PROMPT = ("あなたは忙しい会社員です。毎朝の準備に時間がかかりすぎて遅刻しそうになります。"
+              "朝の準備を15分短縮するために、前日の夜にできることを5つ、具体的な手順と一緒に挙げてください。")
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.index = PromptIndex(os.path.join(self.tmp.name, "similar.sqlite3"))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def test_finds_near_duplicates_above_the_threshold_only(self):
+        self.index.add("gpt-4o", self.PROMPT, "前日の夜にできること")
+        self.index.add("gpt-4o", "全く関係のない質問です。おすすめの本を教えてください。", "本の一覧")
+
+        match = self.index.find("gpt-4o", self.PROMPT.replace("5つ", "3つ"))
+        self.assertEqual(match.response, "前日の夜にできること")
+        self.assertGreater(match.similarity, 0.85)
+        self.assertLess(match.similarity, 1.0)
+        self.assertIsNone(self.index.find("gpt-4o", self.PROMPT.replace("朝の準備", "夕食の支度"), threshold=0.95))
+        # Pairs are kept per scope (Simulator model)
+        self.assertIsNone(self.index.find("gpt-4o-mini", self.PROMPT))
+
+    def test_similar_llm_reuses_answers_and_counts_hits(self):
+        simulator = FakeSimulator("前日の夜にできること")
+        similar = SimilarLLM(simulator, self.index, "gpt-4o", threshold=0.85)
+
+        async def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                first = await similar.ainvoke(self.PROMPT)
+                second = await similar.ainvoke(self.PROMPT.replace("15分", "20分"))
+                other = await similar.ainvoke("おすすめの本を教えてください。")
+            return first.content, second.content, other.content
+
+        self.assertEqual(asyncio.run(run()), ("前日の夜にできること",) * 3)
+        self.assertEqual(len(simulator.prompts), 2)
+        stats = self.index.stats()
+        self.assertEqual((stats["hits"], stats["lookups"], stats["entries"]), (1, 3, 2))
+
+        # Without a threshold the answers are only indexed
+        recording = SimilarLLM(simulator, self.index, "gpt-4o")
+        asyncio.run(recording.ainvoke(self.PROMPT))
+        self.assertEqual(len(simulator.prompts), 3)
+
+
+class TestPromptBudget(unittest.TestCase):
+
+    def test_template_ignores_non_ascii_braces_and_renders_once(self):
+        template = PromptTemplate("{プレースホルダー} は禁止。回答: {previous_response}")
+        self.assertEqual(template.placeholders, {"previous_response"})
+        rendered = template.render({"previous_response": "{previous_response}"})
+        self.assertEqual(rendered, "{プレースホルダー} は禁止。回答: {previous_response}")
+
+    def test_validate_templates_reports_missing_and_unknown(self):
+        with self.assertRaises(ValueError) as ctx:
+            validate_templates({"a": "{x}", "b": "{previous_respons}"},
+                               {"a": {"x"}, "b": {"previous_response"}, "c": set()})
+        message = str(ctx.exception)
+        self.assertIn("b: missing placeholder(s) {previous_response}", message)
+        self.assertIn("b: unknown placeholder(s) {previous_respons}", message)
+        self.assertIn("c: template not found", message)
+
+    def test_human_assisted_config_templates_are_valid(self):
+        import json
+        config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "human_assisted_flow", "config.json")
+        with open(config_path, encoding="utf-8") as f:
+            prompts = json.load(f)["prompts"]
+        validate_templates(prompts, {
+            "phase_0": set(),
+            "phase_1": {"problem_settings", "solution_hints"},
+            "phase_3_loop": {"previous_response"},
+            "phase_4_last": {"previous_response"},
+            "phase_6_summary": {"previous_response"},
+        })
+
+    def test_condense_keeps_structure_and_records_cuts(self):
+        lines = ["# 計画の概要"] + [f"補足説明その{i}：細かい話が続きます。" for i in range(40)] + ["1. 最初にやること"]
+        text = "\n".join(lines)
+        condensed, cuts = condense(text, 60)
+
+        self.assertLessEqual(count_tokens(condensed), 60)
+        self.assertTrue(condensed.startswith("# 計画の概要"))
+        self.assertIn("1. 最初にやること", condensed)
+        self.assertIn(OMISSION_MARKER, condensed)
+        kept = [line for line in condensed.splitlines() if line != OMISSION_MARKER]
+        self.assertEqual(len(kept) + len(cuts), len(lines))
+        for cut in cuts:
+            self.assertEqual(lines[cut["line"] - 1], cut["text"])
+
+    def test_assembler_enforces_budget_and_logs_cuts(self):
+        assembler = PromptAssembler({"next": "回答:\n{previous_response}\n以上"}, budgets={"next": 80})
+        long_answer = "\n".join(f"行{i}：とても長い回答の本文です。" for i in range(100))
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, "cuts.jsonl")
+            result = assembler.assemble("next", {"previous_response": long_answer}, log_path=log_path)
+            with open(log_path, encoding="utf-8") as f:
+                logged = f.read()
+
+        self.assertLessEqual(result.tokens, 80)
+        self.assertTrue(result.text.startswith("回答:") and result.text.endswith("以上"))
+        self.assertTrue(result.cuts["previous_response"])
+        self.assertIn('"template": "next"', logged)
+
+    def test_assembler_leaves_short_prompts_alone(self):
+        assembler = PromptAssembler({"next": "{previous_response}"}, budgets={"next": 1000})
+        result = assembler.assemble("next", {"previous_response": "短い回答"})
+        self.assertEqual((result.text, result.cuts), ("短い回答", {}))
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_token_bucket_delays_calls_over_the_quota(self):
+        now = [0.0]
+        bucket = TokenBucket(60, burst=2, clock=lambda: now[0])
+        self.assertEqual([bucket.reserve(1), bucket.reserve(1)], [0.0, 0.0])
+        self.assertAlmostEqual(bucket.reserve(1), 1.0)
+        now[0] = 3.0
+        self.assertEqual(bucket.reserve(1), 0.0)
+        self.assertEqual(TokenBucket(0).reserve(10 ** 6), 0.0)
+
+    def test_retries_throttled_calls_after_retry_after_and_backs_off_concurrency(self):
+        sleeps = []
+
+        async def sleep(seconds):
+            sleeps.append(seconds)
+
+        failures = [RateLimited(7), RateLimited(7)]
+
+        async def flaky(prompt):
+            if failures:
+                raise failures.pop()
+            return SimpleNamespace(content="ok")
+
+        scheduler = LLMScheduler({"simulator": ProviderLimits(max_concurrency=8)}, attempts=3, sleep=sleep)
+        llm = ScheduledLLM(SimpleNamespace(ainvoke=flaky), scheduler, "simulator")
+        self.assertEqual(asyncio.run(llm.ainvoke("hi")).content, "ok")
+
+        state = scheduler.providers["simulator"]
+        self.assertEqual(state.stats["retries"], 2)
+        self.assertEqual(state.stats["retry_sleep_s"], 14)
+        self.assertTrue(sleeps and all(seconds <= 7 for seconds in sleeps))
+        self.assertEqual(state.concurrency.limit, 2)
+        self.assertEqual(classify(ValueError("bad request")), "fatal")
+
+        failures.extend(RateLimited(0) for _ in range(3))
+        with self.assertRaises(RateLimited):
+            asyncio.run(llm.ainvoke("hi"))
+
+    def test_malformed_retry_after_falls_back_to_backoff(self):
+        self.assertIsNone(retry_after(RateLimited("garbage")))
+        self.assertEqual(retry_after(RateLimited("Wed, 21 Oct 2015 07:28:10 GMT"), now=1445412480), 10)
+
+        sleeps = []
+
+        async def sleep(seconds):
+            sleeps.append(seconds)
+
+        failures = [RateLimited("garbage")]
+
+        async def flaky(prompt):
+            if failures:
+                raise failures.pop()
+            return SimpleNamespace(content="ok")
+
+        scheduler = LLMScheduler({"simulator": ProviderLimits()}, attempts=2, backoff_s=1.0, sleep=sleep)
+        llm = ScheduledLLM(SimpleNamespace(ainvoke=flaky), scheduler, "simulator")
+        self.assertEqual(asyncio.run(llm.ainvoke("hi")).content, "ok")
+        self.assertEqual(scheduler.providers["simulator"].stats["retries"], 1)
+        self.assertTrue(sleeps and all(0 <= seconds <= 1.0 for seconds in sleeps))
+
+    def test_streams_are_retried_only_before_the_first_chunk(self):
+        attempts = []
+
+        class Writer:
+            async def astream(self, payload):
+                attempts.append(payload)
+                if len(attempts) == 1:
+                    raise ConnectionError("reset")
+                yield "a"
+                if len(attempts) == 2:
+                    raise ConnectionError("reset")
+                yield "b"
+
+        async def no_sleep(seconds):
+            pass
+
+        async def collect():
+            return [chunk async for chunk in llm.astream({"input": "x"})]
+
+        scheduler = LLMScheduler({"writer": ProviderLimits()}, sleep=no_sleep)
+        llm = ScheduledLLM(Writer(), scheduler, "writer")
+        with self.assertRaises(ConnectionError):
+            asyncio.run(collect())
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(asyncio.run(collect()), ["a", "b"])
+
+
+class SlowSimulator(FakeSimulator):
+    def __init__(self, reply, delay):
+        super().__init__(reply)
+        self.delay = delay
+        self.cancelled = 0
+
+    async def ainvoke(self, prompt):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return await super().ainvoke(prompt)
+
+
+class TestHedging(unittest.TestCase):
+
+    def tracker(self, latency=0.01):
+        tracker = LatencyTracker(min_samples=3)
+        for _ in range(3):
+            tracker.record(latency)
+        return tracker
+
+    def test_slow_call_is_hedged_to_the_alternate_and_the_loser_cancelled(self):
+        slow, fast = SlowSimulator("primary", 5), SlowSimulator("alternate", 0)
+        llm = HedgedLLM(slow, self.tracker(), alternate=fast)
+        self.assertEqual(asyncio.run(llm.ainvoke("hi")).content, "alternate")
+        self.assertEqual((llm.stats["hedged"], llm.stats["hedge_won"], slow.cancelled), (1, 1, 1))
+
+        # Without enough history nothing is duplicated
+        llm = HedgedLLM(SlowSimulator("primary", 0.05), LatencyTracker(min_samples=3), alternate=fast)
+        self.assertEqual(asyncio.run(llm.ainvoke("hi")).content, "primary")
+        self.assertEqual(llm.stats["hedged"], 0)
+
+    def test_streams_race_on_the_first_chunk(self):
+        class StalledWriter(FakeWriter):
+            async def astream(self, payload):
+                await asyncio.sleep(5)
+                yield "never"
+
+        async def collect():
+            return "".join([chunk async for chunk in llm.astream({"input": "x"})])
+
+        llm = HedgedLLM(StalledWriter([]), self.tracker(), alternate=FakeWriter(["<article>速い</article>"]))
+        self.assertEqual(asyncio.run(collect()), "<article>速い</article>")
+        self.assertEqual(llm.stats["hedge_won"], 1)
+
+    def test_cache_hits_do_not_feed_the_latency_window(self):
+        simulator = FakeSimulator()
+        scheduler = LLMScheduler({"writer": ProviderLimits(), "simulator": ProviderLimits()})
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(os.path.join(tmp, "cache.sqlite3"))
+            with patch.object(main, "build_models", return_value=(FakeWriter([]), simulator)):
+                _, simulator_llm = main.build_clients("w", "s", "system", cache, scheduler,
+                                                      hedge={"writer": None, "simulator": None})
+
+            async def calls():
+                for prompt in ["a"] + ["a"] * 10 + ["b"]:
+                    await simulator_llm.ainvoke(prompt)
+
+            asyncio.run(calls())
+            cache.close()
+        hedged = main.hedged_llm(simulator_llm)
+        # Ten hits in a row, then a miss: only the two misses reached the provider, once each
+        self.assertEqual(simulator.prompts, ["a", "b"])
+        self.assertEqual((len(hedged.tracker.samples), hedged.stats["calls"], hedged.stats["hedged"]), (2, 2, 0))
+        self.assertEqual(hedged.tracker.minimum_s, main.HEDGE_MINIMUM_S)
+
+    def test_hedged_duplicate_spends_its_own_quota(self):
+        simulator = SlowSimulator("回答", 0.2)
+        limits = ProviderLimits(requests_per_min=60, tokens_per_min=100000)
+        scheduler = LLMScheduler({"writer": ProviderLimits(), "simulator": limits}, clock=lambda: 0.0)
+        with patch.object(main, "build_models", return_value=(FakeWriter([]), simulator)):
+            _, simulator_llm = main.build_clients("w", "s", "system", None, scheduler,
+                                                  hedge={"writer": None, "simulator": None})
+        hedged = main.hedged_llm(simulator_llm)
+        hedged.tracker = self.tracker()
+        self.assertEqual(asyncio.run(simulator_llm.ainvoke("hi")).content, "回答")
+        state = scheduler.providers["simulator"]
+        # The primary and the duplicate each took a request from the bucket. The primary's tokens
+        # were corrected to its real usage; the cancelled duplicate keeps its full estimate
+        self.assertEqual((hedged.stats["hedged"], state.stats["duplicates"]), (1, 1))
+        self.assertEqual(state.requests.level, 58)
+        self.assertEqual(state.tokens.level, 100000 - (count_tokens("hi") + limits.expected_output_tokens)
+                         - (count_tokens("hi") + count_tokens("回答")))
+
+    def test_deadline_stops_an_article_whose_step_runs_over_budget(self):
+        writer = FakeWriter([
+            "<article>導入</article><prompt>プロンプト1</prompt>",
+            "<article>本文</article><finished>",
+        ])
+        with contextlib.redirect_stdout(io.StringIO()):
+            parts = asyncio.run(main.generate_article("テーマ", writer, SlowSimulator("回答", 5), max_steps=2,
+                                                      deadline=0.2))
+        self.assertEqual(parts, ["導入"])
+        self.assertEqual(len(writer.inputs), 1)
+
+
+class TestExport(unittest.TestCase):
+
+    ARTICLE = ("# タイトル\n\n導入の**段落**です。\n\n## 手順\n\n> 1. 一つ目\n>    - 詳細\n\n"
+               "```\n<prompt>\n```\n\n## まとめ\n\n- 項目\n")
+
+    def test_renders_markdown_blocks(self):
+        body = export.render_markdown(self.ARTICLE)
+        self.assertIn("<h1>タイトル</h1>", body)
+        self.assertIn("<strong>段落</strong>", body)
+        self.assertIn("<blockquote>\n<ol>\n<li><p>一つ目</p>\n<ul>\n<li>詳細</li>", body)
+        self.assertIn("<pre><code>&lt;prompt&gt;</code></pre>", body)
+        self.assertEqual(len(export.split_sections(self.ARTICLE)), 3)
+        # Quotes in alt text cannot close the attribute, and only safe link targets become live
+        inline = export.render_inline('![図" onerror="alert(1)](fig.png) [危険](javascript:alert) [参照](https://example.com)')
+        self.assertIn('<img src="fig.png" alt="図&quot; onerror=&quot;alert(1)">', inline)
+        self.assertIn("[危険](javascript:alert)", inline)
+        self.assertNotIn('href="javascript', inline)
+        self.assertIn('<a href="https://example.com">参照</a>', inline)
+        self.assertNotIn("<img", export.render_inline("![x](data:text/html,evil)"))
+
+    def test_only_changed_sections_are_rendered_again(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("flow_1", "flow_2"):
+                os.makedirs(os.path.join(tmp, name))
+                with open(os.path.join(tmp, name, export.FLOW_ARTICLE), "w", encoding="utf-8") as f:
+                    f.write(self.ARTICLE)
+            first = export.export_all([tmp], workers=2, pdf=False)
+            second = export.export_all([tmp], workers=1, pdf=False)
+
+            article = os.path.join(tmp, "flow_1", export.FLOW_ARTICLE)
+            with open(article, "a", encoding="utf-8") as f:
+                f.write("\n## 追記\n\n最後の段落\n")
+            third = export.export_article(article, pdf=False)
+            with open(os.path.join(tmp, "flow_1", "final_article.html"), encoding="utf-8") as f:
+                page = f.read()
+
+        self.assertEqual([(r["rendered"], r["html"]) for r in first], [(3, True), (3, True)])
+        self.assertEqual([(r["rendered"], r["html"]) for r in second], [(0, False), (0, False)])
+        self.assertEqual((third["sections"], third["rendered"], third["html"]), (4, 1, True))
+        self.assertIn("<title>タイトル</title>", page)
+        self.assertIn("<h2>追記</h2>", page)
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.now = 1000.0
+        self.queue = JobQueue(os.path.join(self.tmp.name, "jobs.sqlite3"), clock=lambda: self.now)
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp.cleanup()
+
+    def test_expired_lease_is_requeued_and_only_the_holder_completes(self):
+        self.assertEqual(self.queue.add(["朝の準備", "家計簿"]), [1, 2])
+        self.assertEqual(self.queue.add(["朝の準備"]), [])
+
+        first = self.queue.claim("w1", lease_s=60)
+        self.assertEqual((first["id"], first["attempts"]), (1, 1))
+        self.now += 30
+        self.queue.heartbeat(1, "w1", lease_s=60)
+        self.now += 61
+        # w1 stalled past its lease: the job goes to w2, and w1 can neither renew nor complete it
+        self.assertEqual(self.queue.claim("w2", lease_s=60)["id"], 1)
+        with self.assertRaises(LeaseLost):
+            self.queue.heartbeat(1, "w1")
+
+        stale = os.path.join(self.tmp.name, "stale.md")
+        fresh = os.path.join(self.tmp.name, "fresh.md")
+        for path, text in ((stale, "w1"), (fresh, "w2")):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        with self.assertRaises(LeaseLost):
+            self.queue.complete(1, "w1", stale)
+        final_path = self.queue.complete(1, "w2", fresh)
+        with open(final_path, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "w2")
+        self.assertEqual(self.queue.get(1)["attempts"], 2)
+
+        # The other job fails after its last attempt
+        job = self.queue.claim("w1")
+        for attempt in range(job["max_attempts"]):
+            self.queue.fail(job["id"], "w1", "boom")
+            job = self.queue.claim("w1") or job
+        status = self.queue.status()
+        self.assertEqual((status["queued"], status["leased"], status["done"], status["failed"]), (0, 0, 1, 1))
+        self.assertEqual(status["done_per_min"], 0.1)
+
+    def test_worker_resumes_from_the_previous_attempt_checkpoint(self):
+        self.queue.add(["朝の準備"])
+        job = self.queue.claim("crashed")
+        # The first attempt got one step in before its worker died
+        attempt_dir = os.path.join(self.queue.work_dir(job), "attempt-1")
+        os.makedirs(attempt_dir)
+        checkpoint = main.Checkpoint(main.checkpoint_path(os.path.join(attempt_dir, "article.md")))
+        initial = main.PROMPTS.assemble("initial", {"topic": "朝の準備"}).text
+        checkpoint.record(input=initial, article="# 導入", prompt="質問", finished=False, simulator_response="回答")
+        self.now += job["lease_expires"] - self.now + 1
+
+        writer = FakeWriter(["<article>まとめ</article><finished>"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            completed = asyncio.run(work(self.queue, "w2", writer, FakeSimulator(), lease_s=60, poll_s=0))
+        self.assertEqual(completed, 1)
+        self.assertEqual(len(writer.inputs), 1)
+        with open(self.queue.file_path(job), "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "# 導入\n\nまとめ")
+        self.assertFalse(os.path.exists(self.queue.work_dir(job)))
+        self.assertEqual(self.queue.get(job["id"])["state"], "done")
+
+    def test_workers_without_api_keys_stop_before_leasing(self):
+        self.queue.add(["朝の準備"])
+        path = os.path.join(self.tmp.name, "jobs.sqlite3")
+        with patch.dict(os.environ), contextlib.redirect_stdout(io.StringIO()) as out:
+            for name in ("OPENAI_API_KEY", "GOOGLE_API_KEY"):
+                os.environ.pop(name, None)
+            self.assertEqual(job_queue.main(["--queue", path, "worker", "-n", "1"]), 1)
+            limits = SimpleNamespace(no_cache=True, lease=60, poll=0, keep_polling=False, prompt_budget=None)
+            with self.assertRaises(SystemExit) as ctx:
+                job_queue.worker_process(path, "w1", limits)
+        self.assertEqual(ctx.exception.code, 1)
+        self.assertEqual(out.getvalue().count("API keys not found"), 2)
+        # The job was never leased, so no attempt was spent on it
+        self.assertEqual((self.queue.get(1)["state"], self.queue.get(1)["attempts"]), ("queued", 0))
+
+
+class TestService(unittest.TestCase):
+
+    def test_job_streams_events_and_reports_the_article(self):
+        from http.server import ThreadingHTTPServer
+        import threading
+
+        writer = FakeWriter(["<article># 導入</article><prompt>質問</prompt>",
+                             "<article>まとめ</article><finished>"])
+        with tempfile.TemporaryDirectory() as tmp:
+            service = ArticleService(writer, FakeSimulator(), tmp, concurrency=2)
+            httpd = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(service))
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{httpd.server_address[1]}"
+            try:
+                request = urllib.request.Request(url + "/articles", method="POST",
+                                                 data=json.dumps({"topic": "朝の準備"}).encode("utf-8"))
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    self.assertEqual(response.status, 202)
+                    created = json.load(response)
+                with urllib.request.urlopen(url + created["events"], timeout=5) as response:
+                    kinds = [line[len("event: "):] for line in response.read().decode("utf-8").splitlines()
+                             if line.startswith("event: ")]
+                with urllib.request.urlopen(url + created["status"], timeout=5) as response:
+                    status = json.load(response)
+                with urllib.request.urlopen(url + "/health", timeout=5) as response:
+                    health = json.load(response)
+                with self.assertRaises(urllib.error.HTTPError) as ctx:
+                    urllib.request.urlopen(url + "/articles", data=b'{"deadline": 5}', timeout=5)
+            finally:
+                httpd.shutdown()
+                httpd.server_close()
+                service.close()
+
+        self.assertEqual(kinds[:2], ["queued", "started"])
+        self.assertIn("delta", kinds)
+        self.assertEqual([kind for kind in kinds if kind in ("step", "done")], ["step", "step", "done"])
+        self.assertEqual((status["state"], status["steps"], status["article"]), ("done", 2, "# 導入\n\nまとめ"))
+        self.assertEqual(health["jobs"], {"done": 1})
+        self.assertEqual(ctx.exception.code, 400)
+
+    def test_restarted_service_does_not_reuse_file_names(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            earlier = main.article_filename("朝の準備", 1, tmp)
+            with open(earlier, "w", encoding="utf-8") as f:
+                f.write("前の記事")
+            with open(main.checkpoint_path(main.article_filename("締め切り", 2, tmp)), "w", encoding="utf-8") as f:
+                f.write("{}")
+            service = ArticleService(FakeWriter(["<article>新しい記事</article><finished>"]), FakeSimulator(), tmp)
+            try:
+                job = service.submit("朝の準備")
+                with job.changed:
+                    job.changed.wait_for(lambda: job.state in ("done", "failed"), timeout=5)
+            finally:
+                service.close()
+            with open(earlier, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "前の記事")
+        self.assertEqual((job.id, job.state), (3, "done"))
+        self.assertEqual(job.filename, main.article_filename("朝の準備", 3, tmp))
+
+
+class TestCli(unittest.TestCase):
+
+    def test_validate_checks_config_and_templates(self):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(cli.main(["validate"]), 0)
+        self.assertIn("config.json: phases", out.getvalue())
+
+        with open(os.path.join(cli.FLOW_DIR, "config.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        config["prompts"]["phase_1"] = config["prompts"]["phase_1"].replace("{problem_settings}", "{problem}")
+        del config["selectors"]["chatgpt"]["latest_response"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "config.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(config, f, ensure_ascii=False)
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                self.assertEqual(cli.main(["dry-run", "--config", path]), 1)
+        self.assertIn("FAIL config.json", out.getvalue())
+        self.assertIn("{problem}", out.getvalue())
+        self.assertIn("selectors.chatgpt.latest_response", out.getvalue())
+
+    def test_short_commands_do_not_import_the_sdks_or_playwright(self):
+        for name in ("import main", "cli validate", "import flow main"):
+            seconds, loaded = bench_startup.run_case(bench_startup.CASES[name], runs=1)
+            self.assertEqual(loaded, [], name)
+            # Importing the SDKs alone takes well over a second
+            self.assertLess(seconds, 1.0, name)
+
+
+class TestFakeLLMServer(unittest.TestCase):
+
+    def test_pipeline_runs_against_real_clients(self):
+        with FakeLLMServer(seed=0) as server:
+            env = {"GOOGLE_GEMINI_BASE_URL": server.url, "OPENAI_BASE_URL": server.url + "/v1",
+                   "GOOGLE_API_KEY": "fake", "OPENAI_API_KEY": "fake"}
+            with patch.dict(os.environ, env):
+                writer, simulator = main.build_chains("format")
+                parts = asyncio.run(main.generate_article("テーマ", writer, simulator))
+
+        self.assertEqual(len(parts), 3)
+        self.assertIn("## まとめ", parts[-1])
+        self.assertEqual(server.stats, {"gemini:200": 3, "openai:200": 2})
+
+    def test_scheduler_recovers_from_injected_429s(self):
+        async def no_sleep(seconds):
+            pass
+
+        with FakeLLMServer(seed=1, simulator=ProviderProfile(errors="429:0.5")) as server:
+            env = {"GOOGLE_GEMINI_BASE_URL": server.url, "OPENAI_BASE_URL": server.url + "/v1",
+                   "GOOGLE_API_KEY": "fake", "OPENAI_API_KEY": "fake"}
+            scheduler = LLMScheduler({"writer": ProviderLimits(), "simulator": ProviderLimits()},
+                                     attempts=10, sleep=no_sleep)
+            with patch.dict(os.environ, env), contextlib.redirect_stdout(io.StringIO()):
+                writer, simulator = main.build_chains("format", scheduler=scheduler)
+                parts = asyncio.run(main.generate_article("テーマ", writer, simulator))
+
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(server.stats["openai:200"], 2)
+        self.assertEqual(scheduler.providers["simulator"].stats["throttled"], server.stats.get("openai:429", 0))
+
+    def test_injected_errors_carry_retry_after(self):
+        with FakeLLMServer(simulator=ProviderProfile(errors="429:1.0")) as server:
+            request = urllib.request.Request(server.url + "/v1/chat/completions",
+                                             data=b'{"messages": []}', method="POST")
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                urllib.request.urlopen(request, timeout=5)
+
+        self.assertEqual(ctx.exception.code, 429)
+        self.assertEqual(ctx.exception.headers["Retry-After"], "1")
+        self.assertEqual(server.stats, {"openai:429": 1})
+
+    def test_latency_specs(self):
+        import random
+        rng = random.Random(0)
+        self.assertEqual(parse_latency("0.5")(rng), 0.5)
+        self.assertTrue(all(0.2 <= parse_latency("uniform:0.2:0.4")(rng) <= 0.4 for _ in range(100)))
+        self.assertTrue(all(parse_latency("normal:0:1")(rng) >= 0 for _ in range(100)))
+        with self.assertRaises(ValueError):
+            parse_latency("gamma:1:2")
+
+    def test_benchmark_percentiles_and_regression_check(self):
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        self.assertIsNone(percentile([], 50))
+
+        baseline = {"runs": [{"topics": 4, "concurrency": 2, "articles_per_min": 100.0}]}
+        slower = [{"topics": 4, "concurrency": 2, "articles_per_min": 70.0}]
+        steady = [{"topics": 4, "concurrency": 2, "articles_per_min": 85.0}]
+        self.assertEqual(len(compare(slower, baseline, 0.2)), 1)
+        self.assertEqual(compare(steady, baseline, 0.2), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,239 @@
+"""Timing spans for both entry points, written as JSONL, and a report over them.
+
+A span is one timed unit of work (an article, a Writer/Simulator step, a
+browser phase). When it ends it is appended as one JSON line:
+
+    {"run": ..., "span": ..., "parent": ..., "name": "writer", "start": <epoch>,
+     "wall_s": 3.2, "status": "ok", "ttft_s": 0.8, "tokens_in": 412, ...}
+
+Besides wall time, spans carry whatever their caller measured: time to first
+token, token and character counts, retry attempts and the time spent waiting
+for the operator, sleeping between retries, taking screenshots or writing
+files. Seconds end in "_s".
+
+    python tracing.py report articles/ human_assisted_flow/output/
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from prompt_budget import count_tokens
+
+TRACE_SUFFIX = "trace.jsonl"
+# Shown first in the report, in this order; any other numeric field follows
+REPORT_METRICS = ("wall_s", "ttft_s", "human_wait_s", "retry_sleep_s", "screenshot_s", "io_s",
+                  "tokens_in", "tokens_out", "retries")
+
+
+def percentile(values, p):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def text_stats(text, direction):
+    """{"chars_<direction>": ..., "tokens_<direction>": ...} for a prompt ("in") or response ("out")."""
+    text = text or ""
+    return {f"chars_{direction}": len(text), f"tokens_{direction}": count_tokens(text)}
+
+
+class Span:
+    """One timed unit of work; use as a context manager or call end()."""
+
+    def __init__(self, tracer, name, parent=None, **attrs):
+        self.tracer = tracer
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.parent = parent
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._ended = False
+        self.status = "ok"
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount):
+        """Accumulate a counter or a duration (e.g. several operator waits)."""
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def fail(self, error):
+        """Mark the span as failed without raising (the caller handled the error)."""
+        self.status = "error"
+        self.attrs["error"] = str(error)
+
+    def first_token(self):
+        """Record time to first token; later calls are ignored."""
+        if "ttft_s" not in self.attrs:
+            self.attrs["ttft_s"] = round(self.elapsed(), 4)
+
+    @contextmanager
+    def timed(self, key):
+        """Add the time spent in the block to attrs[key]."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(key, time.perf_counter() - started)
+
+    def child(self, name, **attrs):
+        return Span(self.tracer, name, self.id, **attrs)
+
+    def end(self, status=None, **attrs):
+        if self._ended:
+            return
+        self._ended = True
+        self.attrs.update(attrs)
+        self.tracer.write(self, status or self.status)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.end()
+        else:
+            # CancelledError, KeyboardInterrupt and GeneratorExit are not failures of the work itself
+            status = "error" if issubclass(exc_type, Exception) else "cancelled"
+            self.end(status, error=f"{exc_type.__name__}: {exc}")
+        return False
+
+
+class Tracer:
+    """Append finished spans to a JSONL file; with path=None nothing is written.
+
+    attrs (e.g. the topic) are copied into every span. Spans may end from
+    several threads or tasks at once.
+    """
+
+    def __init__(self, path, **attrs):
+        self.path = path
+        self.run = uuid.uuid4().hex[:12]
+        self.attrs = attrs
+        self._lock = threading.Lock()
+
+    def span(self, name, **attrs):
+        return Span(self, name, **attrs)
+
+    def write(self, span, status):
+        if not self.path:
+            return
+        record = {"run": self.run, "span": span.id, "parent": span.parent, "name": span.name,
+                  "start": round(span.started_at, 3), "wall_s": round(span.elapsed(), 4), "status": status,
+                  **self.attrs}
+        for key, value in span.attrs.items():
+            record[key] = round(value, 4) if isinstance(value, float) else value
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+def find_traces(paths):
+    """Trace files under the given files or directories (searched recursively)."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, "**", "*" + TRACE_SUFFIX), recursive=True)))
+        elif os.path.exists(path):
+            found.append(path)
+    return found
+
+
+def load_spans(files):
+    spans = []
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    spans.append(json.loads(line))
+    return spans
+
+
+def summarize(spans):
+    """Group spans by their "group" (or name) and compute n/p50/p95/total per metric.
+
+    Groups are ordered by when they first started, which follows the flow.
+    """
+    groups = {}
+    for span in sorted(spans, key=lambda s: s.get("start", 0)):
+        groups.setdefault(span.get("group") or span["name"], []).append(span)
+
+    summary = {}
+    for group, members in groups.items():
+        fields = [m for m in REPORT_METRICS if any(m in s for s in members)]
+        fields += sorted({key for s in members for key, value in s.items()
+                          if key not in fields and key not in ("start", "step", "attempt")
+                          and isinstance(value, (int, float)) and not isinstance(value, bool)})
+        metrics = {}
+        for field in fields:
+            values = [s[field] for s in members if isinstance(s.get(field), (int, float))]
+            metrics[field] = {"n": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+                              "total": round(sum(values), 4)}
+        summary[group] = {
+            "spans": len(members),
+            "runs": len({s.get("run") for s in members}),
+            "errors": sum(s.get("status", "ok") != "ok" for s in members),
+            "metrics": metrics,
+        }
+    return summary
+
+
+def format_report(summary):
+    def number(value):
+        if value is None:
+            return "-"
+        return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    lines = []
+    for group, entry in summary.items():
+        lines.append(f"\n== {group}  (spans {entry['spans']}, runs {entry['runs']}, errors {entry['errors']})")
+        lines.append(f"  {'metric':<16} {'n':>5} {'p50':>10} {'p95':>10} {'total':>12}")
+        for field, m in entry["metrics"].items():
+            lines.append(f"  {field:<16} {m['n']:>5} {number(m['p50']):>10} {number(m['p95']):>10} {number(m['total']):>12}")
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Aggregate trace.jsonl files into p50/p95 tables.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="Summarize spans per phase across runs.")
+    report.add_argument("paths", nargs="*", default=["."], help="Trace files or directories to search.")
+    report.add_argument("--name", action="append", help="Only spans with this name or group (repeatable).")
+    report.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    files = find_traces(args.paths)
+    spans = load_spans(files)
+    if args.name:
+        spans = [s for s in spans if s["name"] in args.name or s.get("group") in args.name]
+    if not spans:
+        print(f"No spans found in {len(files)} trace file(s).")
+        return 1
+    summary = summarize(spans)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print(f"{len(spans)} spans from {len(files)} trace file(s)")
+        print(format_report(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())